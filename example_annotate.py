@@ -7,6 +7,7 @@ from nalaf.utils.readers import TextFilesReader, PMIDReader
 from nalaf.utils.readers import StringReader
 from nalaf.utils.writers import ConsoleWriter, TagTogFormat, PubTatorFormat
 from nalaf.structures.dataset_pipelines import PrepareDatasetPipeline
+from nalaf.preprocessing.prefilters import MutationPrefilter
 from nalaf.learning.crfsuite import PyCRFSuite
 from nalaf.utils import PRO_CLASS_ID, MUT_CLASS_ID, PRO_REL_MUT_CLASS_ID
 from nalaf.learning.taggers import GNormPlusGeneTagger
@@ -28,6 +29,9 @@ if __name__ == "__main__":
     parser.add_argument('-f', '--file_format', help='the format for writing the output to a directory',
                         choices=['ann.json', 'pubtator'], default='ann.json')
 
+    parser.add_argument('--prefilter', help='skip the sentences without anything that looks like a mutation',
+                        action='store_true')
+
     group = parser.add_mutually_exclusive_group(required=True)
 
     group.add_argument('-s', '--string', help='string you want to predict for')
@@ -47,15 +51,19 @@ if __name__ == "__main__":
     else:
         raise FileNotFoundError('directory or file "{}" does not exist'.format(args.dir_or_file))
 
-    PrepareDatasetPipeline().execute(dataset)
+    pipeline = PrepareDatasetPipeline(prefilter=MutationPrefilter() if args.prefilter else None)
 
-    # get the predictions
+    # get the predictions, generating the features just in time for every batch of documents
     crf = PyCRFSuite()
-    crf.tag(dataset, pkg_resources.resource_filename('nalaf.data', 'example_entity_model'), class_id=MUT_CLASS_ID)
+    crf.tag_batches(dataset.batches(100), pkg_resources.resource_filename('nalaf.data', 'example_entity_model'),
+                    pipeline, class_id=MUT_CLASS_ID)
 
     GNormPlusGeneTagger().tag(dataset, uniprot=True)
     StubSameSentenceRelationExtractor(PRO_CLASS_ID, MUT_CLASS_ID, PRO_REL_MUT_CLASS_ID).tag(dataset)
 
+    # only the text, the annotations and the relations are written out
+    dataset.release('all')
+
     if args.output_dir:
         if not os.path.isdir(args.output_dir):
             raise NotADirectoryError('{} is not a directory'.format(args.output_dir))
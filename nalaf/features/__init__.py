@@ -25,6 +25,20 @@ class FeatureGenerator:
     * Be named [Name]FeatureGenerator
     * Implement the abstract method generate
     * Append new items to the dictionary field "features" of each Token in the dataset
+    * Set shardable = False if the generated features of a part depend on anything else than
+      that same part (e.g. other documents, an external file read sequentially, or a growing feature set)
+    """
+
+    shardable = True
+    """
+    whether generate() yields the same features when run separately on any subset of the documents,
+    which allows PrepareDatasetPipeline to cache or parallelize it per part
+    """
+
+    accumulated_state = ()
+    """
+    names of the attributes that accumulate state while generating (e.g. a growing feature set)
+    rather than configure the generator, left out of PrepareDatasetPipeline.fingerprint()
     """
 
     @abc.abstractmethod
@@ -34,6 +48,18 @@ class FeatureGenerator:
         """
         return
 
+    def merge(self, other):
+        """
+        Merges into this generator the state that a copy of it accumulated in a worker process
+        while generating features for a shard of the dataset (see PrepareDatasetPipeline.execute_parallel).
+        Called once per shard, in the (deterministic) order in which the shards were scheduled.
+
+        Only needs to be implemented by shardable generators that keep some state.
+
+        :type other: FeatureGenerator
+        """
+        return
+
 
 def eval_binary_feature(feature_dict, feature_name, evaluator, *args):
     """
@@ -49,3 +75,27 @@ def eval_binary_feature(feature_dict, feature_name, evaluator, *args):
     """
     if evaluator(*args):
         feature_dict[feature_name] = True
+
+
+def crfsuite_attributes(features):
+    """
+    Flattens a feature dictionary into the (attribute, weight) pairs that CRFsuite sees,
+    following the same conversion as pycrfsuite.ItemSequence:
+        * {name: str} -> ('name:str', 1.0)
+        * {name: float or bool} -> ('name', float)
+        * {name: dict or list or set} -> the nested attributes prefixed with 'name:'
+
+    :type features: dict
+    :rtype: collections.Iterable[(str, float)]
+    """
+    for key, value in features.items():
+        if isinstance(value, str):
+            yield key + ':' + value, 1.0
+        elif isinstance(value, dict):
+            for attribute, weight in crfsuite_attributes(value):
+                yield key + ':' + attribute, weight
+        elif isinstance(value, (list, set)):
+            for attribute in value:
+                yield key + ':' + attribute, 1.0
+        else:
+            yield key, float(value)
@@ -10,6 +10,10 @@ class NamedEntityCountFeatureGenerator(FeatureGenerator):
     :type feature_set: dict
     :type training_mode: bool
     """
+
+    shardable = False
+    accumulated_state = ('feature_set',)
+
     def __init__(self, entity_type, feature_set, training_mode=True):
         self.entity_type = entity_type
         """type of entity"""
@@ -37,6 +41,10 @@ class BagOfWordsFeatureGenerator(FeatureGenerator):
     :type feature_set: nalaf.structures.data.FeatureDictionary
     :type training_mode: bool
     """
+
+    shardable = False
+    accumulated_state = ('feature_set',)
+
     def __init__(self, feature_set, training_mode=True):
         self.feature_set = feature_set
         """the feature set for the dataset"""
@@ -69,6 +77,9 @@ class StemmedBagOfWordsFeatureGenerator(FeatureGenerator):
     :type training_mode: bool
     """
 
+    shardable = False
+    accumulated_state = ('feature_set',)
+
     def __init__(self, feature_set, training_mode=True):
         self.feature_set = feature_set
         """the feature set for the dataset"""
@@ -102,6 +113,10 @@ class OrderOfEntitiesFeatureGenerator(FeatureGenerator):
     :type feature_set: nalaf.structures.data.FeatureDictionary
     :type training_mode: bool
     """
+
+    shardable = False
+    accumulated_state = ('feature_set',)
+
     def __init__(self, feature_set, training_mode=True):
         self.feature_set = feature_set
         """the feature set for the dataset"""
@@ -132,6 +147,10 @@ class CapitalizedTokenFeatureGenerator(FeatureGenerator):
     :type feature_set: nalaf.structures.data.FeatureDictionary
     :type training_mode: bool
     """
+
+    shardable = False
+    accumulated_state = ('feature_set',)
+
     def __init__(self, feature_set, training_mode=True):
         self.feature_set = feature_set
         """the feature set for the dataset"""
@@ -174,6 +193,10 @@ class WordFilterFeatureGenerator(FeatureGenerator):
     :type stem: bool
     :type training_mode: bool
     """
+
+    shardable = False
+    accumulated_state = ('feature_set',)
+
     def __init__(self, feature_set, words, stem=True, training_mode=True):
         self.feature_set = feature_set
         """the feature set for the dataset"""
@@ -239,6 +262,10 @@ class NPChunkRootFeatureGenerator(FeatureGenerator):
     :type nlp: spacy.en.English
     :type training_mode: bool
     """
+
+    shardable = False
+    accumulated_state = ('feature_set',)
+
     def __init__(self, feature_set, nlp, training_mode=True):
         self.feature_set = feature_set
         """the feature set for the dataset"""
@@ -64,6 +64,9 @@ class ExternalPredictedLabelsFeatureGenerator(FeatureGenerator):
         * sequences are separated by an empty line
     """
 
+    shardable = False
+    """the input file is aligned with the sentences of the whole dataset"""
+
     def __init__(self, system_name, input_file, weight=1):
         self.weight = weight
         """
@@ -44,6 +44,9 @@ class BioLemmatizer(FeatureGenerator):
     Implements the abstract class FeatureGenerator.
     """
 
+    shardable = False
+    """the single java subprocess would be shared by the forked workers, which would interleave its lemmas"""
+
     @staticmethod
     def __setNonBlocking(fd):
         """
@@ -1,7 +1,19 @@
 import os
 import sys
-from nalaf.structures.data import Label
+import copy
+import json
+import time
+import hashlib
+from collections import OrderedDict
+import struct
+import threading
+import multiprocessing
+from array import array
+from nalaf.structures.data import Dataset, Label
+from nalaf.features import crfsuite_attributes
+from nalaf.utils.scheduling import LengthBucketedScheduler
 from nalaf.utils import MUT_CLASS_ID
+from nalaf import print_verbose
 import warnings
 
 
@@ -10,41 +22,1091 @@ class PyCRFSuite:
         pass
 
     @staticmethod
-    def train(data, model_file, params = None):
+    def train(data, model_file, params = None, selection=None, release=False):
         """
         :type data: nalaf.structures.data.Dataset
         :type model_file: str
+        :param selection: optional feature selection, fitted on the data if it is not yet, see train_stream()
+        :type selection: FeatureSelection
+        :param release: release the features of the tokens once they are copied into the trainer,
+            i.e. before the actual training, see Dataset.release()
+        :type release: bool
         """
+        if selection is not None and selection.vocabulary is None:
+            selection.fit(PyCRFSuite.sentence_sequences(data))
+
+        def sequences():
+            yield from PyCRFSuite.sentence_sequences(data)
+            if release:
+                data.release('features')
+
+        PyCRFSuite.train_stream(sequences(), model_file, params, selection)
+
+    @staticmethod
+    def train_stream(sequences, model_file, params = None, selection=None):
+        """
+        Trains incrementally from an iterable of (feature sequence, label sequence) pairs,
+        so that only what the iterable keeps in memory at a time (e.g. one batch of documents)
+        is needed, plus the sequences already copied into the trainer.
+
+        If a (fitted) feature selection is given, only its vocabulary is used for training.
+        The vocabulary is saved next to the model (see FeatureSelection.vocabulary_file).
+        Tagging needs no filtering, since CRFsuite ignores the attributes the model was not trained with,
+        but warns about the sentences with no attribute of the vocabulary at all (see TaggerPool.tag_sentences).
+
+        :param sequences: iterable of (list[dict], list[str]), see labelled_sequences() and CompiledTrainingSet
+        :type model_file: str
+        :type selection: FeatureSelection
+        """
+        if selection is not None and selection.vocabulary is None:
+            raise ValueError('the feature selection is not fitted, see FeatureSelection.fit()')
+
         from pycrfsuite import Trainer, ItemSequence
         trainer = Trainer()
         if params is not None:
             trainer.set_params(params)
 
-        for sentence in data.sentences():
-            trainer.append(ItemSequence([token.features for token in sentence]),
-                           [token.original_labels[0].value for token in sentence])
+        # written before the model, so that the taggers reopened for the new model read the new vocabulary
+        vocabulary_file = FeatureSelection.vocabulary_file(model_file)
+        if selection is not None:
+            selection.save(vocabulary_file)
+            sequences = selection.select(sequences)
+        elif os.path.exists(vocabulary_file):
+            os.remove(vocabulary_file)
+
+        for features, labels in sequences:
+            trainer.append(ItemSequence(features), labels)
 
         trainer.train(model_file)
 
     @staticmethod
-    def tag(data, model_file, class_id = MUT_CLASS_ID):
+    def sentence_sequences(data):
+        """
+        :type data: nalaf.structures.data.Dataset
+        :returns iterator of (feature sequence, label sequence) for each sentence of an already labelled dataset,
+            except for the sentences skipped by a prefilter
+        """
+        for sentence in _split_prefiltered(data.parts())[0]:
+            yield [token.features for token in sentence], [token.original_labels[0].value for token in sentence]
+
+    @staticmethod
+    def labelled_sequences(batches, pipeline, labeler, filter_batch=None):
+        """
+        Generator of (feature sequence, label sequence) pairs that prepares and labels one batch of documents
+        at a time and frees the tokens (and their features) of a batch once all of its sentences were consumed.
+
+        Example: PyCRFSuite.train_stream(PyCRFSuite.labelled_sequences(dataset.batches(100), pipeline, labeler), ...)
+
+        :param batches: iterable of datasets, e.g. Dataset.batches() or (reader.read() for reader in readers)
+        :type batches: collections.Iterable[nalaf.structures.data.Dataset]
+        :type pipeline: nalaf.structures.dataset_pipelines.PrepareDatasetPipeline
+        :type labeler: nalaf.preprocessing.labelers.Labeler
+        :param filter_batch: optional callable applied to each labelled batch, e.g. Dataset.prune_filtered_sentences
+        """
+        for batch in batches:
+            pipeline.execute(batch)
+            labeler.label(batch)
+            if filter_batch is not None:
+                filter_batch(batch)
+
+            yield from PyCRFSuite.sentence_sequences(batch)
+
+            batch.release(('sentences', 'tokens'))
+
+    @staticmethod
+    def tag(data, model_file, class_id = MUT_CLASS_ID, workers=1, memo=None, release=False):
         """
         :type data: nalaf.structures.data.Dataset
         :type model_file: str
+        :param workers: number of processes to shard the documents across, see tag_parallel()
+        :type workers: int
+        :param memo: optional memo to decode sentences with identical features only once
+        :type memo: TaggingMemo
+        :param release: release the features of the tokens once tagged, see Dataset.release()
+        :type release: bool
+
+        The sentences skipped by a prefilter (see Part.prefiltered_sentences) are labeled 'O' without decoding.
         """
-        from pycrfsuite import Tagger, ItemSequence
-        tagger = Tagger()
-        tagger.open(model_file)
+        if workers > 1:
+            PyCRFSuite.tag_parallel(data, model_file, class_id, workers, memo)
+            if release:
+                data.release('features')
+            return
 
-        for sentence in data.sentences():
-            labels = tagger.tag(ItemSequence(token.features for token in sentence))
+        sentences, skipped = _split_prefiltered(data.parts())
+        _label_outside(skipped)
+        results = TaggerPool.get(model_file).tag_sentences(([token.features for token in sentence]
+                                                            for sentence in sentences), memo)
 
-            for token_index in range(len(sentence)):
-                label = labels[token_index]
-                sentence[token_index].predicted_labels = [Label(label, tagger.marginal(label, token_index))]
+        for sentence, (labels, marginals) in zip(sentences, results):
+            for token, label, marginal in zip(sentence, labels, marginals):
+                token.predicted_labels = [Label(label, marginal)]
 
         data.form_predicted_annotations(class_id)
 
+        if release:
+            data.release('features')
+
+    @staticmethod
+    def tag_batches(batches, model_file, pipeline, class_id = MUT_CLASS_ID, memo=None, accumulator=None,
+                    release=None):
+        """
+        Tags one batch of documents at a time, generating the features of each batch just in time
+        and clearing them (but keeping the tokens and their predicted labels) as soon as the batch is tagged,
+        so that the features of only one batch are in memory at a time.
+
+        Example: PyCRFSuite.tag_batches(dataset.batches(100), model_file, PrepareDatasetPipeline())
+
+        The non-shardable feature generators of the pipeline only see one batch at a time.
+
+        :param batches: iterable of datasets, e.g. Dataset.batches()
+        :type batches: collections.Iterable[nalaf.structures.data.Dataset]
+        :type model_file: str
+        :type pipeline: nalaf.structures.dataset_pipelines.PrepareDatasetPipeline
+        :type memo: TaggingMemo
+        :param accumulator: optional accumulator that evaluates every batch as soon as it is tagged
+        :type accumulator: nalaf.learning.evaluators.EvaluationAccumulator
+        :param release: optional further stages to release from every batch once it is tagged and evaluated
+            (see Dataset.release), e.g. 'all' when only the predicted annotations and the evaluation are needed
+        :type release: str | collections.Iterable[str]
+        """
+        for batch in batches:
+            pipeline.execute(batch)
+            PyCRFSuite.tag(batch, model_file, class_id, memo=memo, release=True)
+            if accumulator is not None:
+                accumulator.add(batch)
+            if release is not None:
+                batch.release(release)
+
+    @staticmethod
+    def tag_parallel(data, model_file, class_id = MUT_CLASS_ID, workers=2, memo=None):
+        """
+        Same as tag() but the documents are sharded (see LengthBucketedScheduler) across forked worker processes,
+        each with its own tagger (preloaded in this process and shared copy-on-write).
+        The workers send back compact per-sentence label ids and confidences, which are written into
+        the predicted_labels of the tokens, and the predicted annotations are formed shard by shard.
+        The results are identical to the ones of tag().
+
+        If a memo is given, every worker continues with its own copy of it,
+        and their hits and misses are added up into the given memo.
+
+        Requires the 'fork' start method (i.e. a POSIX system); otherwise it falls back to tag().
+
+        :type data: nalaf.structures.data.Dataset
+        :type model_file: str
+        :type workers: int
+        :type memo: TaggingMemo
+        """
+        global _shared_tagging_input
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            warnings.warn('parallel tagging requires the fork start method, tagging serially')
+            return PyCRFSuite.tag(data, model_file, class_id, memo=memo)
+
+        pool = TaggerPool.get(model_file)
+        pool.tagger()  # preload before forking
+        _shared_tagging_input = (data, pool, memo)
+
+        try:
+            scheduler = LengthBucketedScheduler(workers)
+            with multiprocessing.get_context('fork').Pool(workers) as process_pool:
+                for chunk, (label_names, results, memo_counts) in scheduler.imap(
+                        process_pool, _tag_documents, list(data.documents.items()), keys_only=True):
+                    if memo is not None:
+                        memo.hits += memo_counts[0]
+                        memo.misses += memo_counts[1]
+
+                    shard = Dataset()
+                    for (doc_id, document), document_results in zip(chunk, results):
+                        sentences, skipped = _split_prefiltered(document)
+                        _label_outside(skipped)
+                        for sentence, (label_ids, confidences) in zip(sentences, document_results):
+                            for token, label_id, confidence in zip(sentence, label_ids, confidences):
+                                token.predicted_labels = [Label(label_names[label_id], confidence)]
+                        shard.documents[doc_id] = document
+
+                    shard.form_predicted_annotations(class_id)
+        finally:
+            _shared_tagging_input = None
+
+
+_shared_tagging_input = None
+"""(dataset, tagger pool, memo) inherited by the forked workers of PyCRFSuite.tag_parallel"""
+
+
+def _tag_documents(doc_ids):
+    """
+    Runs in a worker process of PyCRFSuite.tag_parallel
+
+    :returns the label names, for each sentence of each document the label ids and the confidences
+        as compact arrays, and the (hits, misses) of the memo while tagging these documents
+    """
+    data, pool, memo = _shared_tagging_input
+    memo_counts = (memo.hits, memo.misses) if memo is not None else (0, 0)
+    label_names = pool.tagger().labels()
+    label_ids = {label: index for index, label in enumerate(label_names)}
+
+    results = []
+    for doc_id in doc_ids:
+        document = data.documents[doc_id]
+        tagged = pool.tag_sentences(([token.features for token in sentence]
+                                     for sentence in _split_prefiltered(document)[0]), memo)
+        results.append([(array('H', (label_ids[label] for label in labels)), array('d', marginals))
+                        for labels, marginals in tagged])
+
+    if memo is not None:
+        memo_counts = (memo.hits - memo_counts[0], memo.misses - memo_counts[1])
+    return label_names, results, memo_counts
+
+
+def _split_prefiltered(parts):
+    """
+    :type parts: collections.Iterable[nalaf.structures.data.Part]
+    :returns the sentences to decode and the sentences skipped by a prefilter (see Part.prefiltered_sentences)
+    :rtype: (list[list[nalaf.structures.data.Token]], list[list[nalaf.structures.data.Token]])
+    """
+    sentences, skipped = [], []
+    for part in parts:
+        for index, sentence in enumerate(part.sentences):
+            (skipped if index in part.prefiltered_sentences else sentences).append(sentence)
+    return sentences, skipped
+
+
+def _label_outside(sentences):
+    for sentence in sentences:
+        for token in sentence:
+            token.predicted_labels = [Label('O', 1.0)]
+
+
+class TaggerPool:
+    """
+    Keeps opened pycrfsuite Taggers for a model file, one per thread (pycrfsuite Taggers cannot be shared
+    across threads), so that repeated tagging requests do not pay the cost of opening the model each time.
+
+    Get the (process-wide) pool of a model with TaggerPool.get(model_file).
+
+    To share a model across worker processes, call TaggerPool.preload(model_file) before forking them:
+    the forked workers then reuse the tagger opened in the parent and its memory pages are shared copy-on-write.
+
+    If the model file changes on disk (e.g. it is retrained), the taggers are transparently reopened.
+
+    The pools stay open until TaggerPool.close(model_file) (e.g. before deleting a temporary model)
+    or TaggerPool.clear() is called.
+
+    :type model_file: str
+    """
+
+    _pools = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_file):
+        self.model_file = model_file
+        """path to the binary model"""
+        self._local = threading.local()
+
+    @staticmethod
+    def get(model_file):
+        """
+        :type model_file: str
+        :rtype: TaggerPool
+        """
+        model_file = os.path.abspath(model_file)
+        with TaggerPool._lock:
+            pool = TaggerPool._pools.get(model_file)
+            if pool is None:
+                pool = TaggerPool._pools[model_file] = TaggerPool(model_file)
+        return pool
+
+    @staticmethod
+    def preload(*model_files):
+        """
+        Opens the taggers of the given models in the current thread.
+        """
+        for model_file in model_files:
+            TaggerPool.get(model_file).tagger()
+
+    @staticmethod
+    def close(model_file):
+        """
+        Forgets the pool of the given model and closes its tagger in the current thread
+        (the taggers of the other threads are freed along with the pool).
+        """
+        with TaggerPool._lock:
+            pool = TaggerPool._pools.pop(os.path.abspath(model_file), None)
+        if pool is not None:
+            pool._close()
+
+    @staticmethod
+    def clear():
+        """
+        Forgets the pools of all the models and closes their taggers in the current thread.
+        """
+        with TaggerPool._lock:
+            pools = list(TaggerPool._pools.values())
+            TaggerPool._pools.clear()
+        for pool in pools:
+            pool._close()
+
+    def _close(self):
+        tagger = getattr(self._local, 'tagger', None)
+        if tagger is not None:
+            tagger.close()
+        self._local = threading.local()
+
+    def _model_signature(self):
+        stat = os.stat(self.model_file)
+        try:
+            vocabulary_stat = os.stat(FeatureSelection.vocabulary_file(self.model_file))
+            vocabulary_signature = vocabulary_stat.st_mtime_ns, vocabulary_stat.st_size
+        except FileNotFoundError:
+            vocabulary_signature = None
+        return stat.st_mtime_ns, stat.st_size, vocabulary_signature
+
+    def tagger(self):
+        """
+        :returns the opened tagger of the current thread
+        :rtype: pycrfsuite.Tagger
+        """
+        signature = self._model_signature()
+        if getattr(self._local, 'signature', None) != signature:
+            from pycrfsuite import Tagger
+            tagger = Tagger()
+            tagger.open(self.model_file)
+            self._local.tagger = tagger
+            self._local.vocabulary = FeatureSelection.load_vocabulary(self.model_file)
+            self._local.signature = signature
+        return self._local.tagger
+
+    def vocabulary(self):
+        """
+        :returns the attributes the model was trained with, if a feature selection was used, otherwise None
+        :rtype: set[str]
+        """
+        self.tagger()
+        return self._local.vocabulary
+
+    def tag_sentences(self, batch, memo=None):
+        """
+        Warns if the model was trained with a feature selection and some sentences have none of its attributes.
+
+        :param batch: iterable of feature sequences, one per sentence (each a list of feature dicts)
+        :param memo: optional memo to reuse the results of sentences with identical features
+        :type memo: TaggingMemo
+        :returns for each sentence the predicted labels and the marginal probability of each of them
+        :rtype: list[(list[str], list[float])]
+        """
+        from pycrfsuite import ItemSequence
+        tagger = self.tagger()
+        vocabulary = self._local.vocabulary
+        results = []
+        unknown = 0
+        for features in batch:
+            if vocabulary is not None and features and not any(
+                    attribute in vocabulary for item in features for attribute, _ in crfsuite_attributes(item)):
+                unknown += 1
+            if memo is None:
+                labels = tagger.tag(ItemSequence(features))
+                results.append((labels, [tagger.marginal(label, index) for index, label in enumerate(labels)]))
+            else:
+                key = memo.key(features)
+                result = memo.get(key)
+                if result is None:
+                    labels = tagger.tag(ItemSequence(features))
+                    result = (labels, [tagger.marginal(label, index) for index, label in enumerate(labels)])
+                    memo.put(key, result)
+                results.append(result)
+
+        if unknown:
+            warnings.warn('{} of {} sentences have no attribute in the vocabulary of {}, were they prepared '
+                          'with the pipeline of the training set?'.format(unknown, len(results), self.model_file))
+        return results
+
+
+class TaggingMemo:
+    """
+    Bounded LRU memo of tagging results (labels and marginals) of whole sentences,
+    keyed by a fixed-size digest of their feature sequence as seen by CRFsuite (see crfsuite_attributes),
+    so that the memo does not keep a copy of the features of every remembered sentence.
+
+    Sentences with identical features get identical results, so corpora full of repeated sentences
+    (boilerplate of structured abstracts, copyright lines, duplicated records, ...) are decoded only once
+    per distinct sentence. Note that the results are shared, i.e. must not be modified.
+
+    With PyCRFSuite.tag_parallel every worker process fills its own copy of the memo, which is discarded
+    afterwards (only its hits and misses are added to the given memo), i.e. what the workers remember
+    does not persist across parallel calls.
+
+    :type maxsize: int
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        """maximum number of sentences to remember"""
+        self.hits = 0
+        self.misses = 0
+        self._memo = OrderedDict()
+
+    @staticmethod
+    def key(features):
+        """
+        :param features: feature sequence of a sentence
+        :returns the 16 bytes blake2b digest of the attributes of every item
+        :rtype: bytes
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for item_features in features:
+            digest.update('\x00'.join('{}\x1f{!r}'.format(attribute, weight)
+                                       for attribute, weight in crfsuite_attributes(item_features)).encode('utf-8'))
+            digest.update(b'\x01')
+        return digest.digest()
+
+    def get(self, key):
+        result = self._memo.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._memo.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self._memo[key] = result
+        if len(self._memo) > self.maxsize:
+            self._memo.popitem(last=False)
+
+    def __len__(self):
+        return len(self._memo)
+
+    def __repr__(self):
+        return 'TaggingMemo(size: {}, hits: {}, misses: {})'.format(len(self), self.hits, self.misses)
+
+
+class FeatureSelection:
+    """
+    Selects the attributes (see crfsuite_attributes) a CRF is trained with, based on their frequency
+    in the training set, to drop the rare features (hapax words, far window features, ...)
+    that dominate the feature space, the training time and the size of the model.
+
+    * First fit() counts in one pass every attribute and how often it occurs with each label
+    * Attributes that occur less than min_count times are dropped
+    * Optionally only the top_k attributes are kept, ranked by frequency
+      or by association with the labels (the maximum chi-squared statistic over the labels)
+
+    The retained vocabulary is saved next to the model by PyCRFSuite.train_stream() (see TaggerPool.vocabulary).
+    The features are not filtered again when tagging: CRFsuite already ignores the attributes
+    the model was not trained with, so the results are the same. The vocabulary is only used to warn
+    about sentences with none of its attributes, a sign that they were not prepared like the training set.
+
+    :type min_count: int
+    :type top_k: int
+    :type ranking: str
+    """
+
+    RANKINGS = ('frequency', 'association')
+
+    def __init__(self, min_count=1, top_k=None, ranking='frequency'):
+        if ranking not in FeatureSelection.RANKINGS:
+            raise ValueError('ranking must be one of {}'.format(FeatureSelection.RANKINGS))
+        self.min_count = min_count
+        """minimum number of occurrences of a kept attribute"""
+        self.top_k = top_k
+        """optional maximum number of kept attributes"""
+        self.ranking = ranking
+        """how the attributes are ranked for top_k: 'frequency' or 'association' """
+        self.vocabulary = None
+        """the set of kept attributes, once fitted"""
+
+    def fit(self, sequences):
+        """
+        :param sequences: iterable of (feature sequence, label sequence), e.g. PyCRFSuite.sentence_sequences()
+        :returns self
+        :rtype: FeatureSelection
+        """
+        counts = {}
+        label_counts = {}
+        joint_counts = {}
+        items = 0
+        for features, labels in sequences:
+            for item_features, label in zip(features, labels):
+                items += 1
+                label_counts[label] = label_counts.get(label, 0) + 1
+                for attribute, _ in crfsuite_attributes(item_features):
+                    counts[attribute] = counts.get(attribute, 0) + 1
+                    if self.ranking == 'association':
+                        key = (attribute, label)
+                        joint_counts[key] = joint_counts.get(key, 0) + 1
+
+        candidates = [attribute for attribute, count in counts.items() if count >= self.min_count]
+
+        if self.top_k is not None and len(candidates) > self.top_k:
+            if self.ranking == 'frequency':
+                scores = counts
+            else:
+                scores = {attribute: max(_chi_squared(joint_counts.get((attribute, label), 0), counts[attribute],
+                                                      label_count, items)
+                                         for label, label_count in label_counts.items())
+                          for attribute in candidates}
+            # ties broken by name, to be deterministic
+            candidates = sorted(candidates, key=lambda attribute: (-scores[attribute], attribute))[:self.top_k]
+
+        self.vocabulary = set(candidates)
+        print_verbose('Feature selection kept {} of {} attributes'.format(len(self.vocabulary), len(counts)))
+        return self
+
+    def select(self, sequences):
+        """
+        :param sequences: iterable of (feature sequence, label sequence)
+        :returns iterator of the same sequences with only the attributes of the vocabulary
+        """
+        if self.vocabulary is None:
+            raise ValueError('the feature selection is not fitted, see FeatureSelection.fit()')
+
+        vocabulary = self.vocabulary
+        return (([{attribute: weight for attribute, weight in crfsuite_attributes(item_features)
+                   if attribute in vocabulary}
+                  for item_features in features], labels)
+                for features, labels in sequences)
+
+    @staticmethod
+    def vocabulary_file(model_file):
+        """
+        :returns the file with the vocabulary of a model
+        :rtype: str
+        """
+        return model_file + '.vocabulary'
+
+    def save(self, file_name):
+        with open(file_name, 'w', encoding='utf-8') as file:
+            json.dump({'min_count': self.min_count, 'top_k': self.top_k, 'ranking': self.ranking,
+                       'vocabulary': sorted(self.vocabulary)}, file)
+
+    @staticmethod
+    def load(file_name):
+        """
+        :rtype: FeatureSelection
+        """
+        with open(file_name, encoding='utf-8') as file:
+            saved = json.load(file)
+        selection = FeatureSelection(saved['min_count'], saved['top_k'], saved['ranking'])
+        selection.vocabulary = set(saved['vocabulary'])
+        return selection
+
+    @staticmethod
+    def load_vocabulary(model_file):
+        """
+        :returns the vocabulary saved next to the model, or None if the model was trained without feature selection
+        :rtype: set[str]
+        """
+        vocabulary_file = FeatureSelection.vocabulary_file(model_file)
+        if os.path.exists(vocabulary_file):
+            return FeatureSelection.load(vocabulary_file).vocabulary
+        return None
+
+
+def _chi_squared(joint, attribute_count, label_count, total):
+    """
+    :returns the chi-squared statistic of the 2x2 contingency table of an attribute and a label
+    :rtype: float
+    """
+    denominator = attribute_count * label_count * (total - attribute_count) * (total - label_count)
+    if denominator == 0:
+        return 0.0
+    return total * (joint * total - attribute_count * label_count) ** 2 / denominator
+
+
+class CompiledTrainingSet:
+    """
+    Compact, binary representation of a labelled and featurized training set for CRFsuite.
+    Attribute names and labels are interned into integer ids and all sequences are stored in flat arrays,
+    so that it can be saved once and loaded for repeated training runs (e.g. when tuning c1/c2)
+    without going through Dataset and Token objects:
+
+        compiled = CompiledTrainingSet.compile(PyCRFSuite.sentence_sequences(dataset), pipeline.fingerprint())
+        compiled.save('train.bin')
+        ...
+        compiled = CompiledTrainingSet.load('train.bin', pipeline.fingerprint())
+        PyCRFSuite.train_stream(compiled, 'model', params)
+
+    The fingerprint of the pipeline (and anything else that determines the features, e.g. the labeler)
+    is stored in the file, and load() refuses to return a compiled set with a different one.
+
+    :type fingerprint: str
+    :type labels: list[str]
+    :type attributes: list[str]
+    """
+
+    MAGIC = b'NALAFCRF'
+    VERSION = 1
+    _ARRAYS = (('sequence_lengths', 'I'), ('item_lengths', 'I'), ('attribute_ids', 'I'),
+               ('weights', 'd'), ('label_ids', 'I'))
+
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint
+        """identifies the configuration that generated the features"""
+        self.labels = []
+        """label of every label id"""
+        self.attributes = []
+        """attribute name of every attribute id"""
+        self._label_ids = {}
+        self._attribute_ids = {}
+        self.sequence_lengths = array('I')
+        self.item_lengths = array('I')
+        self.attribute_ids = array('I')
+        self.weights = array('d')
+        self.label_ids = array('I')
+
+    @staticmethod
+    def compile(sequences, fingerprint=None):
+        """
+        :param sequences: iterable of (feature sequence, label sequence), e.g. PyCRFSuite.sentence_sequences()
+        :type fingerprint: str
+        :rtype: CompiledTrainingSet
+        """
+        compiled = CompiledTrainingSet(fingerprint)
+        for features, labels in sequences:
+            compiled.append(features, labels)
+        return compiled
+
+    def append(self, features, labels):
+        """
+        :type features: list[dict]
+        :type labels: list[str]
+        """
+        self.sequence_lengths.append(len(labels))
+        for item_features, label in zip(features, labels):
+            item_length = 0
+            for attribute, weight in crfsuite_attributes(item_features):
+                attribute_id = self._attribute_ids.get(attribute)
+                if attribute_id is None:
+                    attribute_id = self._attribute_ids[attribute] = len(self.attributes)
+                    self.attributes.append(attribute)
+                self.attribute_ids.append(attribute_id)
+                self.weights.append(weight)
+                item_length += 1
+            self.item_lengths.append(item_length)
+
+            label_id = self._label_ids.get(label)
+            if label_id is None:
+                label_id = self._label_ids[label] = len(self.labels)
+                self.labels.append(label)
+            self.label_ids.append(label_id)
+
+    def __len__(self):
+        return len(self.sequence_lengths)
+
+    def __iter__(self):
+        """
+        :returns iterator of (feature sequence, label sequence) as accepted by pycrfsuite.Trainer.append
+        """
+        return self.select()
+
+    def select(self, keep=None):
+        """
+        Same as iterating but only with the attributes for which keep(attribute) is true,
+        e.g. to try out a smaller window of features without compiling the training set again.
+
+        :param keep: optional callable that receives an attribute name (see crfsuite_attributes)
+        :returns iterator of (feature sequence, label sequence) as accepted by pycrfsuite.Trainer.append
+        """
+        attributes, labels = self.attributes, self.labels
+        attribute_ids, weights = self.attribute_ids, self.weights
+        kept = None if keep is None else [keep(attribute) for attribute in attributes]
+        item_lengths = iter(self.item_lengths)
+        label_ids = iter(self.label_ids)
+        position = 0
+
+        for sequence_length in self.sequence_lengths:
+            features = []
+            sequence_labels = []
+            for _ in range(sequence_length):
+                end = position + next(item_lengths)
+                if kept is None:
+                    features.append({attributes[attribute_ids[index]]: weights[index]
+                                     for index in range(position, end)})
+                else:
+                    features.append({attributes[attribute_ids[index]]: weights[index]
+                                     for index in range(position, end) if kept[attribute_ids[index]]})
+                sequence_labels.append(labels[next(label_ids)])
+                position = end
+            yield features, sequence_labels
+
+    def save(self, file_name):
+        header = json.dumps({
+            'fingerprint': self.fingerprint,
+            'labels': self.labels,
+            'attributes': self.attributes,
+            'lengths': [len(getattr(self, name)) for name, _ in CompiledTrainingSet._ARRAYS]
+        }).encode('utf-8')
+
+        with open(file_name, 'wb') as file:
+            file.write(CompiledTrainingSet.MAGIC)
+            file.write(struct.pack('<IQ', CompiledTrainingSet.VERSION, len(header)))
+            file.write(header)
+            for name, _ in CompiledTrainingSet._ARRAYS:
+                values = getattr(self, name)
+                if sys.byteorder == 'big':
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(file)
+
+    @staticmethod
+    def load(file_name, fingerprint=None):
+        """
+        :param fingerprint: if given, the fingerprint the compiled set must have been created with
+        :raises ValueError: if the file is not a compiled training set or it is stale
+        :rtype: CompiledTrainingSet
+        """
+        with open(file_name, 'rb') as file:
+            if file.read(len(CompiledTrainingSet.MAGIC)) != CompiledTrainingSet.MAGIC:
+                raise ValueError('{} is not a compiled training set'.format(file_name))
+            version, header_length = struct.unpack('<IQ', file.read(struct.calcsize('<IQ')))
+            if version != CompiledTrainingSet.VERSION:
+                raise ValueError('{} has an unsupported version {}'.format(file_name, version))
+            header = json.loads(file.read(header_length).decode('utf-8'))
+
+            if fingerprint is not None and header['fingerprint'] != fingerprint:
+                raise ValueError('{} is stale: it was compiled with fingerprint {} but {} is expected'.format(
+                    file_name, header['fingerprint'], fingerprint))
+
+            compiled = CompiledTrainingSet(header['fingerprint'])
+            compiled.labels = header['labels']
+            compiled.attributes = header['attributes']
+            compiled._label_ids = {label: index for index, label in enumerate(compiled.labels)}
+            compiled._attribute_ids = {attribute: index for index, attribute in enumerate(compiled.attributes)}
+
+            for (name, typecode), length in zip(CompiledTrainingSet._ARRAYS, header['lengths']):
+                values = array(typecode)
+                values.fromfile(file, length)
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                setattr(compiled, name, values)
+
+        return compiled
+
+
+class CRFSuiteModel:
+    """
+    The weights of a binary CRFsuite (crf1d) model file, as written by PyCRFSuite.train,
+    read and written directly in the CRFsuite format (the text dump of pycrfsuite rounds the weights),
+    e.g. to compact a model:
+
+        CRFSuiteModel.read('model').compact(threshold=0.01).write('model.compact')
+
+    :type labels: list[str]
+    :type attributes: list[str]
+    :type features: list[(int, int, int, float)]
+    """
+
+    MAGIC = b'lCRF'
+    TYPE = b'FOMC'
+    VERSION = 100
+    _HEADER = struct.Struct('<4sI4s9I')
+    _CHUNK = struct.Struct('<4sII')
+    _FEATURE = struct.Struct('<IIId')
+    STATE, TRANSITION = 0, 1
+
+    def __init__(self, labels, attributes, features):
+        self.labels = labels
+        """the name of every label id"""
+        self.attributes = attributes
+        """the name of every attribute id"""
+        self.features = features
+        """
+        (type, source, destination label id, weight) of every feature, where the type is either
+        STATE (the source is an attribute id) or TRANSITION (the source is a label id)
+        """
+
+    def __len__(self):
+        return len(self.features)
+
+    @staticmethod
+    def read(model_file):
+        """
+        :type model_file: str
+        :rtype: CRFSuiteModel
+        """
+        with open(model_file, 'rb') as file:
+            buffer = file.read()
+
+        magic, _, model_type, version, _, _, _, off_features, off_labels, off_attributes, _, _ = \
+            CRFSuiteModel._HEADER.unpack_from(buffer)
+        if magic != CRFSuiteModel.MAGIC or model_type != CRFSuiteModel.TYPE or version != CRFSuiteModel.VERSION:
+            raise ValueError('{} is not a CRFsuite crf1d model'.format(model_file))
+
+        # the number of features in the header is always 0, the one of the feature chunk is the right one
+        _, _, num_features = CRFSuiteModel._CHUNK.unpack_from(buffer, off_features)
+        features = [CRFSuiteModel._FEATURE.unpack_from(buffer, off_features + CRFSuiteModel._CHUNK.size
+                                                       + CRFSuiteModel._FEATURE.size * index)
+                    for index in range(num_features)]
+
+        return CRFSuiteModel(_read_cqdb(buffer, off_labels), _read_cqdb(buffer, off_attributes), features)
+
+    def compact(self, threshold=0.0, top_n=None):
+        """
+        :param threshold: state features whose absolute weight is not above it are dropped
+        :type threshold: float
+        :param top_n: optionally keep only the top_n state features with the largest absolute weights
+        :type top_n: int
+        :returns a new model without the dropped state features and the attributes left without any of them;
+            the transition features and the labels are kept as they are
+        :rtype: CRFSuiteModel
+        """
+        kept = {index for index, feature in enumerate(self.features)
+                if feature[0] == CRFSuiteModel.TRANSITION or abs(feature[3]) > threshold}
+        if top_n is not None:
+            states = sorted((index for index in kept if self.features[index][0] == CRFSuiteModel.STATE),
+                            key=lambda index: -abs(self.features[index][3]))
+            kept.difference_update(states[top_n:])
+
+        # like CRFsuite, numbers the attributes in the order of their first feature
+        attribute_ids = {}
+        attributes = []
+        features = []
+        for index, (feature_type, source, destination, weight) in enumerate(self.features):
+            if index not in kept:
+                continue
+            if feature_type == CRFSuiteModel.STATE:
+                attribute_id = attribute_ids.get(source)
+                if attribute_id is None:
+                    attribute_id = attribute_ids[source] = len(attributes)
+                    attributes.append(self.attributes[source])
+                source = attribute_id
+            features.append((feature_type, source, destination, weight))
+
+        return CRFSuiteModel(list(self.labels), attributes, features)
+
+    def write(self, model_file):
+        """
+        Writes the model in the same layout as CRFsuite itself:
+        header, features, labels, attributes, label feature references, attribute feature references.
+
+        :type model_file: str
+        """
+        features = self.features
+        label_references = [[] for _ in self.labels]
+        attribute_references = [[] for _ in self.attributes]
+        for feature_id, (feature_type, source, _, _) in enumerate(features):
+            (attribute_references if feature_type == CRFSuiteModel.STATE else label_references)[source].append(
+                feature_id)
+
+        output = bytearray(CRFSuiteModel._HEADER.size)
+
+        off_features = len(output)
+        output += CRFSuiteModel._CHUNK.pack(
+            b'FEAT', CRFSuiteModel._CHUNK.size + CRFSuiteModel._FEATURE.size * len(features), len(features))
+        for feature in features:
+            output += CRFSuiteModel._FEATURE.pack(*feature)
+
+        off_labels = len(output)
+        output += _cqdb(self.labels)
+        off_attributes = len(output)
+        output += _cqdb(self.attributes)
+
+        # CRFsuite reserves two more (empty) label references
+        off_label_references = _write_references(output, b'LFRF', label_references + [None, None])
+        off_attribute_references = _write_references(output, b'AFRF', attribute_references)
+
+        # like CRFsuite, leaves the number of features of the header at 0
+        CRFSuiteModel._HEADER.pack_into(
+            output, 0, CRFSuiteModel.MAGIC, len(output), CRFSuiteModel.TYPE, CRFSuiteModel.VERSION,
+            0, len(self.labels), len(self.attributes), off_features, off_labels, off_attributes,
+            off_label_references, off_attribute_references)
+
+        with open(model_file, 'wb') as file:
+            file.write(output)
+
+    @staticmethod
+    def compact_file(model_file, compacted_file, threshold=0.0, top_n=None, validation=None,
+                     class_id=MUT_CLASS_ID):
+        """
+        Compacts a model file (see compact()) and reports the size reduction and,
+        if a prepared validation dataset with gold annotations is given, the tagging speedup
+        and the difference in exact F-measure (MentionLevelEvaluator) of the compacted model.
+        The validation dataset is left untouched: copies of it are tagged.
+
+        :type model_file: str
+        :type compacted_file: str
+        :type validation: nalaf.structures.data.Dataset
+        :returns the report, a dict with the sizes, the number of features, and optionally
+            the tagging seconds and the F-measures, of both models, as well as the size reduction
+            ('size_reduction', the fraction of the size saved) and optionally the 'speedup'
+            (original seconds / compacted seconds) and the 'f_measure_delta' (compacted - original)
+        :rtype: dict
+        """
+        model = CRFSuiteModel.read(model_file)
+        compacted = model.compact(threshold, top_n)
+        compacted.write(compacted_file)
+
+        report = {
+            'size': os.path.getsize(model_file), 'compacted_size': os.path.getsize(compacted_file),
+            'features': len(model), 'compacted_features': len(compacted),
+            'attributes': len(model.attributes), 'compacted_attributes': len(compacted.attributes),
+        }
+        report['size_reduction'] = 1 - report['compacted_size'] / report['size']
+
+        if validation is not None:
+            from nalaf.learning.evaluators import MentionLevelEvaluator, Evaluation
+
+            # only close the taggers opened here, the caller may still use the pool of the original model
+            opened = [file_name for file_name in (model_file, compacted_file)
+                      if os.path.abspath(file_name) not in TaggerPool._pools]
+            try:
+                for prefix, file_name in (('', model_file), ('compacted_', compacted_file)):
+                    tagged = copy.deepcopy(validation)
+                    for part in tagged.parts():
+                        part.predicted_annotations = [ann for ann in part.predicted_annotations
+                                                      if ann.class_id != class_id]
+                    start = time.time()
+                    PyCRFSuite.tag(tagged, file_name, class_id)
+                    report[prefix + 'seconds'] = time.time() - start
+
+                    total = MentionLevelEvaluator().evaluate(tagged)(MentionLevelEvaluator.TOTAL_LABEL)
+                    report[prefix + 'f_measure'] = Evaluation(
+                        total.label, total.tp, total.fp, total.fn, total.fp_ov, total.fn_ov).compute('exact').f_measure
+            finally:
+                for file_name in opened:
+                    TaggerPool.close(file_name)
+
+            report['speedup'] = report['seconds'] / report['compacted_seconds'] if report['compacted_seconds'] \
+                else float('inf')
+            report['f_measure_delta'] = report['compacted_f_measure'] - report['f_measure']
+
+        print_verbose('Compacted model {}: {}'.format(compacted_file, report))
+        return report
+
+
+def _read_cqdb(buffer, begin):
+    """
+    :returns the strings of a CQDB chunk of a CRFsuite model, in the order of their ids
+    :rtype: list[str]
+    """
+    _, _, _, _, backward_size, backward_offset = struct.unpack_from('<4sIIIII', buffer, begin)
+    strings = []
+    for index in range(backward_size):
+        offset, = struct.unpack_from('<I', buffer, begin + backward_offset + 4 * index)
+        _, size = struct.unpack_from('<II', buffer, begin + offset)
+        start = begin + offset + 8
+        strings.append(buffer[start:start + size - 1].decode('utf-8'))
+    return strings
+
+
+def _cqdb(strings):
+    """
+    :param strings: the string of every id
+    :returns the CQDB (constant quark database) chunk of a CRFsuite model mapping the strings to their ids
+    :rtype: bytearray
+    """
+    tables = 256
+    header = struct.Struct('<4sIIIII')
+    data_offset = header.size + 8 * tables
+
+    data = bytearray()
+    buckets = [[] for _ in range(tables)]
+    backward = []
+    for string_id, string in enumerate(strings):
+        key = string.encode('utf-8') + b'\0'
+        hash_value = _hashlittle(key)
+        offset = data_offset + len(data)
+        buckets[hash_value % tables].append((hash_value, offset))
+        backward.append(offset)
+        data += struct.pack('<II', string_id, len(key)) + key
+
+    table_references = bytearray()
+    hash_tables = bytearray()
+    for bucket in buckets:
+        size = 2 * len(bucket)  # half of the slots are kept empty
+        table_references += struct.pack('<II', data_offset + len(data) + len(hash_tables) if bucket else 0, size)
+        slots = [(0, 0)] * size
+        for hash_value, offset in bucket:
+            slot = (hash_value >> 8) % size
+            while slots[slot][1] != 0:
+                slot = (slot + 1) % size
+            slots[slot] = (hash_value, offset)
+        for slot in slots:
+            hash_tables += struct.pack('<II', *slot)
+
+    backward_offset = data_offset + len(data) + len(hash_tables) if backward else 0
+    size = data_offset + len(data) + len(hash_tables) + 4 * len(backward)
+
+    chunk = bytearray(header.pack(b'CQDB', size, 0, 0x62445371, len(backward), backward_offset))
+    chunk += table_references + data + hash_tables
+    chunk += array('I', backward).tobytes() if sys.byteorder == 'little' else struct.pack(
+        '<{}I'.format(len(backward)), *backward)
+    return chunk
+
+
+def _write_references(output, chunk_id, references):
+    """
+    Appends to the output a chunk of feature references (aligned to 4 bytes):
+    the offset of every reference list and then the lists themselves (their length and the feature ids).
+
+    :param references: list of feature ids of every label or attribute (or None for an empty offset)
+    :returns the offset of the chunk
+    :rtype: int
+    """
+    while len(output) % 4:
+        output.append(0)
+    begin = len(output)
+    output += bytes(CRFSuiteModel._CHUNK.size + 4 * len(references))
+
+    offsets = []
+    for feature_ids in references:
+        if feature_ids is None:
+            offsets.append(0)
+        else:
+            offsets.append(len(output))
+            output += struct.pack('<{}I'.format(len(feature_ids) + 1), len(feature_ids), *feature_ids)
+
+    struct.pack_into('<4sII{}I'.format(len(references)), output, begin,
+                     chunk_id, len(output) - begin, len(references), *offsets)
+    return begin
+
+
+def _hashlittle(key, initial_value=0):
+    """
+    Bob Jenkins' lookup3 hashlittle() of the bytes of a key, as used by CQDB.
+
+    :type key: bytes
+    :rtype: int
+    """
+    def rotate(x, k):
+        return ((x << k) | (x >> (32 - k))) & 0xffffffff
+
+    length = len(key)
+    a = b = c = (0xdeadbeef + length + initial_value) & 0xffffffff
+
+    position = 0
+    while length - position > 12:
+        x, y, z = struct.unpack_from('<III', key, position)
+        a = (a + x) & 0xffffffff
+        b = (b + y) & 0xffffffff
+        c = (c + z) & 0xffffffff
+        # mix(a, b, c)
+        a = (a - c) & 0xffffffff; a ^= rotate(c, 4); c = (c + b) & 0xffffffff
+        b = (b - a) & 0xffffffff; b ^= rotate(a, 6); a = (a + c) & 0xffffffff
+        c = (c - b) & 0xffffffff; c ^= rotate(b, 8); b = (b + a) & 0xffffffff
+        a = (a - c) & 0xffffffff; a ^= rotate(c, 16); c = (c + b) & 0xffffffff
+        b = (b - a) & 0xffffffff; b ^= rotate(a, 19); a = (a + c) & 0xffffffff
+        c = (c - b) & 0xffffffff; c ^= rotate(b, 4); b = (b + a) & 0xffffffff
+        position += 12
+
+    if length - position == 0:
+        return c
+
+    x, y, z = struct.unpack('<III', key[position:].ljust(12, b'\0'))
+    a = (a + x) & 0xffffffff
+    b = (b + y) & 0xffffffff
+    c = (c + z) & 0xffffffff
+    # final(a, b, c)
+    c ^= b; c = (c - rotate(b, 14)) & 0xffffffff
+    a ^= c; a = (a - rotate(c, 11)) & 0xffffffff
+    b ^= a; b = (b - rotate(a, 25)) & 0xffffffff
+    c ^= b; c = (c - rotate(b, 16)) & 0xffffffff
+    a ^= c; a = (a - rotate(c, 4)) & 0xffffffff
+    b ^= a; b = (b - rotate(a, 14)) & 0xffffffff
+    c ^= b; c = (c - rotate(b, 24)) & 0xffffffff
+    return c
+
 
 class CRFSuite:
     """
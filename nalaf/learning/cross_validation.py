@@ -0,0 +1,114 @@
+import os
+import copy
+import shutil
+import tempfile
+import multiprocessing
+from nalaf.learning.crfsuite import PyCRFSuite, TaggerPool
+from nalaf.learning.evaluators import MentionLevelEvaluator, Evaluations, EvaluationWithStandardError
+from nalaf.utils import MUT_CLASS_ID
+from nalaf import print_verbose
+
+
+class PyCRFSuiteCrossValidation:
+    """
+    Runs N-fold cross-validation (see Dataset.cv_split) of a PyCRFSuite model:
+        * First prepares (and labels) the whole dataset once
+        * Next trains and tags every fold in a separate forked worker process
+        * Finally evaluates each fold and merges the evaluations with Evaluations.merge
+
+    The workers only modify their own copy of the dataset, so the predicted labels and annotations
+    of the given dataset are left untouched. The numbers are the same as the ones of the serial procedure
+    (workers=1, which tags a copy of each test fold in this process instead).
+
+    :type pipeline: nalaf.structures.dataset_pipelines.PrepareDatasetPipeline
+    :type labeler: nalaf.preprocessing.labelers.Labeler
+    :type evaluator: nalaf.learning.evaluators.Evaluator
+    :type class_id: str
+    :type params: dict
+    :type workers: int
+    """
+
+    def __init__(self, pipeline, labeler, evaluator=None, class_id=MUT_CLASS_ID, params=None, workers=None):
+        self.pipeline = pipeline
+        """prepares the dataset (executed once for all the folds)"""
+        self.labeler = labeler
+        """labels the tokens for training"""
+        self.evaluator = evaluator if evaluator is not None else MentionLevelEvaluator()
+        """evaluates the predictions of each test fold"""
+        self.class_id = class_id
+        """the class id of the predicted annotations"""
+        self.params = params
+        """the training parameters passed to PyCRFSuite.train"""
+        self.workers = workers
+        """number of worker processes, by default as many as CPUs (but at most one per fold)"""
+
+    def run(self, dataset, n=5, prepared=False):
+        """
+        :type dataset: nalaf.structures.data.Dataset
+        :param n: number of folds
+        :type n: int
+        :param prepared: whether the dataset was already prepared and labeled
+        :type prepared: bool
+        :returns the merged evaluations and the evaluations of each fold
+        :rtype: (nalaf.learning.evaluators.Evaluations, list[nalaf.learning.evaluators.Evaluations])
+        """
+        global _shared_cross_validation
+
+        if not prepared:
+            self.pipeline.execute(dataset)
+            self.labeler.label(dataset)
+
+        folds = list(dataset.cv_split(n))
+        workers = min(n, self.workers or os.cpu_count() or 1)
+        model_directory = tempfile.mkdtemp()
+
+        _shared_cross_validation = (self, folds, model_directory)
+        try:
+            if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+                print_verbose('Cross-validation of {} folds with {} workers'.format(n, workers))
+                with multiprocessing.get_context('fork').Pool(workers) as pool:
+                    fold_counts = pool.map(_run_fold, range(n), chunksize=1)
+            else:
+                fold_counts = [_run_fold(fold_nr, copy_test=True) for fold_nr in range(n)]
+        finally:
+            _shared_cross_validation = None
+            shutil.rmtree(model_directory)
+
+        fold_evaluations = []
+        for counts in fold_counts:
+            evaluations = Evaluations()
+            for label, dic_counts in counts:
+                evaluations.add(EvaluationWithStandardError(label, dic_counts))
+            fold_evaluations.append(evaluations)
+
+        return Evaluations.merge(fold_evaluations), fold_evaluations
+
+
+_shared_cross_validation = None
+"""(cross-validation, folds, model directory) inherited by the forked workers of PyCRFSuiteCrossValidation.run"""
+
+
+def _run_fold(fold_nr, copy_test=False):
+    """
+    Trains, tags and evaluates one fold (in a worker process of PyCRFSuiteCrossValidation.run)
+
+    :param copy_test: tag a copy of the test documents, when running in the process of the caller,
+        whose documents must be left untouched
+    :returns the counts of each evaluated label (the evaluations themselves are not picklable)
+    :rtype: list[(str, dict)]
+    """
+    cross_validation, folds, model_directory = _shared_cross_validation
+    train, test = folds[fold_nr]
+    if copy_test:
+        test = copy.deepcopy(test)
+    model_file = os.path.join(model_directory, 'fold_{}.model'.format(fold_nr))
+
+    PyCRFSuite.train(train, model_file, cross_validation.params)
+    try:
+        PyCRFSuite.tag(test, model_file, cross_validation.class_id)
+    finally:
+        TaggerPool.close(model_file)  # the temporary model is deleted after the run
+    evaluations = cross_validation.evaluator.evaluate(test)
+
+    print_verbose('Cross-validation fold {} done'.format(fold_nr))
+    return [(evaluations(label).label, evaluations(label).dic_counts) for label in evaluations]
@@ -1,8 +1,14 @@
 import abc
-from nalaf.structures.data import Entity
-from nalaf import print_verbose, print_debug
+import os
+import heapq
+import bisect
+import itertools
+import multiprocessing
+from array import array
+import numpy as np
+from nalaf.structures.data import Dataset, Entity
+from nalaf import print_verbose, print_debug, config
 from collections import namedtuple
-import random
 import math
 
 class Evaluation:
@@ -94,11 +100,23 @@ class Evaluation:
 
 
 class EvaluationWithStandardError:
+    """
+    Evaluation with standard errors estimated by bootstrapping: n samples of (round(p * number of documents))
+    documents each are drawn without replacement, and the spread of their performance around the total performance
+    gives the standard error.
+
+    The counts of the documents are kept as a NumPy matrix and all the samples are drawn and summed at once
+    (in batches of bounded memory). The summed counts of the samples are drawn only once and shared by all the
+    strictnesses, and the standard errors of each strictness are cached. Pass a seed for reproducible errors.
+    See also Evaluations.compute_SEs to compute those of many labels in parallel.
+    """
 
     Computation = namedtuple('Computation',
                              ['precision', 'precision_SE', 'recall', 'recall_SE', 'f_measure', 'f_measure_SE'])
 
-    def __init__(self, label, dic_counts, n=1000, p=0.15, mode='macro', precomputed_SEs=None):
+    COUNTS = ('tp', 'fp', 'fn', 'fp_ov', 'fn_ov')
+
+    def __init__(self, label, dic_counts, n=1000, p=0.15, mode='macro', precomputed_SEs=None, seed=None):
         self.label = str(label)
         self.dic_counts = dic_counts
         self.n = n
@@ -106,6 +124,8 @@ class EvaluationWithStandardError:
         assert mode == 'macro', "`micro` mode is not implemented yet"
         self.mode = mode
         self.precomputed_SEs = precomputed_SEs
+        self.seed = seed
+        """seed of the random generator of the samples, None for a different one every time"""
 
         self.keys = dic_counts.keys()
         self.keys_len = len(self.keys)
@@ -119,6 +139,9 @@ class EvaluationWithStandardError:
         self.fp_ov = self._mean_eval.fp_ov
         self.fn_ov = self._mean_eval.fn_ov
 
+        self._sample_counts = None
+        self._SEs = {}
+
     def _get(self, count, keys=None):
         if keys is None:
             keys = self.keys
@@ -126,44 +149,74 @@ class EvaluationWithStandardError:
         return sum([counts.get(count, 0) for key, counts in self.dic_counts.items() if key in keys])
 
     def _compute_SE(self, mean, array, multiply_small_values=4):
-        cleaned = [x for x in array if not math.isnan(x)]
+        cleaned = array[~np.isnan(array)]
         n = len(cleaned)
-        ret = Evaluation._safe_div(math.sqrt(sum((x - mean) ** 2 for x in cleaned) / (n - 1)), math.sqrt(n))
+        ret = Evaluation._safe_div(math.sqrt(float(((cleaned - mean) ** 2).sum()) / (n - 1)), math.sqrt(n))
         if (ret <= 0.00001):
             ret *= multiply_small_values
         return ret
 
+    def sample_counts(self, batch_size=2 ** 22):
+        """
+        Draws (once) the bootstrap samples.
+
+        :param batch_size: maximum number of random numbers drawn at once
+        :returns the summed counts (columns in the order of COUNTS) of each sample
+        :rtype: numpy.ndarray
+        """
+        if self._sample_counts is None:
+            counts = np.array([[document_counts.get(count, 0) for count in self.COUNTS]
+                               for document_counts in self.dic_counts.values()], dtype=np.float64)
+            counts = counts.reshape(self.keys_len, len(self.COUNTS))
+            size = round(self.keys_len * self.p)
+            generator = np.random.default_rng(self.seed)
+
+            sample_counts = np.zeros((self.n, len(self.COUNTS)))
+            if 0 < size < self.keys_len:
+                step = max(1, batch_size // self.keys_len)
+                for first in range(0, self.n, step):
+                    rows = min(step, self.n - first)
+                    # the first `size` of a random permutation of the documents, i.e. a sample without replacement
+                    samples = np.argpartition(generator.random((rows, self.keys_len)), size - 1, axis=1)[:, :size]
+                    sample_counts[first:first + rows] = counts[samples].sum(axis=1)
+            elif size >= self.keys_len:
+                sample_counts[:] = counts.sum(axis=0)
+            self._sample_counts = sample_counts
+
+        return self._sample_counts
+
+    def standard_errors(self, strictness):
+        """
+        :param strictness: see Evaluation.compute
+        :type strictness: str
+        :returns the (cached) standard errors as a dict with the keys precision_SE, recall_SE and f_measure_SE
+        :rtype: dict
+        """
+        if strictness not in self._SEs:
+            means = self._mean_eval.compute(strictness)
+            precision, recall, f_measure = _compute_vectorized(self.sample_counts().T, strictness)
+            self._SEs[strictness] = {
+                'precision_SE': self._compute_SE(means.precision, precision),
+                'recall_SE': self._compute_SE(means.recall, recall),
+                'f_measure_SE': self._compute_SE(means.f_measure, f_measure)}
+
+        return self._SEs[strictness]
+
     def compute(self, strictness, precomputed_SE=None):
         means = self._mean_eval.compute(strictness)
 
         if precomputed_SE is None:
-            samples = []
-            for _ in range(self.n):
-                random_keys = random.sample(self.keys, round(self.keys_len * self.p))  # without replacement
-                sample = Evaluation(str(self.label),
-                                    self._get('tp', random_keys),
-                                    self._get('fp', random_keys),
-                                    self._get('fn', random_keys),
-                                    self._get('fp_ov', random_keys),
-                                    self._get('fn_ov', random_keys))
-
-                samples.append(sample.compute(strictness))
-
-            p_SE = self._compute_SE(means.precision, [sample.precision for sample in samples])
-            r_SE = self._compute_SE(means.recall, [sample.recall for sample in samples])
-            f_SE = self._compute_SE(means.f_measure, [sample.f_measure for sample in samples])
+            precomputed_SE = self.standard_errors(strictness)
 
-        else:
-            p_SE = precomputed_SE['precision_SE']
-            r_SE = precomputed_SE['recall_SE']
-            f_SE = precomputed_SE['f_measure_SE']
+        p_SE = precomputed_SE['precision_SE']
+        r_SE = precomputed_SE['recall_SE']
+        f_SE = precomputed_SE['f_measure_SE']
 
         return EvaluationWithStandardError.Computation(
             means.precision, p_SE,
             means.recall, r_SE,
             means.f_measure, f_SE)
 
-
     def __str__(self):
         return self.format()
 
@@ -247,6 +300,47 @@ class EvaluationWithStandardError:
         return [item for pair in zip(comps, ses_reduced) for item in pair]
 
 
+def _compute_vectorized(counts, strictness):
+    """
+    Evaluation.compute of many count vectors at once.
+
+    :param counts: the arrays of tp, fp, fn, fp_ov and fn_ov
+    :returns the arrays of precision, recall and f_measure
+    """
+    tp, fp, fn, fp_ov, fn_ov = counts
+
+    if strictness == 'exact':
+        precision = _safe_divide(tp, tp + fp)
+        recall = _safe_divide(tp, tp + fn)
+
+    elif strictness == 'overlapping':
+        fp = fp - fp_ov
+        fn = fn - fn_ov
+        tp = tp + fp_ov + fn_ov
+
+        precision = _safe_divide(tp, tp + fp)
+        recall = _safe_divide(tp, tp + fn)
+
+    elif strictness == 'half_overlapping':
+        fp = fp - fp_ov
+        fn = fn - fn_ov
+
+        precision = _safe_divide(tp + (fp_ov + fn_ov) / 2, tp + fp_ov + fn_ov + fp)
+        recall = _safe_divide(tp + (fp_ov + fn_ov) / 2, tp + fp_ov + fn_ov + fn)
+
+    else:
+        raise ValueError('strictness must be "exact" or "overlapping" or "half_overlapping"')
+
+    f_measure = 2 * _safe_divide(precision * recall, precision + recall)
+
+    return precision, recall, f_measure
+
+
+def _safe_divide(nominators, denominators):
+    """vectorized Evaluation._safe_div"""
+    return np.divide(nominators, denominators, out=np.zeros(np.shape(nominators)), where=denominators != 0)
+
+
 class Evaluations:
 
     def __init__(self):
@@ -275,6 +369,38 @@ class Evaluations:
     def __iter__(self):
         return self.classes.__iter__()
 
+    def compute_SEs(self, strictnesses=None, workers=None):
+        """
+        Computes (and caches) the standard errors of every evaluation of type EvaluationWithStandardError,
+        the labels in parallel in forked worker processes.
+
+        :param strictnesses: by default 'exact' and 'overlapping'
+        :type strictnesses: list[str]
+        :param workers: number of worker processes, by default as many as CPUs (but at most one per label)
+        :type workers: int
+        """
+        global _shared_evaluations
+
+        strictnesses = ['exact', 'overlapping'] if strictnesses is None else strictnesses
+        labels = [label for label, evaluation in self.classes.items()
+                  if isinstance(evaluation, EvaluationWithStandardError)]
+        workers = min(workers or os.cpu_count() or 1, len(labels))
+
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            _shared_evaluations = (self, strictnesses)
+            try:
+                with multiprocessing.get_context('fork').Pool(workers) as pool:
+                    results = pool.map(_label_SEs, labels, chunksize=1)
+            finally:
+                _shared_evaluations = None
+
+            for label, standard_errors in zip(labels, results):
+                self.classes[label]._SEs.update(standard_errors)
+        else:
+            for label in labels:
+                for strictness in strictnesses:
+                    self.classes[label].standard_errors(strictness)
+
     @staticmethod
     def merge(evaluations_itr):
         """
@@ -298,6 +424,104 @@ class Evaluations:
         return ret
 
 
+class EvaluationAccumulator:
+    """
+    Streaming evaluation: consumes one document or one batch of documents at a time
+    (e.g. the tagged batches of PyCRFSuite.tag_batches), keeping only the counts of each document,
+    and finalizes into the same Evaluations as evaluating the whole dataset at once with the evaluator.
+
+    Accumulators of disjoint parts of a dataset (e.g. of parallel shards) are merged with merge(),
+    which is associative and commutative (the counts of a document seen by both are added up),
+    and accumulators are picklable so that they can be sent back from worker processes.
+
+    :type evaluator: Evaluator
+    """
+
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+        """the evaluator of each document or batch"""
+        self.counts = {}
+        """the counts of each document of each evaluated label"""
+        self.docids = {}
+        """the ids of the consumed documents, in order (the values are unused)"""
+
+    def add(self, dataset, release=None):
+        """
+        Evaluates a batch of documents.
+
+        :type dataset: nalaf.structures.data.Dataset
+        :param release: optional stages to release from the batch once evaluated, see Dataset.release()
+        :type release: str | collections.Iterable[str]
+        :returns self
+        """
+        evaluations = self.evaluator.evaluate(dataset)
+        if release is not None:
+            dataset.release(release)
+        for docid in dataset.documents:
+            self.docids.setdefault(docid)
+        for label in evaluations:
+            self._add_counts(evaluations(label).label, evaluations(label).dic_counts)
+        return self
+
+    def add_document(self, docid, document):
+        """
+        Evaluates a single document.
+
+        :type docid: str
+        :type document: nalaf.structures.data.Document
+        :returns self
+        """
+        dataset = Dataset()
+        dataset.documents[docid] = document
+        return self.add(dataset)
+
+    def merge(self, other):
+        """
+        Adds the counts of another accumulator to this one.
+
+        :type other: EvaluationAccumulator
+        :returns self
+        """
+        for docid in other.docids:
+            self.docids.setdefault(docid)
+        for label, dic_counts in other.counts.items():
+            self._add_counts(label, dic_counts)
+        return self
+
+    def _add_counts(self, label, dic_counts):
+        label_counts = self.counts.setdefault(label, {})
+        for docid, counts in dic_counts.items():
+            if docid in label_counts:
+                label_counts[docid] = {count: label_counts[docid].get(count, 0) + counts.get(count, 0)
+                                       for count in list(label_counts[docid]) +
+                                       [count for count in counts if count not in label_counts[docid]]}
+            else:
+                label_counts[docid] = dict(counts)
+
+    def finalize(self, **kwargs):
+        """
+        :param kwargs: passed on to every EvaluationWithStandardError, e.g. n, p or seed
+        :returns the evaluation of each label, in which the documents without counts for it
+            (e.g. of batches without a subclass) count zero, like when evaluating all the documents at once
+        :rtype: Evaluations
+        """
+        evaluations = Evaluations()
+        for label, label_counts in self.counts.items():
+            zero = dict.fromkeys(next(iter(label_counts.values())) if label_counts else (), 0)
+            dic_counts = {docid: label_counts.get(docid, zero).copy() for docid in self.docids}
+            evaluations.add(EvaluationWithStandardError(label, dic_counts, **kwargs))
+        return evaluations
+
+
+_shared_evaluations = None
+"""(evaluations, strictnesses) inherited by the forked workers of Evaluations.compute_SEs"""
+
+
+def _label_SEs(label):
+    evaluations, strictnesses = _shared_evaluations
+    return {strictness: evaluations.classes[label].standard_errors(strictness) for strictness in strictnesses}
+
+
 class Evaluator:
     """
     Calculates precision, recall and subsequently F1 measure based on the original and the predicted mention
@@ -365,59 +589,67 @@ class MentionLevelEvaluator(Evaluator):
         subcounts = ['tp', 'fp', 'fn', 'fp_ov', 'fn_ov']
         counts = {label: {docid: dict.fromkeys(subcounts, 0) for docid in docids} for label in labels}
 
+        debug = config.getboolean('print', 'debug', fallback=False)
+
         for docid, doc in dataset.documents.items():
             for partid, part in doc.parts.items():
-                tests = ' || '.join(sorted(ann.text for ann in part.annotations))
-                preds = ' || '.join(sorted(ann.text for ann in part.predicted_annotations))
-                if tests != preds:
-                    print_debug("* docid={} part={}".format(docid, partid))
-                    print_debug("test: {}".format(tests))
-                    print_debug("pred: {}".format(preds))
-                    print_debug()
-
-                overlap_real = {label: [] for label in labels}
-                overlap_predicted = {label: [] for label in labels}
-
-                Entity.equality_operator = 'overlapping'
-                for ann_a in part.annotations:
-                    for ann_b in part.predicted_annotations:
-                        if ann_a == ann_b:  # equal according according to exclusive overlapping eq (not exact)
-                            overlap_real[TOTAL].append(ann_a)
-                            overlap_predicted[TOTAL].append(ann_b)
-
-                            if self.subclass_analysis:
-                                if ann_a.subclass != ann_b.subclass:
-                                    print_debug('overlapping subclasses do not match', ann_a.subclass, ann_b.subclass)
-                                    ann_b.subclass = ann_a.subclass
-
-                                overlap_real[ann_a.subclass].append(ann_a)
-                                overlap_predicted[ann_b.subclass].append(ann_b)
-
-                Entity.equality_operator = 'exact'
+                if debug:
+                    tests = ' || '.join(sorted(ann.text for ann in part.annotations))
+                    preds = ' || '.join(sorted(ann.text for ann in part.predicted_annotations))
+                    if tests != preds:
+                        print_debug("* docid={} part={}".format(docid, partid))
+                        print_debug("test: {}".format(tests))
+                        print_debug("pred: {}".format(preds))
+                        print_debug()
+
+                # the exact keys of the annotations that overlap (but do not match exactly) an annotation of the other side
+                overlap_real = {label: set() for label in labels}
+                overlap_predicted = {label: set() for label in labels}
+
+                for ann_a, ann_b in _overlapping_pairs(part.annotations, part.predicted_annotations):
+                    overlap_real[TOTAL].add(_exact_key(ann_a))
+                    overlap_predicted[TOTAL].add(_exact_key(ann_b))
+
+                    if self.subclass_analysis:
+                        if ann_a.subclass != ann_b.subclass:
+                            print_debug('overlapping subclasses do not match', ann_a.subclass, ann_b.subclass)
+                            ann_b.subclass = ann_a.subclass
+
+                        overlap_real[ann_a.subclass].add(_exact_key(ann_a))
+                        overlap_predicted[ann_b.subclass].add(_exact_key(ann_b))
+
+                real_keys = {_exact_key(ann) for ann in part.annotations}
+                predicted_keys = {_exact_key(ann) for ann in part.predicted_annotations}
+
                 for ann in part.predicted_annotations:
-                    if ann in part.annotations:
+                    key = _exact_key(ann)
+                    if key in real_keys:
                         counts[TOTAL][docid]['tp'] += 1
                         if self.subclass_analysis:
                             counts[ann.subclass][docid]['tp'] += 1
                     else:
                         counts[TOTAL][docid]['fp'] += 1
-                        if ann in overlap_predicted[TOTAL]:
+                        if key in overlap_predicted[TOTAL]:
                             counts[TOTAL][docid]['fp_ov'] += 1
                         if self.subclass_analysis:
                             counts[ann.subclass][docid]['fp'] += 1
-                            if ann in overlap_predicted[ann.subclass]:
+                            if key in overlap_predicted[ann.subclass]:
                                 counts[ann.subclass][docid]['fp_ov'] += 1
 
                 for ann in part.annotations:
-                    if ann not in part.predicted_annotations:
+                    key = _exact_key(ann)
+                    if key not in predicted_keys:
                         counts[TOTAL][docid]['fn'] += 1
-                        if ann in overlap_real[TOTAL]:
+                        if key in overlap_real[TOTAL]:
                             counts[TOTAL][docid]['fn_ov'] += 1
                         if self.subclass_analysis:
                             counts[ann.subclass][docid]['fn'] += 1
-                            if ann in overlap_real[ann.subclass]:
+                            if key in overlap_real[ann.subclass]:
                                 counts[ann.subclass][docid]['fn_ov'] += 1
 
+        # as always before, leave the (global) equality of the entities exact
+        Entity.equality_operator = 'exact'
+
         evaluations = Evaluations()
 
         for label in labels:
@@ -426,6 +658,52 @@ class MentionLevelEvaluator(Evaluator):
         return evaluations
 
 
+def _exact_key(ann):
+    """
+    :returns the key under which two annotations are equal with the 'exact' Entity.equality_operator
+    """
+    return ann.class_id, ann.offset, ann.text
+
+
+def _overlapping_pairs(real, predicted):
+    """
+    Finds the pairs of annotations that are equal with the 'overlapping' Entity.equality_operator,
+    i.e. of the same class, overlapping but not matching exactly, with a sweep over the intervals sorted by start
+    (only the intervals that are still open are compared, instead of all of them).
+
+    :type real: list[nalaf.structures.data.Entity]
+    :type predicted: list[nalaf.structures.data.Entity]
+    :returns the (real, predicted) pairs in the same order as nested loops over real and then predicted
+    :rtype: list[(nalaf.structures.data.Entity, nalaf.structures.data.Entity)]
+    """
+    sides = (real, predicted)
+    classes = {}
+    for side, annotations in enumerate(sides):
+        for index, ann in enumerate(annotations):
+            classes.setdefault(ann.class_id, []).append((ann.offset, side, index))
+
+    pairs = []
+    for events in classes.values():
+        events.sort()
+        open_intervals = ([], [])  # heaps of (end, index) of each side
+        for start, side, index in events:
+            for heap in open_intervals:
+                while heap and heap[0][0] <= start:
+                    heapq.heappop(heap)
+
+            ann = sides[side][index]
+            end = start + len(ann.text)
+            for _, other_index in open_intervals[1 - side]:
+                other = sides[1 - side][other_index]
+                if other.offset < end and not (other.offset == ann.offset and other.text == ann.text):
+                    pairs.append((index, other_index) if side == 0 else (other_index, index))
+
+            heapq.heappush(open_intervals[side], (end, index))
+
+    pairs.sort()
+    return [(real[index_a], predicted[index_b]) for index_a, index_b in pairs]
+
+
 class DocumentLevelRelationEvaluator(Evaluator):
     """
     Implements document level performance evaluation for relations. That means
@@ -439,9 +717,14 @@ class DocumentLevelRelationEvaluator(Evaluator):
     argument. If the value of 'match_case' is True, then a predicted relation
     will match only if the cases match. If set to False, both entities will be
     converted to lower case. By default, match_case is set to True.
+
+    The relations are compared as sets of canonical keys (see Document.relation_keys),
+    computed once per document for all the relation types. Several relation types
+    can be evaluated in one pass by giving a list of them.
     """
     def __init__(self, rel_type, match_case=True):
         self.rel_type = rel_type
+        """the relation type, or a list of relation types, to evaluate"""
         self.match_case = match_case
         """
         If set to True, two relations will match only if their entities have the
@@ -457,39 +740,426 @@ class DocumentLevelRelationEvaluator(Evaluator):
     def evaluate(self, dataset):
         """
         :type dataset: nala.structures.data.Dataset
-        :returns Evaluations
+        :returns Evaluations with one evaluation for each relation type
         """
+        rel_types = [self.rel_type] if isinstance(self.rel_type, str) else list(self.rel_type)
 
         docids = dataset.documents.keys()
         subcounts = ['tp', 'fp', 'fn']
-        counts = {docid: dict.fromkeys(subcounts, 0) for docid in docids}
+        counts = {rel_type: {docid: dict.fromkeys(subcounts, 0) for docid in docids} for rel_type in rel_types}
+        empty = frozenset()
 
-        true_relations = {}
         for docid, doc in dataset.documents.items():
-            relations = list(doc.unique_relations(self.rel_type))
-            true_relations[docid] = relations
+            true_relations = doc.relation_keys(match_case=self.match_case)
+            predicted_relations = doc.relation_keys(predicted=True, match_case=self.match_case)
 
-        predicted_relations = {}
-        for docid, doc in dataset.documents.items():
-            relations = list(doc.unique_relations(self.rel_type, predicted=True))
-            predicted_relations[docid] = relations
-
-        for docid in docids:
-            predicted = predicted_relations[docid]
-            actual = true_relations[docid]
-
-            if not self.match_case:
-                predicted = [x.lower() for x in predicted]
-                actual = [x.lower() for x in actual]
-            for relation in predicted:
-                if relation in actual:
-                    counts[docid]['tp'] += 1
-                else:
-                    counts[docid]['fp'] += 1
-            for relation in actual:
-                if relation not in predicted:
-                    counts[docid]['fn'] += 1
+            for rel_type in rel_types:
+                actual = true_relations.get(rel_type, empty)
+                predicted = predicted_relations.get(rel_type, empty)
+                tp = len(predicted & actual)
+
+                counts[rel_type][docid]['tp'] = tp
+                counts[rel_type][docid]['fp'] = len(predicted) - tp
+                counts[rel_type][docid]['fn'] = len(actual) - tp
+
+        evaluations = Evaluations()
+        for rel_type in rel_types:
+            evaluations.add(EvaluationWithStandardError(rel_type, counts[rel_type]))
+        return evaluations
+
+
+class TokenLevelEvaluator(Evaluator):
+    """
+    Implements token level performance evaluation. That means it compares the original label
+    (Token.original_labels[0]) with the predicted label (Token.predicted_labels[0]) of every token,
+    for any label scheme (e.g. of BIOLabeler, BIEOLabeler or TmVarLabeler).
+
+    For every label:
+        * tp: tokens with that original and predicted label
+        * fp: tokens predicted with that label but originally with another
+        * fn: tokens originally with that label but predicted with another
+    The TOTAL label adds up the counts of all the labels but the outside label.
+
+    The labels are collected into integer arrays in one pass over the tokens
+    and all the counting is vectorized with NumPy. The counts are kept per document,
+    so that the evaluations have bootstrap standard errors like the ones of the other evaluators.
+    Tokens without an original or a predicted label are ignored.
+    """
+
+    TOTAL_LABEL = 'TOTAL'
+
+    TokenLabels = namedtuple('TokenLabels', ['original', 'predicted', 'documents', 'label_names', 'docids'])
+
+    def __init__(self, outside_label='O'):
+        self.outside_label = outside_label
+        """the label of the tokens outside of any mention, left out of the TOTAL counts"""
+
+    def collect(self, dataset):
+        """
+        :type dataset: nalaf.structures.data.Dataset
+        :returns the original label id, the predicted label id and the document index of every labeled token,
+            the (sorted) label of each label id and the id of each document index
+        :rtype: TokenLevelEvaluator.TokenLabels
+        """
+        index = _Ids()
+        original, predicted, documents = array('i'), array('i'), array('i')
+        docids = list(dataset.documents)
+
+        for document_index, document in enumerate(dataset.documents.values()):
+            start = len(original)
+            for part in document.parts.values():
+                for sentence in part.sentences:
+                    labeled = [token for token in sentence if token.original_labels and token.predicted_labels]
+                    original.extend([index[token.original_labels[0].value] for token in labeled])
+                    predicted.extend([index[token.predicted_labels[0].value] for token in labeled])
+            documents.extend([document_index] * (len(original) - start))
+
+        label_names = sorted(index)
+        order = np.empty(len(index), dtype=np.int32)
+        order[[index[name] for name in label_names]] = np.arange(len(index))
+
+        return TokenLevelEvaluator.TokenLabels(order[np.frombuffer(original, dtype=np.int32)],
+                                               order[np.frombuffer(predicted, dtype=np.int32)],
+                                               np.frombuffer(documents, dtype=np.int32), label_names, docids)
+
+    @staticmethod
+    def confusion_matrix(labels):
+        """
+        :param labels: the collected labels (see collect)
+        :type labels: TokenLevelEvaluator.TokenLabels
+        :returns the number of tokens of each original label (rows) and predicted label (columns),
+            in the order of labels.label_names
+        :rtype: numpy.ndarray
+        """
+        size = len(labels.label_names)
+        return np.bincount(labels.original.astype(np.int64) * size + labels.predicted,
+                           minlength=size * size).reshape(size, size)
+
+    def evaluate(self, dataset, labels=None):
+        """
+        :type dataset: nalaf.structures.data.Dataset
+        :param labels: the already collected labels of the dataset (see collect), by default they are collected
+        :type labels: TokenLevelEvaluator.TokenLabels
+        :returns Evaluations with one evaluation for each label and the TOTAL
+        """
+        if labels is None:
+            labels = self.collect(dataset)
+
+        size, num_documents = len(labels.label_names), len(labels.docids)
+        documents = labels.documents.astype(np.int64) * size
+        correct = labels.original == labels.predicted
+
+        def per_document(cells, mask=None):
+            if mask is not None:
+                cells = cells[mask]
+            return np.bincount(cells, minlength=num_documents * size).reshape(num_documents, size)
+
+        tp = per_document(documents + labels.original, correct)
+        fp = per_document(documents + labels.predicted) - tp
+        fn = per_document(documents + labels.original) - tp
+
+        inside = np.array([name != self.outside_label for name in labels.label_names], dtype=bool)
+        columns = [(self.TOTAL_LABEL, tp[:, inside].sum(axis=1), fp[:, inside].sum(axis=1),
+                    fn[:, inside].sum(axis=1))]
+        columns += [(name, tp[:, column], fp[:, column], fn[:, column])
+                    for column, name in enumerate(labels.label_names)]
 
         evaluations = Evaluations()
-        evaluations.add(EvaluationWithStandardError(self.rel_type, counts))
+        for label, label_tp, label_fp, label_fn in columns:
+            dic_counts = {docid: {'tp': counts[0], 'fp': counts[1], 'fn': counts[2], 'fp_ov': 0, 'fn_ov': 0}
+                          for docid, counts in zip(labels.docids, zip(label_tp.tolist(), label_fp.tolist(),
+                                                                      label_fn.tolist()))}
+            evaluations.add(EvaluationWithStandardError(label, dic_counts))
         return evaluations
+
+
+class MultiSystemEvaluator:
+    """
+    Mention level evaluation of many systems (e.g. different models, GNormPlus or merged systems)
+    against the same gold standard, with paired significance tests between them.
+
+    The gold annotations of every part are indexed once: the set of their exact keys and, for every class,
+    their intervals sorted by start. Each prediction set is then scored in a single pass over its own annotations,
+    looking up the exact matches and the overlapping gold intervals in the index, and the systems are scored
+    in parallel in forked worker processes. The counts are the same as the ones of MentionLevelEvaluator
+    (also with subclass_analysis), but the predicted annotations are left untouched.
+
+    A prediction set is either a Dataset (its predicted annotations are scored) or a dict of
+    (docid, partid) to the list of predicted annotations of that part (see predictions).
+    Parts without predictions count as parts without any predicted annotation.
+
+    :type gold: nalaf.structures.data.Dataset
+    :type subclass_analysis: bool
+    """
+
+    TOTAL_LABEL = MentionLevelEvaluator.TOTAL_LABEL
+
+    PairedTest = namedtuple('PairedTest', ['difference', 'p_value'])
+
+    METHODS = ('randomization', 'bootstrap')
+
+    def __init__(self, gold, subclass_analysis=False):
+        self.subclass_analysis = subclass_analysis
+        """whether to report the performance for each subclass separately"""
+        self.docids = list(gold.documents)
+        """the ids of the gold documents, in order"""
+        self.index = {(docid, partid): _GoldPart(part.annotations)
+                      for docid, document in gold.documents.items() for partid, part in document.parts.items()}
+        """the gold index of each (docid, partid)"""
+        self.subclasses = {ann.subclass for part in self.index.values() for ann in part.annotations
+                           if ann.subclass is not None}
+        """the subclasses of the gold annotations"""
+
+    @staticmethod
+    def predictions(dataset):
+        """
+        :type dataset: nalaf.structures.data.Dataset
+        :returns the predicted annotations of each part of the dataset
+        :rtype: dict
+        """
+        return {(docid, partid): part.predicted_annotations
+                for docid, document in dataset.documents.items() for partid, part in document.parts.items()}
+
+    def evaluate(self, systems, workers=None):
+        """
+        :param systems: the prediction set of each system name
+        :type systems: dict
+        :param workers: number of worker processes, by default as many as CPUs (but at most one per system)
+        :type workers: int
+        :returns the evaluations of each system
+        :rtype: dict[str, Evaluations]
+        """
+        global _shared_multi_system
+
+        names = list(systems)
+        workers = min(workers or os.cpu_count() or 1, len(names))
+
+        _shared_multi_system = (self, systems)
+        try:
+            if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+                with multiprocessing.get_context('fork').Pool(workers) as pool:
+                    results = pool.map(_score_system, names, chunksize=1)
+            else:
+                results = [_score_system(name) for name in names]
+        finally:
+            _shared_multi_system = None
+
+        ret = {}
+        for name, counts in zip(names, results):
+            evaluations = Evaluations()
+            for label, dic_counts in counts.items():
+                evaluations.add(EvaluationWithStandardError(label, dic_counts))
+            ret[name] = evaluations
+        return ret
+
+    def score(self, predictions):
+        """
+        Counts, for every document, the matches of one prediction set.
+
+        :param predictions: a Dataset or the predicted annotations of each (docid, partid)
+        :returns the counts of each document of each label
+        :rtype: dict[str, dict]
+        """
+        if isinstance(predictions, Dataset):
+            predictions = self.predictions(predictions)
+
+        TOTAL = self.TOTAL_LABEL
+        labels = [TOTAL]
+        if self.subclass_analysis:
+            subclasses = set(self.subclasses)
+            subclasses.update(ann.subclass for annotations in predictions.values() for ann in annotations
+                              if ann.subclass is not None)
+            labels += list(subclasses)
+
+        subcounts = EvaluationWithStandardError.COUNTS
+        counts = {label: {docid: dict.fromkeys(subcounts, 0) for docid in self.docids} for label in labels}
+
+        for (docid, partid), gold in self.index.items():
+            predicted = predictions.get((docid, partid), ())
+            real = gold.annotations
+
+            overlap_real = {label: set() for label in labels}
+            overlap_predicted = {label: set() for label in labels}
+            # the subclass of a predicted annotation is the one of the last gold annotation it overlaps
+            subclasses = []
+
+            for ann in predicted:
+                key = _exact_key(ann)
+                subclass = ann.subclass
+                for index in gold.overlapping(ann):
+                    overlap_real[TOTAL].add(gold.keys[index])
+                    overlap_predicted[TOTAL].add(key)
+                    if self.subclass_analysis:
+                        subclass = real[index].subclass
+                        overlap_real[subclass].add(gold.keys[index])
+                        overlap_predicted[subclass].add(key)
+                subclasses.append(subclass)
+
+            predicted_keys = set()
+            for ann, subclass in zip(predicted, subclasses):
+                key = _exact_key(ann)
+                predicted_keys.add(key)
+                if key in gold.key_set:
+                    counts[TOTAL][docid]['tp'] += 1
+                    if self.subclass_analysis:
+                        counts[subclass][docid]['tp'] += 1
+                else:
+                    counts[TOTAL][docid]['fp'] += 1
+                    if key in overlap_predicted[TOTAL]:
+                        counts[TOTAL][docid]['fp_ov'] += 1
+                    if self.subclass_analysis:
+                        counts[subclass][docid]['fp'] += 1
+                        if key in overlap_predicted[subclass]:
+                            counts[subclass][docid]['fp_ov'] += 1
+
+            for ann, key in zip(real, gold.keys):
+                if key not in predicted_keys:
+                    counts[TOTAL][docid]['fn'] += 1
+                    if key in overlap_real[TOTAL]:
+                        counts[TOTAL][docid]['fn_ov'] += 1
+                    if self.subclass_analysis:
+                        counts[ann.subclass][docid]['fn'] += 1
+                        if key in overlap_real[ann.subclass]:
+                            counts[ann.subclass][docid]['fn_ov'] += 1
+
+        return counts
+
+    @staticmethod
+    def paired_test(evaluation_a, evaluation_b, strictness='exact', measure='f_measure', method='randomization',
+                    n=10000, seed=None, batch_size=2 ** 22):
+        """
+        Tests whether the difference of performance of two systems on the same documents is significant,
+        from their counts of each document:
+            * 'randomization': approximate randomization, the counts of each document are swapped
+                between the systems at random
+            * 'bootstrap': paired bootstrap, the documents are resampled with replacement
+        and the p-value is the (smoothed) fraction of samples with a difference at least as extreme
+        as the observed one (two-sided).
+
+        :type evaluation_a: EvaluationWithStandardError
+        :type evaluation_b: EvaluationWithStandardError
+        :param strictness: see Evaluation.compute
+        :param measure: 'precision', 'recall' or 'f_measure'
+        :param method: one of METHODS
+        :param n: number of samples
+        :param seed: seed of the random generator of the samples, None for a different one every time
+        :param batch_size: maximum number of random numbers drawn at once
+        :returns the observed difference (a - b) and its p-value
+        :rtype: MultiSystemEvaluator.PairedTest
+        """
+        if method not in MultiSystemEvaluator.METHODS:
+            raise ValueError('method must be one of {}, not {}'.format(MultiSystemEvaluator.METHODS, method))
+        column = ('precision', 'recall', 'f_measure').index(measure)
+
+        docids = list(evaluation_a.dic_counts)
+        zero = {}
+        counts_a, counts_b = (
+            np.array([[evaluation.dic_counts.get(docid, zero).get(count, 0)
+                       for count in EvaluationWithStandardError.COUNTS] for docid in docids],
+                     dtype=np.float64).reshape(len(docids), len(EvaluationWithStandardError.COUNTS))
+            for evaluation in (evaluation_a, evaluation_b))
+
+        def differences(sums_a, sums_b):
+            return (_compute_vectorized(sums_a.T, strictness)[column] -
+                    _compute_vectorized(sums_b.T, strictness)[column])
+
+        observed = float(differences(counts_a.sum(axis=0, keepdims=True), counts_b.sum(axis=0, keepdims=True))[0])
+        generator = np.random.default_rng(seed)
+        num_documents = len(docids)
+        step = max(1, batch_size // max(num_documents, 1))
+        extreme = 0
+
+        for first in range(0, n, step):
+            rows = min(step, n - first)
+            if method == 'randomization':
+                swaps = generator.random((rows, num_documents)) < 0.5
+                change = swaps.astype(np.float64).dot(counts_b - counts_a)
+                sampled = differences(counts_a.sum(axis=0) + change, counts_b.sum(axis=0) - change)
+                extreme += int((np.abs(sampled) >= abs(observed) - 1e-12).sum())
+            else:
+                cells = generator.integers(0, num_documents, (rows, num_documents)) if num_documents else \
+                    np.zeros((rows, 0), dtype=np.int64)
+                cells += np.arange(rows)[:, None] * num_documents
+                weights = np.bincount(cells.ravel(), minlength=rows * num_documents).reshape(rows, num_documents)
+                sampled = differences(weights.dot(counts_a), weights.dot(counts_b))
+                # centered at the observed difference, i.e. under the null hypothesis of no difference
+                extreme += int((np.abs(sampled - observed) >= abs(observed) - 1e-12).sum())
+
+        return MultiSystemEvaluator.PairedTest(observed, (extreme + 1) / (n + 1))
+
+    @staticmethod
+    def compare(system_evaluations, label=TOTAL_LABEL, **kwargs):
+        """
+        Paired tests of every pair of systems.
+
+        :param system_evaluations: the evaluations of each system (see evaluate)
+        :type system_evaluations: dict[str, Evaluations]
+        :param label: the label whose evaluations are compared
+        :param kwargs: passed on to paired_test, e.g. strictness, method, n or seed
+        :returns the test of each (name a, name b) pair, in the order of the systems
+        :rtype: dict[(str, str), MultiSystemEvaluator.PairedTest]
+        """
+        names = list(system_evaluations)
+        return {(name_a, name_b): MultiSystemEvaluator.paired_test(system_evaluations[name_a](label),
+                                                                   system_evaluations[name_b](label), **kwargs)
+                for position, name_a in enumerate(names) for name_b in names[position + 1:]}
+
+
+class _GoldPart:
+    """
+    The gold annotations of a part indexed for MultiSystemEvaluator: their exact keys
+    and, for every class, their intervals sorted by start with the running maximum of their ends.
+    """
+
+    def __init__(self, annotations):
+        self.annotations = list(annotations)
+        self.keys = [_exact_key(ann) for ann in self.annotations]
+        self.key_set = set(self.keys)
+        self.intervals = {}
+        """class id: (starts, ends, running maximum of the ends, annotation indices)"""
+
+        classes = {}
+        for index, ann in enumerate(self.annotations):
+            classes.setdefault(ann.class_id, []).append((ann.offset, ann.offset + len(ann.text), index))
+        for class_id, intervals in classes.items():
+            intervals.sort()
+            starts, ends, indices = (list(values) for values in zip(*intervals))
+            self.intervals[class_id] = (starts, ends, list(itertools.accumulate(ends, max)), indices)
+
+    def overlapping(self, ann):
+        """
+        :returns the (sorted) indices of the gold annotations of the same class that overlap
+            the annotation but do not match it exactly
+        :rtype: list[int]
+        """
+        if ann.class_id not in self.intervals:
+            return []
+        starts, ends, max_ends, indices = self.intervals[ann.class_id]
+        start, end = ann.offset, ann.offset + len(ann.text)
+
+        found = []
+        position = bisect.bisect_left(starts, end) - 1
+        while position >= 0 and max_ends[position] > start:
+            if ends[position] > start and not (starts[position] == start and
+                                               self.annotations[indices[position]].text == ann.text):
+                found.append(indices[position])
+            position -= 1
+        found.sort()
+        return found
+
+
+_shared_multi_system = None
+"""(evaluator, systems) inherited by the forked workers of MultiSystemEvaluator.evaluate"""
+
+
+def _score_system(name):
+    evaluator, systems = _shared_multi_system
+    return evaluator.score(systems[name])
+
+
+class _Ids(dict):
+    """dict that assigns the next integer id to every missing key"""
+
+    def __missing__(self, key):
+        value = self[key] = len(self)
+        return value
@@ -0,0 +1,473 @@
+import re
+import os
+import multiprocessing
+import numpy as np
+from nalaf import print_verbose
+
+
+class ParseTree:
+    """
+    A parse tree in bracket notation, e.g. '(S (NP (DT The) (NN cat)) (VP (VBD sat)))',
+    parsed once into compact node arrays (the nodes are numbered in pre-order, the root is 0).
+
+    Labels and productions are interned to integers with a shared symbol table so that
+    node comparisons in the tree kernels are integer comparisons.
+
+    :type labels: list[int]
+    :type children: list[tuple[int]]
+    :type productions: list[int]
+    """
+
+    TOKENS = re.compile(r'\(|\)|[^\s()]+')
+
+    def __init__(self, labels, children, productions):
+        self.labels = labels
+        """the interned label of each node (the words are leaf nodes)"""
+        self.children = children
+        """the children of each node"""
+        self.productions = productions
+        """the interned production (label and labels of the children) of each node, -1 for the leaves"""
+        self.preterminal = [bool(node_children) and all(not children[child] for child in node_children)
+                            for node_children in children]
+        """whether each node is a pre-terminal, i.e. all its children are leaves"""
+        self.by_production = _group(productions)
+        """the nodes of each production"""
+        self.by_label = _group(labels)
+        """the nodes of each label"""
+
+    def __len__(self):
+        return len(self.labels)
+
+    @staticmethod
+    def parse(string, symbols):
+        """
+        :param string: the tree in bracket notation
+        :type string: str
+        :param symbols: the symbol table (label or production to integer) to intern with, which is extended
+        :type symbols: dict
+        :rtype: ParseTree
+        """
+        labels, children = [], []
+        stack = []
+        opened = False
+
+        for token in ParseTree.TOKENS.findall(string):
+            if token == ')':
+                if opened:  # e.g. '()'
+                    opened = False
+                    continue
+                node, node_children = stack.pop()
+                children[node] = tuple(node_children)
+                continue
+
+            if token == '(':
+                if not opened:
+                    opened = True
+                    continue
+                label = ''  # a bracket without label, e.g. the root of '( (S ...))'
+            else:
+                label = token
+
+            node = len(labels)
+            labels.append(symbols.setdefault(('label', label), len(symbols)))
+            children.append(())
+            if stack:
+                stack[-1][1].append(node)
+            if opened:
+                stack.append((node, []))
+                opened = token == '('
+
+        productions = [symbols.setdefault(('production', labels[node], tuple(labels[child] for child in node_children)),
+                                          len(symbols)) if node_children else -1
+                       for node, node_children in enumerate(children)]
+        return ParseTree(labels, children, productions)
+
+
+class TreeKernel:
+    """
+    Convolution tree kernels between parse trees (see Part.sentence_parse_trees), computed in process:
+        * 'sst': subset tree kernel (Collins and Duffy, 2002), the fragments are any subtrees
+            whose nodes keep all their children
+        * 'st': subtree kernel (Vishwanathan and Smola, 2002), the fragments are complete subtrees
+        * 'ptk': partial tree kernel (Moschitti, 2006), the fragments may contain any subsequence
+            of the children of a node
+
+    Each tree string is parsed only once. The node pair computations of a tree pair are memoized,
+    and so are the kernel values of the tree pairs (identical trees are only evaluated once).
+    The rows of a kernel matrix are computed in parallel in forked worker processes.
+
+    :type kind: str
+    :type decay: float
+    :type mu: float
+    :type normalize: bool
+    """
+
+    KINDS = ('sst', 'st', 'ptk')
+
+    def __init__(self, kind='sst', decay=0.4, mu=0.4, normalize=True):
+        if kind not in self.KINDS:
+            raise ValueError('kind must be one of {}, not {}'.format(self.KINDS, kind))
+        self.kind = kind
+        """the tree kernel, one of KINDS"""
+        self.decay = decay
+        """decay factor (lambda) of the size of the fragments (and of the gaps in the children for 'ptk')"""
+        self.mu = mu
+        """decay factor of the height of the fragments ('ptk' only)"""
+        self.normalize = normalize
+        """whether the kernel values are normalized, i.e. K(a, b) / sqrt(K(a, a) * K(b, b))"""
+        self.symbols = {}
+        """symbol table of the labels and productions of the parsed trees"""
+        self.trees = {}
+        """the parsed tree of each tree string"""
+        self.values = {}
+        """the (not normalized) kernel value of each evaluated pair of tree strings"""
+
+    def parse(self, tree):
+        """
+        :type tree: str
+        :rtype: ParseTree
+        """
+        parsed = self.trees.get(tree)
+        if parsed is None:
+            parsed = self.trees[tree] = ParseTree.parse(tree, self.symbols)
+        return parsed
+
+    def clear(self):
+        """
+        Forgets the parsed trees and the memoized kernel values.
+        """
+        self.symbols, self.trees, self.values = {}, {}, {}
+
+    def evaluate(self, first, second):
+        """
+        :type first: ParseTree
+        :type second: ParseTree
+        :returns the (not normalized) kernel value, i.e. the weighted number of common fragments
+        :rtype: float
+        """
+        memo = {}
+        if self.kind == 'ptk':
+            delta, groups = self._ptk_delta, first.by_label
+            other_groups = second.by_label
+        else:
+            delta, groups = self._sst_delta, first.by_production
+            other_groups = second.by_production
+
+        value = 0.0
+        for key, nodes in groups.items():
+            other_nodes = other_groups.get(key)
+            if other_nodes is None or key == -1:
+                continue
+            for node in nodes:
+                for other_node in other_nodes:
+                    value += delta(first, second, node, other_node, memo)
+        return value
+
+    def kernel(self, first, second):
+        """
+        :param first: tree in bracket notation
+        :type first: str
+        :param second: tree in bracket notation
+        :type second: str
+        :rtype: float
+        """
+        return self.matrix([first], [second])[0, 0]
+
+    def matrix(self, rows, columns=None, workers=1):
+        """
+        :param rows: trees in bracket notation
+        :type rows: list[str]
+        :param columns: trees in bracket notation, by default the rows (i.e. the gram matrix)
+        :type columns: list[str]
+        :param workers: number of worker processes, None for as many as CPUs
+        :type workers: int
+        :returns the kernel value of every row and column tree
+        :rtype: numpy.ndarray
+        """
+        global _shared_kernel
+
+        unique_rows, row_index = _unique(rows)
+        if columns is None:
+            unique_columns, column_index = unique_rows, row_index
+        else:
+            unique_columns, column_index = _unique(columns)
+
+        pending = {}
+        for row in unique_rows:
+            for column in unique_columns:
+                if _pair(row, column) not in self.values:
+                    first, second = _pair(row, column)
+                    pending.setdefault(first, set()).add(second)
+        if self.normalize:
+            for tree in set(unique_rows) | set(unique_columns):
+                if (tree, tree) not in self.values:
+                    pending.setdefault(tree, set()).add(tree)
+
+        tasks = [(first, sorted(seconds)) for first, seconds in pending.items()]
+        for first, seconds in tasks:
+            self.parse(first)
+            for second in seconds:
+                self.parse(second)
+
+        workers = min(workers or os.cpu_count() or 1, len(tasks))
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            print_verbose('Tree kernel of {} tree pairs with {} workers'.format(
+                sum(len(seconds) for _, seconds in tasks), workers))
+            _shared_kernel = self
+            try:
+                with multiprocessing.get_context('fork').Pool(workers) as pool:
+                    results = pool.map(_kernel_row, tasks, chunksize=max(1, len(tasks) // (4 * workers)))
+            finally:
+                _shared_kernel = None
+        else:
+            results = [self._row(task) for task in tasks]
+
+        for (first, seconds), values in zip(tasks, results):
+            for second, value in zip(seconds, values):
+                self.values[first, second] = value
+
+        unique_matrix = np.array([[self.values[_pair(row, column)] for column in unique_columns]
+                                  for row in unique_rows], dtype=np.float64).reshape(len(unique_rows),
+                                                                                     len(unique_columns))
+        if self.normalize:
+            row_norms = np.sqrt([self.values[row, row] for row in unique_rows])
+            column_norms = np.sqrt([self.values[column, column] for column in unique_columns])
+            norms = np.outer(row_norms, column_norms)
+            unique_matrix = np.divide(unique_matrix, norms, out=np.zeros_like(unique_matrix), where=norms > 0)
+
+        return unique_matrix[np.ix_(row_index, column_index)]
+
+    def _row(self, task):
+        first, seconds = task
+        return [self.evaluate(self.trees[first], self.trees[second]) for second in seconds]
+
+    def _sst_delta(self, first, second, node, other_node, memo):
+        key = (node, other_node)
+        value = memo.get(key)
+        if value is None:
+            if first.productions[node] == -1 or first.productions[node] != second.productions[other_node]:
+                value = 0.0
+            elif first.preterminal[node]:
+                value = self.decay
+            else:
+                value = self.decay
+                sigma = 1.0 if self.kind == 'sst' else 0.0
+                for child, other_child in zip(first.children[node], second.children[other_node]):
+                    value *= sigma + self._sst_delta(first, second, child, other_child, memo)
+            memo[key] = value
+        return value
+
+    def _ptk_delta(self, first, second, node, other_node, memo):
+        key = (node, other_node)
+        value = memo.get(key)
+        if value is not None:
+            return value
+
+        decay, decay_2 = self.decay, self.decay ** 2
+        if first.labels[node] != second.labels[other_node]:
+            value = 0.0
+        elif not first.children[node] or not second.children[other_node]:
+            value = self.mu * decay_2
+        else:
+            children, other_children = first.children[node], second.children[other_node]
+            n, m = len(children), len(other_children)
+
+            # dps[i][j]: common child subsequences (of the current length) ending exactly at children i and j
+            dps = [[0.0] * (m + 1) for _ in range(n + 1)]
+            total = 0.0
+            for i in range(1, n + 1):
+                for j in range(1, m + 1):
+                    if first.labels[children[i - 1]] == second.labels[other_children[j - 1]]:
+                        dps[i][j] = self._ptk_delta(first, second, children[i - 1], other_children[j - 1], memo)
+                        total += dps[i][j]
+
+            dp = [[0.0] * (m + 1) for _ in range(n + 1)]
+            for length in range(1, min(n, m)):
+                for j in range(m + 1):
+                    dp[length - 1][j] = 0.0
+                for i in range(n + 1):
+                    dp[i][length - 1] = 0.0
+                for i in range(length, n + 1):
+                    for j in range(length, m + 1):
+                        dp[i][j] = dps[i][j] + decay * dp[i - 1][j] + decay * dp[i][j - 1] \
+                            - decay_2 * dp[i - 1][j - 1]
+                        if first.labels[children[i - 1]] == second.labels[other_children[j - 1]]:
+                            dps[i][j] = self._ptk_delta(first, second, children[i - 1], other_children[j - 1],
+                                                        memo) * dp[i - 1][j - 1]
+                            total += dps[i][j]
+
+            value = self.mu * (decay_2 + total)
+
+        memo[key] = value
+        return value
+
+
+class KernelSVM:
+    """
+    Binary support vector machine (L1-loss, with a bias) trained on a precomputed kernel matrix
+    by dual coordinate descent (Hsieh et al., 2008).
+
+    :type c: float
+    :type max_iterations: int
+    :type tolerance: float
+    """
+
+    def __init__(self, c=1.0, max_iterations=1000, tolerance=1e-3, seed=0):
+        self.c = c
+        """trade-off between the training error and the margin"""
+        self.max_iterations = max_iterations
+        """maximum number of passes over the samples"""
+        self.tolerance = tolerance
+        """training stops when the spread of the projected gradient is smaller than this"""
+        self.seed = seed
+        """seed of the order in which the samples are visited"""
+        self.support = None
+        """indices of the training samples that are support vectors, a numpy array"""
+        self.coefficients = None
+        """the dual coefficient (alpha * target) of each support vector, a numpy array"""
+
+    def fit(self, gram, targets):
+        """
+        :param gram: the kernel matrix of the training samples
+        :type gram: numpy.ndarray
+        :param targets: 1 or -1 for every sample
+        :returns self
+        """
+        q = np.asarray(gram, dtype=np.float64) + 1.0  # the bias is learned as the weight of a constant feature
+        targets = np.asarray(targets, dtype=np.float64)
+        n = len(targets)
+        alphas = np.zeros(n)
+        outputs = np.zeros(n)
+        generator = np.random.RandomState(self.seed)
+
+        for _ in range(self.max_iterations):
+            largest, smallest = -np.inf, np.inf
+            for i in generator.permutation(n):
+                gradient = targets[i] * outputs[i] - 1
+                if alphas[i] == 0:
+                    projected = min(gradient, 0.0)
+                elif alphas[i] == self.c:
+                    projected = max(gradient, 0.0)
+                else:
+                    projected = gradient
+                largest, smallest = max(largest, projected), min(smallest, projected)
+
+                if projected != 0 and q[i, i] > 0:
+                    alpha = min(max(alphas[i] - gradient / q[i, i], 0.0), self.c)
+                    outputs += (alpha - alphas[i]) * targets[i] * q[:, i]
+                    alphas[i] = alpha
+            if largest - smallest < self.tolerance:
+                break
+
+        self.support = np.flatnonzero(alphas)
+        self.coefficients = alphas[self.support] * targets[self.support]
+        return self
+
+    def decision_function(self, gram):
+        """
+        :param gram: the kernel values between the samples (rows) and the support vectors (columns)
+        :type gram: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        return (np.asarray(gram, dtype=np.float64) + 1.0).dot(self.coefficients)
+
+    def predict(self, gram):
+        """
+        :param gram: the kernel values between the samples (rows) and the support vectors (columns)
+        :type gram: numpy.ndarray
+        :returns 1 or -1 for every sample
+        :rtype: numpy.ndarray
+        """
+        return np.where(self.decision_function(gram) > 0, 1, -1)
+
+
+def path_enclosed_tree(tree, first, second):
+    """
+    Path-enclosed tree (Zhang et al., 2006) of a pair of entities: the smallest subtree of the parse tree
+    that covers both entities, without the leaves before the first one or after the last one,
+    and with the pre-terminals of the entities marked by wrapping them in E1 and E2 nodes,
+    so that the different pairs of entities of a sentence get different trees.
+
+    :param tree: the parse tree in bracket notation, whose leaves are the tokens of the sentence
+    :type tree: str
+    :param first: the leaf (token) indices of the first entity, as (start, end) with the end excluded
+    :type first: (int, int)
+    :param second: the leaf (token) indices of the second entity
+    :type second: (int, int)
+    :returns the path-enclosed tree in bracket notation
+    :rtype: str
+    """
+    root = _nested(tree)
+    start, end = min(first[0], second[0]), max(first[1], second[1])
+    leaf = [0]
+
+    def prune(node):
+        label, children = node
+        if all(isinstance(child, str) for child in children):  # pre-terminal (or leaf-less node)
+            indices = range(leaf[0], leaf[0] + len(children))
+            leaf[0] += len(children)
+            if not any(start <= index < end for index in indices):
+                return None
+            for mark, (mark_start, mark_end) in (('E2', second), ('E1', first)):
+                if any(mark_start <= index < mark_end for index in indices):
+                    node = (mark, [node])
+            return node
+        pruned = [child for child in (prune(child) for child in children) if child is not None]
+        return (label, pruned) if pruned else None
+
+    root = prune(root)
+    if root is None:
+        raise ValueError('the entities {} and {} are not in the tree {}'.format(first, second, tree))
+    while root[0] not in ('E1', 'E2') and len(root[1]) == 1 and not isinstance(root[1][0], str):
+        root = root[1][0]
+    return _bracket(root)
+
+
+def _nested(tree):
+    """:returns the tree in bracket notation as nested (label, children) pairs, where the leaves are strings"""
+    stack = [('', [])]
+    for token in ParseTree.TOKENS.findall(tree):
+        if token == '(':
+            stack.append((None, []))
+        elif token == ')':
+            label, children = stack.pop()
+            stack[-1][1].append((label or '', children))
+        elif stack[-1][0] is None and not stack[-1][1]:
+            stack[-1] = (token, stack[-1][1])
+        else:
+            stack[-1][1].append(token)
+    children = stack[0][1]
+    return children[0] if len(children) == 1 else ('', children)
+
+
+def _bracket(node):
+    if isinstance(node, str):
+        return node
+    label, children = node
+    return '({} {})'.format(label, ' '.join(_bracket(child) for child in children))
+
+
+_shared_kernel = None
+"""the tree kernel inherited by the forked workers of TreeKernel.matrix"""
+
+
+def _kernel_row(task):
+    return _shared_kernel._row(task)
+
+
+def _pair(first, second):
+    return (first, second) if first <= second else (second, first)
+
+
+def _unique(items):
+    """:returns the unique items in order of appearance and the index of each item among them"""
+    positions = {}
+    index = [positions.setdefault(item, len(positions)) for item in items]
+    return list(positions), np.array(index, dtype=np.int64)
+
+
+def _group(values):
+    groups = {}
+    for node, value in enumerate(values):
+        groups.setdefault(value, []).append(node)
+    return groups
@@ -0,0 +1,203 @@
+import os
+import multiprocessing
+import numpy as np
+from nalaf import print_verbose
+
+
+class LinearClassifier:
+    """
+    Binary linear classifier over sparse, integer-indexed features (e.g. Edge.features),
+    trained in process with NumPy instead of an external SVM binary.
+
+    Minimizes 0.5 * ||w||^2 + c * sum(loss(y * (x.w + b))) with L-BFGS, where the loss is either:
+        * 'logistic': log(1 + exp(-z)), i.e. L2-regularized logistic regression
+        * 'squared_hinge': max(0, 1 - z)^2, i.e. L2-loss linear SVM (the default of liblinear)
+
+    The samples are given as a CSR sparse matrix (see nalaf.utils.sparse, e.g. EdgeMatrix.export)
+    and the targets as 1 (positive) or -1 (negative), as set by Dataset.label_edges.
+    Columns that were not seen while training are ignored when predicting.
+
+    Training runs in this process (every L-BFGS iteration is a single vectorized pass over the matrix),
+    while the predictions of large matrices can be computed over blocks of rows in forked worker processes.
+
+    :type loss: str
+    :type c: float
+    :type max_iterations: int
+    :type tolerance: float
+    """
+
+    LOSSES = ('logistic', 'squared_hinge')
+
+    MIN_BLOCK_ROWS = 10000
+    """the minimum number of rows per worker process, below which forking costs more than it saves"""
+
+    def __init__(self, loss='logistic', c=1.0, max_iterations=200, tolerance=1e-5):
+        if loss not in self.LOSSES:
+            raise ValueError('loss must be one of {}, not {}'.format(self.LOSSES, loss))
+        self.loss = loss
+        """the loss function, one of LOSSES"""
+        self.c = c
+        """trade-off between the training error and the regularization (the bigger, the less regularized)"""
+        self.max_iterations = max_iterations
+        """maximum number of L-BFGS iterations"""
+        self.tolerance = tolerance
+        """training stops when the norm of the gradient is smaller than this (relative to the initial one)"""
+        self.weights = None
+        """the learned weight of each column, a numpy array"""
+        self.bias = 0.0
+        """the learned bias (not regularized)"""
+
+    def fit(self, matrix, targets):
+        """
+        :param matrix: one row per sample
+        :type matrix: nalaf.utils.sparse.CSRMatrix
+        :param targets: 1 or -1 for every row
+        :returns self
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        num_columns = matrix.num_columns
+
+        def objective(parameters):
+            weights, bias = parameters[:-1], parameters[-1]
+            margins = targets * (matrix.dot(weights) + bias)
+            if self.loss == 'logistic':
+                loss = np.logaddexp(0, -margins).sum()
+                derivatives = -targets * np.exp(-np.logaddexp(0, margins))
+            else:
+                violations = np.maximum(0, 1 - margins)
+                loss = (violations ** 2).sum()
+                derivatives = -2 * targets * violations
+
+            gradient = np.empty_like(parameters)
+            gradient[:-1] = weights + self.c * matrix.transpose_dot(derivatives)[:num_columns]
+            gradient[-1] = self.c * derivatives.sum()
+            return 0.5 * weights.dot(weights) + self.c * loss, gradient
+
+        parameters = _lbfgs(objective, np.zeros(num_columns + 1), self.max_iterations, self.tolerance)
+        self.weights, self.bias = parameters[:-1], float(parameters[-1])
+        return self
+
+    def decision_function(self, matrix, workers=1):
+        """
+        :type matrix: nalaf.utils.sparse.CSRMatrix
+        :param workers: number of worker processes, each computing a block of rows, None for as many as CPUs
+        :type workers: int
+        :returns the signed distance x.w + b of every row to the separating hyperplane
+        :rtype: numpy.ndarray
+        """
+        global _shared_classifier
+
+        workers = min(workers or os.cpu_count() or 1, len(matrix) // self.MIN_BLOCK_ROWS)
+        if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            return matrix.dot(self.weights) + self.bias
+
+        print_verbose('Linear predictions of {} rows with {} workers'.format(len(matrix), workers))
+        bounds = np.linspace(0, len(matrix), workers + 1).astype(int)
+        _shared_classifier = (self, matrix)
+        try:
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                blocks = pool.map(_decision_block, list(zip(bounds[:-1], bounds[1:])), chunksize=1)
+        finally:
+            _shared_classifier = None
+        return np.concatenate(blocks)
+
+    def predict(self, matrix, workers=1):
+        """
+        :type matrix: nalaf.utils.sparse.CSRMatrix
+        :param workers: see decision_function()
+        :returns 1 or -1 for every row
+        :rtype: numpy.ndarray
+        """
+        return np.where(self.decision_function(matrix, workers) > 0, 1, -1)
+
+    def predict_probability(self, matrix, workers=1):
+        """
+        :type matrix: nalaf.utils.sparse.CSRMatrix
+        :param workers: see decision_function()
+        :returns the probability of the positive class of every row (only meaningful for the logistic loss)
+        :rtype: numpy.ndarray
+        """
+        return np.exp(-np.logaddexp(0, -self.decision_function(matrix, workers)))
+
+    def save(self, file_name):
+        """
+        Saves the learned model as a NumPy .npz file.
+        """
+        with open(file_name, 'wb') as file:
+            np.savez(file, weights=self.weights, bias=self.bias, loss=self.loss, c=self.c)
+
+    @staticmethod
+    def load(file_name):
+        """
+        :returns a classifier with the model saved with save()
+        :rtype: LinearClassifier
+        """
+        with np.load(file_name) as model:
+            classifier = LinearClassifier(str(model['loss']), float(model['c']))
+            classifier.weights, classifier.bias = model['weights'], float(model['bias'])
+        return classifier
+
+
+_shared_classifier = None
+"""(classifier, matrix) inherited by the forked workers of LinearClassifier.decision_function"""
+
+
+def _decision_block(bounds):
+    classifier, matrix = _shared_classifier
+    return matrix.row_block(*bounds).dot(classifier.weights) + classifier.bias
+
+
+def _lbfgs(objective, x, max_iterations, tolerance, memory=10):
+    """
+    Minimizes a smooth function with L-BFGS and a backtracking (Armijo) line search.
+
+    :param objective: returns the value and the gradient of the function at a point
+    :returns the minimizing point
+    """
+    value, gradient = objective(x)
+    initial_norm = np.linalg.norm(gradient)
+    steps, changes = [], []
+
+    for _ in range(max_iterations):
+        if np.linalg.norm(gradient) <= tolerance * max(initial_norm, 1.0):
+            break
+
+        # two-loop recursion
+        direction = -gradient
+        alphas = []
+        for step, change in reversed(list(zip(steps, changes))):
+            alpha = step.dot(direction) / change.dot(step)
+            direction = direction - alpha * change
+            alphas.append(alpha)
+        if steps:
+            direction = direction * steps[-1].dot(changes[-1]) / changes[-1].dot(changes[-1])
+        for (step, change), alpha in zip(zip(steps, changes), reversed(alphas)):
+            beta = change.dot(direction) / change.dot(step)
+            direction = direction + (alpha - beta) * step
+
+        slope = gradient.dot(direction)
+        if slope >= 0:  # not a descent direction, restart from the steepest descent
+            steps, changes = [], []
+            direction, slope = -gradient, -gradient.dot(gradient)
+
+        rate = 1.0 if steps else 1.0 / max(np.linalg.norm(gradient), 1.0)
+        while True:
+            new_x = x + rate * direction
+            new_value, new_gradient = objective(new_x)
+            if new_value <= value + 1e-4 * rate * slope or rate < 1e-10:
+                break
+            rate *= 0.5
+
+        step, change = new_x - x, new_gradient - gradient
+        if change.dot(step) > 1e-10:
+            steps.append(step)
+            changes.append(change)
+            if len(steps) > memory:
+                del steps[0], changes[0]
+
+        converged = abs(value - new_value) <= 1e-12 * max(abs(value), 1.0)
+        x, value, gradient = new_x, new_value, new_gradient
+        if converged:
+            break
+
+    return x
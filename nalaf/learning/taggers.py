@@ -2,7 +2,10 @@ import abc
 import difflib
 from nalaf.utils.ncbi_utils import GNormPlus
 from nalaf.utils.uniprot_utils import Uniprot
+from nalaf.learning.linear import LinearClassifier
+from nalaf.learning.kernels import TreeKernel, KernelSVM, path_enclosed_tree
 from nalaf.structures.data import Entity, Relation
+from nalaf.utils.sparse import EdgeMatrix
 from nalaf.utils import PRO_CLASS_ID, ENTREZ_GENE_ID, UNIPROT_ID
 
 
@@ -114,6 +117,132 @@ class StubSameSentenceRelationExtractor(RelationExtractor):
                         Relation(ann_1.offset, ann_2.offset, ann_1.text, ann_2.text, self.relation_type))
 
 
+class LinearRelationExtractor(RelationExtractor):
+    """
+    Predicts relations with a linear classifier (see nalaf.learning.linear.LinearClassifier)
+    trained in process on the sparse edge features (Edge.features) generated by the relation feature generators.
+
+    Only the edges of the given relation type are considered. All of them are predicted at once in a batch,
+    split into blocks of rows across worker processes if there are many (see LinearClassifier.decision_function).
+
+    :type classifier: nalaf.learning.linear.LinearClassifier
+    :type workers: int
+    """
+
+    def __init__(self, entity1_class, entity2_class, relation_type, classifier=None, workers=1):
+        super().__init__(entity1_class, entity2_class, relation_type)
+        self.classifier = classifier if classifier is not None else LinearClassifier()
+        """the (trained or untrained) linear classifier"""
+        self.workers = workers
+        """number of worker processes predicting the edges, None for as many as CPUs"""
+
+    def train(self, dataset):
+        """
+        Trains the classifier on the edges of the dataset, labeled with Dataset.label_edges.
+
+        :type dataset: nalaf.structures.data.Dataset
+        """
+        dataset.label_edges()
+        edges = EdgeMatrix.export(dataset, self.relation_type)
+        self.classifier.fit(edges.matrix, edges.targets)
+
+    def tag(self, dataset):
+        """
+        Sets the target of every edge and appends the predicted relations to part.predicted_relations.
+
+        :type dataset: nalaf.structures.data.Dataset
+        """
+        edges = EdgeMatrix.export(dataset, self.relation_type)
+        if not len(edges):
+            return
+
+        edges.write_targets(self.classifier.predict(edges.matrix, self.workers))
+        dataset.form_predicted_relations(self.relation_type)
+
+
+class TreeKernelRelationExtractor(RelationExtractor):
+    """
+    Predicts relations with a support vector machine over a tree kernel between the parse trees
+    of the sentences of the edges (see nalaf.learning.kernels), computed in process.
+
+    Only the edges of the given relation type are considered. By default the tree of an edge is the path-enclosed
+    tree of its two entities in the parse tree of its sentence (see edge_tree()), so that the different pairs
+    of entities of a sentence get different trees.
+
+    :type kernel: nalaf.learning.kernels.TreeKernel
+    :type classifier: nalaf.learning.kernels.KernelSVM
+    :type workers: int
+    """
+
+    def __init__(self, entity1_class, entity2_class, relation_type, kernel=None, classifier=None, workers=1,
+                 tree=None):
+        super().__init__(entity1_class, entity2_class, relation_type)
+        self.kernel = kernel if kernel is not None else TreeKernel()
+        """the tree kernel"""
+        self.classifier = classifier if classifier is not None else KernelSVM()
+        """the (trained or untrained) kernel classifier"""
+        self.workers = workers
+        """number of worker processes computing the kernel matrices, None for as many as CPUs"""
+        self.tree = tree if tree is not None else self.edge_tree
+        """function that returns the tree (in bracket notation) of an edge, specific to its pair of entities"""
+        self.support_trees = []
+        """the trees of the support vectors of the trained classifier"""
+
+    def edges(self, dataset):
+        """
+        :type dataset: nalaf.structures.data.Dataset
+        :rtype: list[nalaf.structures.data.Edge]
+        """
+        return [edge for edge in dataset.edges() if edge.relation_type == self.relation_type]
+
+    @staticmethod
+    def edge_tree(edge):
+        """
+        The default tree of an edge: the path-enclosed tree (see nalaf.learning.kernels.path_enclosed_tree)
+        of its entities in the parse tree of its sentence (Part.sentence_parse_trees), which should then be set
+        and have the tokens of the sentence of the edge (Edge.sentence) as leaves.
+
+        :type edge: nalaf.structures.data.Edge
+        :rtype: str
+        """
+        def span(entity):
+            indices = [index for index, token in enumerate(edge.sentence)
+                       if token.start < entity.offset + len(entity.text) and entity.offset < token.end]
+            if not indices:
+                raise ValueError('{} is not in the sentence of the edge'.format(entity))
+            return indices[0], indices[-1] + 1
+
+        return path_enclosed_tree(edge.part.sentence_parse_trees[edge.sentence_id],
+                                  span(edge.entity1), span(edge.entity2))
+
+    def train(self, dataset):
+        """
+        Trains the classifier on the edges of the dataset, labeled with Dataset.label_edges.
+
+        :type dataset: nalaf.structures.data.Dataset
+        """
+        dataset.label_edges()
+        edges = self.edges(dataset)
+        trees = [self.tree(edge) for edge in edges]
+        self.classifier.fit(self.kernel.matrix(trees, workers=self.workers), [edge.target for edge in edges])
+        self.support_trees = [trees[index] for index in self.classifier.support]
+
+    def tag(self, dataset):
+        """
+        Sets the target of every edge and appends the predicted relations to part.predicted_relations.
+
+        :type dataset: nalaf.structures.data.Dataset
+        """
+        edges = self.edges(dataset)
+        if not edges:
+            return
+
+        gram = self.kernel.matrix([self.tree(edge) for edge in edges], self.support_trees, workers=self.workers)
+        for edge, target in zip(edges, self.classifier.predict(gram)):
+            edge.target = int(target)
+        dataset.form_predicted_relations(self.relation_type)
+
+
 class CRFSuiteTagger(Tagger):
     """
     Performs tagging with a binary model using CRFSuite
@@ -0,0 +1,229 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import shutil
+import tempfile
+import itertools
+import multiprocessing
+from nalaf.learning.crfsuite import PyCRFSuite, TaggerPool
+from nalaf.learning.evaluators import MentionLevelEvaluator, Evaluation
+from nalaf.utils import MUT_CLASS_ID
+from nalaf import print_verbose
+
+
+class PyCRFSuiteSearch:
+    """
+    Grid or random search of the training parameters of PyCRFSuite.
+
+    All the candidates are trained concurrently in forked worker processes from one shared
+    CompiledTrainingSet (inherited copy-on-write, i.e. not copied per candidate) and evaluated
+    on a held-out, already prepared, validation dataset with the mention level evaluator.
+    Where fork is not available (or with a single worker) they are trained one after the other in this process.
+
+    A candidate is a dict of pycrfsuite training parameters (e.g. c1, c2, max_iterations,
+    feature.possible_transitions), optionally with the key 'window': the window offsets
+    (see WindowFeatureGenerator) whose features are used, e.g. (-1, 1). Features of other offsets
+    are dropped from the training set, and hence ignored by the resulting model when tagging.
+
+    With successive halving (min_iterations) the candidates are first trained with a small budget
+    of iterations, and only the best 1/eta of them continue with a budget eta times bigger,
+    so that clearly dominated configurations are cut off early.
+
+    :type training_set: nalaf.learning.crfsuite.CompiledTrainingSet
+    :type validation: nalaf.structures.data.Dataset
+    :type class_id: str
+    :type strictness: str
+    :type workers: int
+    """
+
+    WINDOW_KEY = 'window'
+
+    def __init__(self, training_set, validation, class_id=MUT_CLASS_ID, strictness='exact', workers=None):
+        self.training_set = training_set
+        """the compiled training set shared by all candidates"""
+        self.validation = validation
+        """prepared dataset with gold annotations on which the candidates are evaluated"""
+        self.class_id = class_id
+        """the class id of the predicted annotations"""
+        self.strictness = strictness
+        """strictness of the evaluation (see Evaluation.compute) by which candidates are ranked"""
+        self.workers = workers if workers else os.cpu_count() or 1
+        """number of worker processes, by default as many as CPUs"""
+        self.leaderboard = []
+        """
+        (candidate index, round, params, precision, recall, f_measure, seconds)
+        of every training run of the last search
+        """
+
+    @staticmethod
+    def grid(space):
+        """
+        :param space: dict of parameter name to the list of values to try
+        :type space: dict
+        :returns every combination of the values
+        :rtype: list[dict]
+        """
+        names = sorted(space)
+        return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+    @staticmethod
+    def random(space, n, seed=None):
+        """
+        :param space: dict of parameter name to either a list of values to choose from
+            or a callable that receives a random.Random and returns a value (e.g. lambda r: 10 ** r.uniform(-3, 1))
+        :type space: dict
+        :param n: number of candidates
+        :type n: int
+        :rtype: list[dict]
+        """
+        generator = random.Random(seed)
+        names = sorted(space)
+        return [{name: space[name](generator) if callable(space[name]) else generator.choice(space[name])
+                 for name in names}
+                for _ in range(n)]
+
+    def run(self, candidates, leaderboard_file=None, best_model_file=None, min_iterations=None, eta=3):
+        """
+        :type candidates: list[dict]
+        :param leaderboard_file: optional file to write the leaderboard to as tab separated values
+        :param best_model_file: optional file to copy the model of the best candidate to
+        :param min_iterations: optional budget of max_iterations of the first round of successive halving;
+            the last round trains with the max_iterations of each candidate (by default 100)
+        :type min_iterations: int
+        :param eta: fraction (1/eta) of candidates that continue to the next round and factor of the budget increase,
+            greater than 1
+        :type eta: int
+        :returns the params of the best candidate and its f_measure
+        :rtype: (dict, float)
+        """
+        global _shared_search
+
+        if eta <= 1:
+            raise ValueError('eta must be greater than 1, not {}'.format(eta))
+        if min_iterations is not None and min_iterations <= 0:
+            raise ValueError('min_iterations must be positive, not {}'.format(min_iterations))
+
+        if min_iterations:
+            max_iterations = max(candidate.get('max_iterations', 100) for candidate in candidates)
+            budgets = []
+            budget = min_iterations
+            while budget < max_iterations:
+                budgets.append(budget)
+                budget *= eta
+            budgets.append(None)  # the max_iterations of each candidate
+        else:
+            budgets = [None]
+
+        model_directory = tempfile.mkdtemp()
+        _shared_search = (self, model_directory)
+        self.leaderboard = []
+        alive = list(range(len(candidates)))
+
+        # the workers inherit the shared search through fork, otherwise the candidates are trained serially
+        workers = min(self.workers, len(candidates))
+        pool = None
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            pool = multiprocessing.get_context('fork').Pool(workers)
+
+        try:
+            for round_nr, budget in enumerate(budgets):
+                tasks = []
+                for index in alive:
+                    params = dict(candidates[index])
+                    if budget is not None:
+                        params['max_iterations'] = min(budget, params.get('max_iterations', budget))
+                    tasks.append((index, round_nr, params))
+
+                if pool is not None:
+                    results = pool.map(_train_candidate, tasks, chunksize=1)
+                else:
+                    results = [_train_candidate(task) for task in tasks]
+                self.leaderboard.extend(results)
+                print_verbose('Search round {} ({} candidates): best f_measure {}'.format(
+                    round_nr, len(results), max(result[5] for result in results)))
+
+                ranked = sorted(results, key=lambda result: (-result[5], result[0]))
+                alive = [result[0] for result in ranked[:max(1, math.ceil(len(ranked) / eta))]]
+
+            best_index, best_round, best_params, _, _, f_measure, _ = ranked[0]
+            if best_model_file:
+                shutil.copyfile(_model_file(model_directory, best_index, best_round), best_model_file)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            _shared_search = None
+            shutil.rmtree(model_directory)
+
+        if leaderboard_file:
+            self.write_leaderboard(leaderboard_file)
+
+        return best_params, f_measure
+
+    def write_leaderboard(self, file_name):
+        """
+        Writes the leaderboard of the last search, best first, as tab separated values.
+        """
+        with open(file_name, 'w') as file:
+            file.write('\t'.join(['rank', 'candidate', 'round', 'params', 'precision', 'recall', 'f_measure',
+                                  'seconds']) + '\n')
+            ranked = sorted(self.leaderboard, key=lambda result: (-result[1], -result[5], result[0]))
+            for rank, (index, round_nr, params, precision, recall, f_measure, seconds) in enumerate(ranked, 1):
+                file.write('{}\t{}\t{}\t{}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.1f}\n'.format(
+                    rank, index, round_nr, json.dumps(params, sort_keys=True), precision, recall, f_measure, seconds))
+
+
+_shared_search = None
+"""(search, model directory) inherited by the forked workers of PyCRFSuiteSearch.run"""
+
+
+def _model_file(model_directory, index, round_nr):
+    return os.path.join(model_directory, 'candidate_{}_{}.model'.format(index, round_nr))
+
+
+def _train_candidate(task):
+    """
+    Trains and evaluates one candidate (in a worker process of PyCRFSuiteSearch.run)
+
+    :returns (candidate index, round, params, precision, recall, f_measure, seconds)
+    """
+    search, model_directory = _shared_search
+    index, round_nr, params = task
+    start = time.time()
+
+    training_params = dict(params)
+    window = training_params.pop(PyCRFSuiteSearch.WINDOW_KEY, None)
+    if window is None:
+        sequences = search.training_set
+    else:
+        offsets = set(window) | {0}
+        sequences = search.training_set.select(lambda attribute: _window_offset(attribute) in offsets)
+
+    model_file = _model_file(model_directory, index, round_nr)
+    PyCRFSuite.train_stream(sequences, model_file, training_params)
+
+    validation = search.validation
+    for part in validation.parts():
+        part.predicted_annotations = [ann for ann in part.predicted_annotations if ann.class_id != search.class_id]
+    try:
+        PyCRFSuite.tag(validation, model_file, search.class_id)
+    finally:
+        TaggerPool.close(model_file)  # the temporary model is deleted after the search
+
+    total = MentionLevelEvaluator().evaluate(validation)(MentionLevelEvaluator.TOTAL_LABEL)
+    computation = Evaluation(total.label, total.tp, total.fp, total.fn, total.fp_ov, total.fn_ov).compute(
+        search.strictness)
+
+    return (index, round_nr, params, computation.precision, computation.recall, computation.f_measure,
+            time.time() - start)
+
+
+def _window_offset(attribute):
+    """
+    :returns the window offset of the feature of an attribute, e.g. -1 for 'stem[-1]:walk'
+    :rtype: int
+    """
+    match = re.match(r'[^:]*\[(-?[0-9]+)\]', attribute)
+    return int(match.group(1)) if match else 0
@@ -0,0 +1,154 @@
+import abc
+import copy
+import re
+from nalaf.structures.data import Dataset, Document
+
+
+class Prefilter:
+    """
+    Abstract class for cheaply deciding, before any feature generation, which sentences
+    may contain something worth tagging. The rest of the sentences are skipped by the feature generators
+    and by the tagger (their tokens are simply labeled 'O').
+    Subclasses that inherit this class should:
+    * Be named [Name]Prefilter
+    * Implement the abstract method keep
+    * Rather keep too many sentences than too few: every skipped mention is lost recall
+    """
+
+    accumulated_state = ('sentences', 'skipped', 'skipped_annotations', 'skipped_predicted_annotations')
+    """the counters, left out of PrepareDatasetPipeline.fingerprint() (see FeatureGenerator.accumulated_state)"""
+
+    def __init__(self, class_id=None):
+        self.class_id = class_id
+        """the class of the annotations counted by the recall-safety counters, by default all of them"""
+        self.sentences = 0
+        """number of sentences seen by count()"""
+        self.skipped = 0
+        """number of sentences skipped among them"""
+        self.skipped_annotations = 0
+        """
+        recall-safety counter: number of gold annotations that overlap a skipped sentence,
+        only meaningful on annotated (e.g. validation) data, always 0 at inference
+        """
+        self.skipped_predicted_annotations = 0
+        """
+        recall-safety counter for inference: number of annotations already predicted by an upstream annotator
+        (e.g. a dictionary or GNormPlus) when the dataset is prefiltered that overlap a skipped sentence
+        """
+
+    @abc.abstractmethod
+    def keep(self, sentence):
+        """
+        :param sentence: the text of the sentence
+        :type sentence: str
+        :returns whether the sentence may contain a mention
+        :rtype: bool
+        """
+        return True
+
+    def apply(self, dataset):
+        """
+        Records in each part the indices of the sentences that fail the prefilter (see Part.prefiltered_sentences).
+
+        :type dataset: nalaf.structures.data.Dataset
+        :returns a shadow dataset of the same parts with only the sentences that pass the prefilter,
+            sharing the tokens with the given dataset, to run the feature generators on
+        :rtype: nalaf.structures.data.Dataset
+        """
+        shadow = Dataset()
+        for doc_id, document in dataset.documents.items():
+            shadow_document = Document()
+            for part_id, part in document.parts.items():
+                texts = part.sentences_
+                if len(texts) != len(part.sentences):
+                    texts = [' '.join(token.word for token in sentence) for sentence in part.sentences]
+                part.prefiltered_sentences = {index for index, text in enumerate(texts) if not self.keep(text)}
+
+                shadow_part = copy.copy(part)
+                shadow_part.sentences = [sentence for index, sentence in enumerate(part.sentences)
+                                         if index not in part.prefiltered_sentences]
+                shadow_part.sentences_ = [text for index, text in enumerate(texts)
+                                          if index not in part.prefiltered_sentences]
+                shadow_document.parts[part_id] = shadow_part
+            shadow.documents[doc_id] = shadow_document
+        return shadow
+
+    def count(self, dataset):
+        """
+        Updates the counters with the sentences of the dataset,
+        which must already have been prefiltered (see apply()).
+        The gold annotations are counted in skipped_annotations and the predicted ones in
+        skipped_predicted_annotations.
+
+        :type dataset: nalaf.structures.data.Dataset
+        """
+        for part in dataset.parts():
+            self.sentences += len(part.sentences)
+            self.skipped += len(part.prefiltered_sentences)
+
+            for index in part.prefiltered_sentences:
+                sentence = part.sentences[index]
+                if not sentence:
+                    continue
+                start, end = sentence[0].start, sentence[-1].end
+                self.skipped_annotations += self._count_overlapping(part.annotations, start, end)
+                self.skipped_predicted_annotations += self._count_overlapping(part.predicted_annotations, start, end)
+
+    def _count_overlapping(self, annotations, start, end):
+        return sum(1 for ann in annotations
+                   if (self.class_id is None or ann.class_id == self.class_id)
+                   and ann.offset < end and start < ann.offset + len(ann.text))
+
+    def __repr__(self):
+        return '{}(sentences: {}, skipped: {}, skipped annotations: {}, skipped predicted annotations: {})'.format(
+            type(self).__name__, self.sentences, self.skipped, self.skipped_annotations,
+            self.skipped_predicted_annotations)
+
+
+class PatternPrefilter(Prefilter):
+    """
+    Keeps the sentences in which any of the given regular expressions is found.
+
+    Implements the abstract class Prefilter.
+
+    :type patterns: collections.Iterable[str | re.__Regex]
+    """
+
+    def __init__(self, patterns, class_id=None):
+        super().__init__(class_id)
+        self.patterns = [re.compile(pattern) if isinstance(pattern, str) else pattern for pattern in patterns]
+        """the compiled regular expressions"""
+
+    def keep(self, sentence):
+        return any(pattern.search(sentence) for pattern in self.patterns)
+
+
+class MutationPrefilter(PatternPrefilter):
+    """
+    Keeps the sentences that contain something that looks like a mutation mention,
+    based on the building blocks used by TmVarLabeler:
+    * HGVS-like prefixes followed by a position or a symbol, e.g. c.A100G, p.V100Q, g.-12
+    * digits adjacent to one letter amino acid or nucleotide codes, e.g. R7X, 1234A>G
+    * digits adjacent to three letter amino acid codes, e.g. Arg7Ter, Gly 12
+    * dbSNP ids, e.g. rs1234
+    * full amino acid names and mutation types, e.g. glycine to alanine, 12delAG, IVS2, frameshift
+
+    Implements the abstract class Prefilter.
+    """
+
+    amino_acids_3 = 'ala|arg|asn|asp|cys|gln|glu|gly|his|ile|leu|lys|met|phe|pro|ser|thr|trp|tyr|val|ter|sec|pyl|stop'
+
+    amino_acids = ('alanine|arginine|asparagine|aspartate|aspartic|cysteine|glutamine|glutamate|glutamic|glycine|'
+                   'histidine|isoleucine|leucine|lysine|methionine|phenylalanine|proline|serine|threonine|'
+                   'tryptophan|tyrosine|valine')
+
+    default_patterns = [
+        r'\b[cgrmpn]\.\s?[-+*(]?\s?[0-9A-Z]',
+        r'[A-Z*]\d+[A-Z*]|\d+\s?[ACGTUacgtu]\s?(?:>|->|-->|/|to)\s?[ACGTUacgtu]\b',
+        r'(?i:\b(?:{0})\s?\d+|\d+\s?(?:{0})\b)'.format(amino_acids_3),
+        r'(?i:\brs\s?\d+)',
+        r'(?i:{}|\d(?:del|ins|dup|inv)|\bivs\s?\d|\b(?:delins|indel|frameshift|fs\*?\d*x?)\b)'.format(amino_acids),
+    ]
+
+    def __init__(self, patterns=None, class_id=None):
+        super().__init__(patterns if patterns is not None else self.default_patterns, class_id)
@@ -12,6 +12,7 @@ class Tokenizer:
     * Be named [Name]Tokenizer
     * Implement the abstract method tokenize
     * Append new sub-items to each list of the list field "sentences" of each Part in the dataset
+    * Clear the field "prefiltered_sentences" of each Part, whose indices refer to the former sentences
     """
 
     @abc.abstractmethod
@@ -30,6 +31,7 @@ class NLTKTokenizer(Tokenizer):
         for part in dataset.parts():
             so_far = 0
             part.sentences = []
+            part.prefiltered_sentences = set()
             for index, sentence_ in enumerate(part.sentences_):
                 part.sentences.append([])
                 for token_word in word_tokenize(sentence_):
@@ -50,6 +52,7 @@ class TmVarTokenizer(Tokenizer):
         for part in dataset.parts():
             so_far = 0
             part.sentences = []
+            part.prefiltered_sentences = set()
             for index, sentence_ in enumerate(part.sentences_):
                 sentence = sentence_
                 sentence = re.sub('([0-9])([A-Za-z])', r'\1 \2', sentence)
@@ -2,6 +2,7 @@ from collections import OrderedDict
 from itertools import chain
 import json
 import random
+import sys
 from nalaf.utils import MUT_CLASS_ID
 import re
 from nalaf.utils.qmath import arithmetic_mean
@@ -125,6 +126,92 @@ class Dataset:
             for edge in part.edges:
                 yield edge
 
+    def batches(self, batch_size):
+        """
+        helper function that splits the dataset into consecutive batches of documents.
+        The batches share the same Document objects with this dataset.
+
+        :param batch_size: number of documents in each batch
+        :type batch_size: int
+        :rtype: collections.Iterable[Dataset]
+        """
+        batch = Dataset()
+        for doc_id, document in self.documents.items():
+            batch.documents[doc_id] = document
+            if len(batch) == batch_size:
+                yield batch
+                batch = Dataset()
+        if len(batch) > 0:
+            yield batch
+
+    RELEASE_STAGES = ('features', 'sentences', 'edges', 'labels', 'tokens')
+    """what release() can drop, in the order in which it is usually no longer needed"""
+
+    def release(self, stage='features'):
+        """
+        Drops intermediate state that is no longer needed, e.g. before writing out the predictions,
+        so that it can be garbage collected. The text, the annotations and the relations
+        (gold and predicted) are always kept. The stages are:
+        * features: the features of the tokens and of the edges
+        * sentences: the raw sentence strings (Part.sentences_) and the parse trees of the sentences
+        * edges: the edges (candidate relations) of the parts
+        * labels: the original and the predicted labels of the tokens
+        * tokens: the tokenized sentences themselves (implies all the above except edges)
+
+        The stages of the pipeline release what they consumed when asked to (see the release parameters of
+        PyCRFSuite.train, PyCRFSuite.tag, PyCRFSuite.tag_batches and EvaluationAccumulator.add),
+        and PyCRFSuite.labelled_sequences releases the tokens of every batch once consumed by training.
+
+        :param stage: one of RELEASE_STAGES, an iterable of them, or 'all'
+        :type stage: str | collections.Iterable[str]
+        :returns an estimate of the number of bytes freed (the objects no longer referenced by the dataset)
+        :rtype: int
+        """
+        stages = set(self.RELEASE_STAGES if stage == 'all' else [stage] if isinstance(stage, str) else stage)
+        unknown = stages.difference(self.RELEASE_STAGES)
+        if unknown:
+            raise ValueError('unknown stages {}, expected any of {}'.format(sorted(unknown), self.RELEASE_STAGES))
+
+        seen = set()
+        freed = 0
+        for part in self.parts():
+            if 'features' in stages:
+                for sentence in part.sentences:
+                    for token in sentence:
+                        if token.features:
+                            freed += _deep_sizeof(token.features, seen)
+                            token.features = FeatureDictionary()
+                for edge in part.edges:
+                    if edge.features:
+                        freed += _deep_sizeof(edge.features, seen)
+                        edge.features = {}
+            if 'sentences' in stages:
+                freed += _deep_sizeof(part.sentences_, seen) + _deep_sizeof(part.sentence_parse_trees, seen)
+                part.sentences_ = []
+                part.sentence_parse_trees = []
+            if 'edges' in stages:
+                if 'tokens' not in stages:
+                    seen.update(id(sentence) for sentence in part.sentences)  # still referenced by the part
+                freed += _deep_sizeof(part.edges, seen, shallow=(Part, Entity, Token))
+                part.edges = []
+            if 'labels' in stages:
+                for sentence in part.sentences:
+                    for token in sentence:
+                        freed += _deep_sizeof(token.original_labels, seen) + _deep_sizeof(token.predicted_labels, seen)
+                        token.original_labels = None
+                        token.predicted_labels = None
+            if 'tokens' in stages:
+                # the edges still refer to their sentence
+                kept = {id(edge.sentence) for edge in part.edges}
+                freed += sum(_deep_sizeof(sentence, seen) for sentence in part.sentences if id(sentence) not in kept)
+                freed += _deep_sizeof(part.tokens, seen)
+                part.sentences = [[]]
+                part.tokens = []
+                part.prefiltered_sentences = set()
+
+        print_verbose('Released {} of the dataset: {} bytes'.format(', '.join(sorted(stages)), freed))
+        return freed
+
     def purge_false_relationships(self):
         """
         cleans false relationships by validating them
@@ -220,7 +307,7 @@ class Dataset:
                         part.predicted_annotations.append(Entity(class_id, start, part.text[start:end], confidence))
                     index += 1
 
-    def form_predicted_relations(self):
+    def form_predicted_relations(self, relation_type=None):
         """
         Populates part.predicted_relations with a list of Relation objects
         based on the values of the field target for each edge.
@@ -229,10 +316,13 @@ class Dataset:
         of different classes. Each relation is given by a relation type.
 
         Requires edge.target to be set for each edge.
+
+        :param relation_type: only consider the edges of this relation type, by default all of them
+        :type relation_type: str
         """
         for part in self.parts():
             for edge in part.edges:
-                if edge.target == 1:
+                if edge.target == 1 and (relation_type is None or edge.relation_type == relation_type):
                     part.predicted_relations.append(Relation(edge.entity1.offset,
                                                         edge.entity2.offset,
                                                         edge.entity1.text,
@@ -465,15 +555,10 @@ class Dataset:
         empty_sentence = lambda s: all(t.original_labels[0].value == 'O' for t in s)
 
         for part in self.parts():
-            tmp = []
-            tmp_ = []
-            for index, sentence in enumerate(part.sentences):
-                do_use = not empty_sentence(sentence) or filterin(part.sentences_[index]) or random.uniform(0, 1) < percent_to_keep
-                if do_use:
-                    tmp.append(sentence)
-                    tmp_.append(part.sentences_[index])
-            part.sentences = tmp
-            part.sentences_ = tmp_
+            part.select_sentences(
+                index for index, sentence in enumerate(part.sentences)
+                if not empty_sentence(sentence) or filterin(part.sentences_[index])
+                or random.uniform(0, 1) < percent_to_keep)
 
     def prune_sentences(self, percent_to_keep=0):
         """
@@ -494,10 +579,10 @@ class Dataset:
                 chosen = random.sample(false_indices, round(percent_to_keep*len(false_indices)))
 
                 # keep the sentence if it has a mention or it was chosen randomly
-                part.sentences = [sentence for index, sentence in enumerate(part.sentences)
-                                  if sentences_have_ann[index] or index in chosen]
+                part.select_sentences(index for index in range(len(part.sentences))
+                                      if sentences_have_ann[index] or index in chosen)
             else:
-                part.sentences = []
+                part.select_sentences([])
 
     def delete_subclass_annotations(self, subclasses, predicted=True):
         """
@@ -685,6 +770,29 @@ class Dataset:
         return train, test
 
 
+def _deep_sizeof(obj, seen, shallow=()):
+    """
+    :returns the size in bytes of the object and of everything it (recursively) refers to,
+        not counting the objects in seen (which is updated) and not following the instances of the shallow types
+    :rtype: int
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(_deep_sizeof(key, seen, shallow) + _deep_sizeof(value, seen, shallow)
+                          for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(_deep_sizeof(item, seen, shallow) for item in obj)
+    if hasattr(obj, '__dict__') and not isinstance(obj, shallow):
+        return size + _deep_sizeof(vars(obj), seen, shallow)
+    return size
+
+
 class Document:
     """
     Class representing a single document, for example an article from PubMed.
@@ -748,7 +856,7 @@ class Document:
         :return: set of all relations (ignoring the text offset and
         considering only the relation text)
         """
-        relations = []
+        relations = set()
         for part in self:
             if predicted:
                 relation_list = part.predicted_relations
@@ -756,13 +864,31 @@ class Document:
                 relation_list = part.relations
             for rel in relation_list:
                 entity1, relation_type, entity2 = rel.get_relation_without_offset()
-                if entity1 < entity2:
-                    relation_string = entity1+' '+relation_type+' '+entity2
-                else:
-                    relation_string = entity2+' '+relation_type+' '+entity1
-                if relation_string not in relations and relation_type == rel_type:
-                    relations.append(relation_string)
-        return set(relations)
+                if relation_type == rel_type:
+                    if entity1 < entity2:
+                        relations.add(entity1+' '+relation_type+' '+entity2)
+                    else:
+                        relations.add(entity2+' '+relation_type+' '+entity1)
+        return relations
+
+    def relation_keys(self, predicted=False, match_case=True):
+        """
+        The unique relations of each relation type, as canonical (undirected) keys.
+
+        :param predicted: iterate through predicted relations or true relations
+        :type predicted: bool
+        :param match_case: if False, the texts of the entities are lower cased (before ordering them)
+        :type match_case: bool
+        :return: for each relation type the set of (text of the first entity, text of the second entity),
+            ordered alphabetically
+        :rtype: dict[str, set[(str, str)]]
+        """
+        keys = {}
+        for part in self:
+            for rel in (part.predicted_relations if predicted else part.relations):
+                text1, text2 = (rel.text1, rel.text2) if match_case else (rel.text1.lower(), rel.text2.lower())
+                keys.setdefault(rel.class_id, set()).add((text1, text2) if text1 < text2 else (text2, text1))
+        return keys
 
     def relations(self):
         """  helper function for providing an iterator of relations on document level """
@@ -933,6 +1059,26 @@ class Part:
         self.sentence_parse_trees = []
         """the parse trees for each sentence stored as a string. TODO this may be too relna-specific"""
         self.tokens = []
+        self.prefiltered_sentences = set()
+        """
+        indices of the sentences skipped by a prefilter (see nalaf.preprocessing.prefilters),
+        i.e. without features and labeled 'O' by the tagger
+        """
+
+    def select_sentences(self, indices):
+        """
+        Keeps only the sentences with the given indices (and their texts in sentences_),
+        renumbering the indices of the prefiltered sentences accordingly.
+
+        :param indices: the indices of the sentences to keep, in increasing order
+        :type indices: collections.Iterable[int]
+        """
+        indices = list(indices)
+        if len(self.sentences_) == len(self.sentences):
+            self.sentences_ = [self.sentences_[index] for index in indices]
+        self.prefiltered_sentences = {new_index for new_index, index in enumerate(indices)
+                                      if index in self.prefiltered_sentences}
+        self.sentences = [self.sentences[index] for index in indices]
 
     def get_sentence_string_array(self):
         """ :returns an array of string in which each index contains one sentence in type string with spaces between tokens """
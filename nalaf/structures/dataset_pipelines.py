@@ -4,7 +4,18 @@ from nalaf.features.stemming import PorterStemFeatureGenerator
 from nalaf.features.window import WindowFeatureGenerator
 from nalaf.preprocessing.spliters import NLTKSplitter, Splitter
 from nalaf.preprocessing.tokenizers import TmVarTokenizer, Tokenizer
+from nalaf.preprocessing.prefilters import Prefilter
+from nalaf.structures.data import Dataset, Document, Token
+from nalaf.utils.scheduling import LengthBucketedScheduler
 from nalaf import print_verbose
+import hashlib
+import multiprocessing
+import copy
+import io
+import socket
+import subprocess
+import threading
+import types
 
 
 class PrepareDatasetPipeline:
@@ -20,9 +31,12 @@ class PrepareDatasetPipeline:
     :param tokenizer: the module responsible for splitting the sentences into tokens
     :type feature_generators: collections.Iterable[FeatureGenerator]
     :param feature_generators: one or more modules responsible for generating features
+    :type prefilter: nalaf.preprocessing.prefilters.Prefilter
+    :param prefilter: optional module that decides, after the tokenizer, which sentences are worth tagging;
+        the (leading shardable) feature generators only run on those
     """
 
-    def __init__(self, splitter=None, tokenizer=None, feature_generators=None):
+    def __init__(self, splitter=None, tokenizer=None, feature_generators=None, prefilter=None):
         if not splitter:
             splitter = NLTKSplitter()
         if not tokenizer:
@@ -51,16 +65,162 @@ class PrepareDatasetPipeline:
         else:
             raise TypeError('not an instance or iterable of instances that implements FeatureGenerator')
 
-    def execute(self, dataset):
+        if prefilter is None or isinstance(prefilter, Prefilter):
+            self.prefilter = prefilter
+        else:
+            raise TypeError('not an instance that implements Prefilter')
+
+    def execute(self, dataset, cache=None, workers=1, chunk_size=None):
         """
         :type dataset: nalaf.structures.data.Dataset()
+        :param cache: optional cache of already prepared parts, see execute_cached()
+        :type cache: nalaf.utils.cache.ContentAddressedCache
+        :param workers: number of processes to shard the documents across, see execute_parallel()
+        :type workers: int
+        :param chunk_size: maximum number of documents sent to a worker process at a time
+        :type chunk_size: int
         """
+        if cache is not None:
+            return self.execute_cached(dataset, cache, workers, chunk_size)
+        if workers > 1 or self.prefilter is not None:
+            # the prefilter applies to the shardable feature generators, which execute_parallel separates
+            return self.execute_parallel(dataset, workers, chunk_size)
+
         self.splitter.split(dataset)
         self.tokenizer.tokenize(dataset)
+        _clear_prefiltered(dataset)
         for feature_generator in self.feature_generators:
             print_verbose('Apply feature generator:', type(feature_generator))
             feature_generator.generate(dataset)
 
+    def execute_cached(self, dataset, cache, workers=1, chunk_size=None):
+        """
+        Same as execute() but parts whose text was already prepared with the same configuration
+        (see fingerprint()) are restored from the cache instead of being split, tokenized and featurized again.
+
+        Only the leading shardable feature generators are cached,
+        the rest of them are applied afterwards on the whole dataset.
+
+        :type dataset: nalaf.structures.data.Dataset()
+        :type cache: nalaf.utils.cache.ContentAddressedCache
+        """
+        cached_generators, remaining_generators = self._shardable_generators()
+        fingerprint = self.fingerprint()
+
+        missing = Dataset()
+        missing_keys = []
+        for doc_id, document in dataset.documents.items():
+            for part_id, part in document.parts.items():
+                key = cache.key(fingerprint, part.text)
+                state = cache.get(key)
+                if state is None:
+                    missing.documents.setdefault(doc_id, Document()).parts[part_id] = part
+                    missing_keys.append((key, part))
+                else:
+                    restore_part_state(part, state)
+
+        print_verbose('Prepared parts restored from cache: {}, to prepare: {}'.format(
+            sum(1 for _ in dataset.parts()) - len(missing_keys), len(missing_keys)))
+
+        if missing_keys:
+            self._execute_shardable(missing, cached_generators, workers, chunk_size)
+            for key, part in missing_keys:
+                cache.put(key, part_state(part))
+
+        self._count_prefiltered(dataset)
+
+        for feature_generator in remaining_generators:
+            print_verbose('Apply feature generator:', type(feature_generator))
+            feature_generator.generate(dataset)
+
+    def execute_parallel(self, dataset, workers, chunk_size=None):
+        """
+        Same as execute() but the documents are sharded across a pool of worker processes,
+        each of which runs the splitter, the tokenizer and the leading shardable feature generators.
+        The resulting sentences, tokens and features are merged back into the original parts
+        and are identical to the ones of the serial execution.
+
+        The documents are distributed by size with LengthBucketedScheduler.
+
+        The non-shardable feature generators (and all the ones that follow them) run afterwards
+        in this process on the whole dataset. Shardable generators that keep some state
+        receive the state of their copies in the workers through FeatureGenerator.merge(),
+        in the order of the chunks (not in the order the workers finish), so the merged state is deterministic.
+
+        :type dataset: nalaf.structures.data.Dataset()
+        :type workers: int
+        :type chunk_size: int
+        """
+        shardable_generators, remaining_generators = self._shardable_generators()
+
+        self._execute_shardable(dataset, shardable_generators, workers, chunk_size)
+        self._count_prefiltered(dataset)
+
+        for feature_generator in remaining_generators:
+            print_verbose('Apply feature generator:', type(feature_generator))
+            feature_generator.generate(dataset)
+
+    def _execute_shardable(self, dataset, feature_generators, workers, chunk_size):
+        if workers <= 1:
+            self.splitter.split(dataset)
+            self.tokenizer.tokenize(dataset)
+            if self.prefilter is not None:
+                dataset = self.prefilter.apply(dataset)
+            else:
+                _clear_prefiltered(dataset)
+            for feature_generator in feature_generators:
+                print_verbose('Apply feature generator:', type(feature_generator))
+                feature_generator.generate(dataset)
+            return
+
+        mergeable = [type(generator).merge is not FeatureGenerator.merge for generator in feature_generators]
+
+        scheduler = LengthBucketedScheduler(workers, chunk_size)
+        items = list(dataset.documents.items())
+
+        print_verbose('Prepare {} documents with {} workers'.format(len(items), workers))
+
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        with context.Pool(workers, initializer=_init_worker,
+                          initargs=(self.splitter, self.tokenizer, self.prefilter, feature_generators,
+                                    mergeable)) as pool:
+            results = scheduler.imap(pool, _prepare_chunk, items, ordered=True)
+            for chunk, (states, generator_copies) in results:
+                for (_, document), part_states in zip(chunk, states):
+                    for part, state in zip(document.parts.values(), part_states):
+                        restore_part_state(part, state)
+                for generator, worker_generator in zip(feature_generators, generator_copies):
+                    if worker_generator is not None:
+                        generator.merge(worker_generator)
+
+    def _count_prefiltered(self, dataset):
+        if self.prefilter is not None:
+            self.prefilter.count(dataset)
+            print_verbose('Prefilter:', self.prefilter)
+
+    def _shardable_generators(self):
+        """
+        :returns the longest prefix of feature generators that are shardable and the rest of them
+        """
+        generators = list(self.feature_generators)
+        index = 0
+        while index < len(generators) and generators[index].shardable:
+            index += 1
+        return generators[:index], generators[index:]
+
+    def fingerprint(self):
+        """
+        :returns a hash of the configuration of the splitter, the tokenizer and the feature generators
+        that is stable across processes and runs (contrary to serialize() which may contain memory addresses),
+        and does not change when the modules accumulate state by executing the pipeline;
+        runtime handles of the modules, such as the subprocess of BioLemmatizer, are left out
+        :rtype: str
+        """
+        modules = [self.splitter, self.tokenizer] + list(self.feature_generators)
+        if self.prefilter is not None:
+            modules.append(self.prefilter)
+        return hashlib.sha1('\n'.join(_describe(module) for module in modules).encode('utf-8')).hexdigest()
+
     def serialize(self, dataset, to_file=None):
         """
         :type dataset: nalaf.structures.data.Dataset()
@@ -85,3 +245,117 @@ class PrepareDatasetPipeline:
                 file.writelines('\n'.join(repr(x) for x in features))
 
         return types, features, find_current_git_ref()
+
+
+_worker_modules = None
+
+
+def _init_worker(splitter, tokenizer, prefilter, feature_generators, mergeable):
+    global _worker_modules
+    _worker_modules = (splitter, tokenizer, prefilter, feature_generators, mergeable)
+
+
+def _prepare_chunk(chunk):
+    """
+    Runs in a worker process of PrepareDatasetPipeline.execute_parallel
+
+    :param chunk: list of (doc_id, document)
+    :returns the prepared state of each part of each document and the state of the mergeable generators
+    """
+    splitter, tokenizer, prefilter, feature_generators, mergeable = _worker_modules
+    if any(mergeable):
+        # every chunk starts from the original state so that each state is merged exactly once
+        feature_generators = copy.deepcopy(feature_generators)
+
+    dataset = Dataset()
+    for doc_id, document in chunk:
+        dataset.documents[doc_id] = document
+
+    splitter.split(dataset)
+    tokenizer.tokenize(dataset)
+    if prefilter is not None:
+        dataset = prefilter.apply(dataset)
+    else:
+        _clear_prefiltered(dataset)
+    for feature_generator in feature_generators:
+        feature_generator.generate(dataset)
+
+    states = [[part_state(part) for part in document] for _, document in chunk]
+    generator_copies = [generator if is_mergeable else None
+                        for generator, is_mergeable in zip(feature_generators, mergeable)]
+    return states, generator_copies
+
+
+def _clear_prefiltered(dataset):
+    """
+    Forgets the sentences skipped by the prefilter of a former execution (e.g. of another pipeline)
+    when no prefilter runs, in case the tokenizer did not already.
+    """
+    for part in dataset.parts():
+        part.prefiltered_sentences = set()
+
+
+def part_state(part):
+    """
+    :returns a compact (picklable) representation of the sentences, tokens and features of a prepared part
+    :type part: nalaf.structures.data.Part
+    """
+    return (part.sentences_,
+            [[(token.word, token.start, dict(token.features)) for token in sentence] for sentence in part.sentences],
+            part.prefiltered_sentences)
+
+
+def restore_part_state(part, state):
+    """
+    Inverse of part_state(): sets the sentences, tokens and features of the part.
+
+    :type part: nalaf.structures.data.Part
+    """
+    sentences_, sentences, prefiltered_sentences = state
+    part.sentences_ = sentences_
+    part.prefiltered_sentences = prefiltered_sentences
+    part.sentences = []
+    for sentence in sentences:
+        tokens = []
+        for word, start, features in sentence:
+            token = Token(word, start)
+            token.features.update(features)  # feature names are already normalized
+            tokens.append(token)
+        part.sentences.append(tokens)
+
+
+_RUNTIME_HANDLES = (io.IOBase, subprocess.Popen, socket.socket, threading.Thread, types.ModuleType,
+                    type(threading.Lock()), type(threading.RLock()))
+"""
+types of the attributes that are handles to the resources of the running process (files, subprocesses, locks...)
+rather than configuration, left out of PrepareDatasetPipeline.fingerprint() since they differ from run to run
+"""
+
+
+def _describe(value, depth=3):
+    """
+    Deterministic description of the configuration of a module (its class and its attributes),
+    without the attributes that only accumulate state (see FeatureGenerator.accumulated_state)
+    or are runtime handles (see _RUNTIME_HANDLES).
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return '[{}]'.format(', '.join(_describe(x, depth) for x in value))
+    if isinstance(value, (set, frozenset)):
+        return '{{{}}}'.format(', '.join(sorted(_describe(x, depth) for x in value)))
+    if isinstance(value, dict):
+        return '{{{}}}'.format(', '.join(sorted('{}: {}'.format(_describe(k, depth), _describe(v, depth))
+                                                for k, v in value.items())))
+    if hasattr(value, 'pattern') and hasattr(value, 'flags'):  # compiled regex
+        return 're({!r}, {})'.format(value.pattern, value.flags)
+
+    name = '{}.{}'.format(type(value).__module__, type(value).__qualname__)
+    if callable(value) and hasattr(value, '__qualname__'):
+        return '{}.{}'.format(getattr(value, '__module__', ''), value.__qualname__)
+    if depth > 0 and hasattr(value, '__dict__') and not isinstance(value, _RUNTIME_HANDLES):
+        excluded = getattr(value, 'accumulated_state', ())
+        attributes = {key: attribute for key, attribute in vars(value).items()
+                      if key not in excluded and not isinstance(attribute, _RUNTIME_HANDLES)}
+        return '{}({})'.format(name, _describe(attributes, depth - 1))
+    return name
@@ -1,5 +1,8 @@
 import os
 import json
+import hashlib
+import pickle
+import tempfile
 from nalaf import print_verbose
 import time
 
@@ -62,3 +65,134 @@ class Cacheable:
                 os.makedirs(self.cache_directory)
             with open(self.cache_filename, 'w') as file:
                 json.dump(self.cache, file)
+
+
+class ContentAddressedCache:
+    """
+    Size-bounded on-disk cache of picklable values, where each value is addressed by
+    a hash of the content it was computed from (see ContentAddressedCache.key).
+
+    Every value is stored in its own file under [directory]/[first 2 chars of key]/[key].
+    Files are written to a temporary file first and then atomically moved in place,
+    so several worker processes can read (and write) the same cache concurrently
+    without ever seeing a partially written value.
+
+    When the total size of the cache exceeds max_size_in_bytes, the least recently used
+    values (by file modification time, which is refreshed on every hit) are evicted.
+    """
+
+    def __init__(self, directory=None, max_size_in_bytes=2 ** 30):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.nalaf', 'content_cache')
+        self.directory = directory
+        """the directory where the values are stored"""
+        self.max_size_in_bytes = max_size_in_bytes
+        """upper bound for the total size of the stored values, None means unbounded"""
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    @staticmethod
+    def key(*components):
+        """
+        :param components: strings that together uniquely determine the cached value
+        :return: hex digest to be used as key
+        :rtype: str
+        """
+        digest = hashlib.sha1()
+        for component in components:
+            digest.update(component.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except (EOFError, pickle.UnpicklingError):
+            print_verbose('ignoring corrupt cache entry {}'.format(path))
+            self.misses += 1
+            return default
+
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass  # evicted in the meantime by another process
+        self.hits += 1
+        return value
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try:
+            old_size = os.path.getsize(path)  # the value is overwritten
+        except OSError:
+            old_size = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self.max_size_in_bytes is not None:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += os.path.getsize(path) - old_size
+            if self._size > self.max_size_in_bytes:
+                self.evict()
+
+    def _entries(self):
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.startswith('.tmp'):
+                    path = os.path.join(root, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        """:returns the total size in bytes of all the stored values"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_size_in_bytes=None):
+        """
+        Removes the least recently used values until the cache fits into max_size_in_bytes
+        (by default the one given at construction).
+        """
+        if max_size_in_bytes is None:
+            max_size_in_bytes = self.max_size_in_bytes
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_size_in_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # already evicted by another process
+            total -= size
+
+        print_verbose('cache {} evicted down to {} bytes'.format(self.directory, total))
+        self._size = total
+
+    def clear(self):
+        self.evict(max_size_in_bytes=0)
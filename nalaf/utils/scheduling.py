@@ -0,0 +1,122 @@
+import math
+from nalaf import print_debug
+
+
+class LengthBucketedScheduler:
+    """
+    Distributes documents over a pool of worker processes so that the wall-clock time
+    approaches the total work divided by the number of workers,
+    even when the document sizes range from short abstracts to long full texts.
+
+    * The work of a document is estimated by its number of tokens (see estimate_cost)
+    * The documents are bucketed by the order of magnitude (powers of 2) of their cost
+    * Within a bucket, documents are grouped into chunks of roughly the same cost;
+      documents bigger than the target chunk cost form a chunk on their own
+    * The chunks are submitted largest first, and every idle worker takes the next chunk
+      from the shared queue (i.e. work is stolen by whoever is free), so that the many small
+      chunks at the end fill up the gaps left by the big ones
+
+    :type workers: int
+    :type chunk_size: int
+    :type chunks_per_worker: int
+    :type chars_per_token: float
+    """
+
+    def __init__(self, workers, chunk_size=None, chunks_per_worker=4, chars_per_token=5.0):
+        self.workers = workers
+        """number of worker processes"""
+        self.chunk_size = chunk_size
+        """optional maximum number of documents in a chunk"""
+        self.chunks_per_worker = chunks_per_worker
+        """how many chunks (on average) each worker should get, the more, the finer the balancing"""
+        self.chars_per_token = chars_per_token
+        """used to estimate the number of tokens of not yet tokenized documents"""
+
+    def estimate_cost(self, document):
+        """
+        :returns the number of tokens of the document if it is already tokenized,
+        otherwise an estimate based on the number of characters
+        :type document: nalaf.structures.data.Document
+        :rtype: float
+        """
+        tokens = sum(len(sentence) for part in document for sentence in part.sentences)
+        if tokens:
+            return tokens
+        return max(1.0, document.get_size() / self.chars_per_token)
+
+    def schedule(self, items):
+        """
+        :param items: list of (key, document)
+        :returns list of chunks, each a list of (key, document), in the order they should be submitted
+        :rtype: list[list[(str, nalaf.structures.data.Document)]]
+        """
+        costs = [self.estimate_cost(document) for _, document in items]
+        total = sum(costs)
+        target = total / max(1, self.workers * self.chunks_per_worker)
+
+        buckets = {}
+        for item, cost in zip(items, costs):
+            buckets.setdefault(int(math.log2(cost)), []).append((cost, item))
+
+        chunks = []
+        for bucket in sorted(buckets, reverse=True):
+            chunk, chunk_cost = [], 0
+            for cost, item in sorted(buckets[bucket], key=lambda x: x[0], reverse=True):
+                chunk.append(item)
+                chunk_cost += cost
+                if chunk_cost >= target or (self.chunk_size and len(chunk) >= self.chunk_size):
+                    chunks.append((chunk_cost, chunk))
+                    chunk, chunk_cost = [], 0
+            if chunk:
+                chunks.append((chunk_cost, chunk))
+
+        # largest first
+        chunks.sort(key=lambda x: x[0], reverse=True)
+
+        print_debug('Scheduled {} documents (estimated cost {}) in {} chunks for {} workers'.format(
+            len(items), total, len(chunks), self.workers))
+
+        return [chunk for _, chunk in chunks]
+
+    def imap(self, pool, function, items, keys_only=False, ordered=False):
+        """
+        Applies function to every chunk of items in the pool as scheduled by schedule().
+
+        :param pool: multiprocessing.Pool
+        :param function: picklable function that receives a chunk (list of (key, document))
+        :param items: list of (key, document)
+        :param keys_only: send only the keys of each chunk to the function,
+            for when the workers already have the documents (e.g. inherited through fork)
+        :param ordered: yield the results in the (deterministic) order of the chunks of schedule()
+            instead of in completion order; the chunks are still taken by whichever worker is idle,
+            but the results that complete early are buffered until their turn
+        :returns iterator of (chunk, result)
+        """
+        chunks = self.schedule(items)
+        tasks = [[key for key, _ in chunk] for chunk in chunks] if keys_only else chunks
+        # chunksize=1: every worker takes a single chunk from the queue whenever it is idle
+        results = pool.imap_unordered(_IndexedFunction(function), enumerate(tasks), chunksize=1)
+
+        if not ordered:
+            for index, result in results:
+                yield chunks[index], result
+            return
+
+        pending = {}
+        next_index = 0
+        for index, result in results:
+            pending[index] = result
+            while next_index in pending:
+                yield chunks[next_index], pending.pop(next_index)
+                next_index += 1
+
+
+class _IndexedFunction:
+    """picklable wrapper to know to which chunk the results of imap_unordered correspond"""
+
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, indexed_chunk):
+        index, chunk = indexed_chunk
+        return index, self.function(chunk)
@@ -0,0 +1,363 @@
+import os
+import json
+import zlib
+import numpy as np
+from nalaf.features import crfsuite_attributes
+
+
+class CSRMatrix:
+    """
+    Sparse matrix in compressed sparse row (CSR) format, as plain NumPy arrays:
+    the values of row i are data[indptr[i]:indptr[i + 1]] in the columns indices[indptr[i]:indptr[i + 1]].
+
+    The arrays can be saved to a directory and loaded back memory-mapped.
+
+    :type data: numpy.ndarray
+    :type indices: numpy.ndarray
+    :type indptr: numpy.ndarray
+    :type num_columns: int
+    """
+
+    ARRAYS = ('data', 'indices', 'indptr')
+
+    def __init__(self, data, indices, indptr, num_columns=None):
+        self.data = np.asanyarray(data, dtype=np.float64)
+        """the stored values"""
+        self.indices = np.asanyarray(indices, dtype=np.int64)
+        """the column of each stored value"""
+        self.indptr = np.asanyarray(indptr, dtype=np.int64)
+        """the position of the first stored value of each row (and the number of stored values at the end)"""
+        if num_columns is None:
+            num_columns = int(self.indices.max()) + 1 if len(self.indices) else 0
+        self.num_columns = num_columns
+        """the number of columns"""
+
+    @property
+    def shape(self):
+        return len(self.indptr) - 1, self.num_columns
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def row_block(self, start, end):
+        """
+        :returns the rows start to end (excluded) as a matrix that shares the arrays of this one
+        :rtype: CSRMatrix
+        """
+        begin, finish = self.indptr[start], self.indptr[end]
+        return CSRMatrix(self.data[begin:finish], self.indices[begin:finish], self.indptr[start:end + 1] - begin,
+                         self.num_columns)
+
+    def row_ids(self):
+        """
+        :returns the row of every stored value
+        :rtype: numpy.ndarray
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def dot(self, vector):
+        """
+        Columns beyond the length of the vector are ignored (i.e. taken as zero).
+
+        :type vector: numpy.ndarray
+        :returns the product of the matrix with the dense vector
+        :rtype: numpy.ndarray
+        """
+        known = self.indices < len(vector)
+        if known.all():
+            products = self.data * vector[self.indices]
+        else:
+            products = np.where(known, self.data, 0) * vector[np.where(known, self.indices, 0)]
+        return np.bincount(self.row_ids(), weights=products, minlength=len(self))
+
+    def transpose_dot(self, vector):
+        """
+        :type vector: numpy.ndarray
+        :returns the product of the transposed matrix with the dense vector (one value per column)
+        :rtype: numpy.ndarray
+        """
+        return np.bincount(self.indices, weights=self.data * vector[self.row_ids()], minlength=self.num_columns)
+
+    def save(self, directory):
+        """
+        Saves the arrays as .npy files into the directory (created if needed).
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'matrix.json'), 'w') as file:
+            json.dump({'num_columns': self.num_columns}, file)
+
+    @staticmethod
+    def load(directory, mmap_mode='r'):
+        """
+        :param mmap_mode: see numpy.load, by default the arrays are memory-mapped read-only; None to read them
+        :rtype: CSRMatrix
+        """
+        with open(os.path.join(directory, 'matrix.json')) as file:
+            num_columns = json.load(file)['num_columns']
+        return CSRMatrix(*(np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+                           for name in CSRMatrix.ARRAYS), num_columns=num_columns)
+
+
+class EdgeMatrix:
+    """
+    The features (Edge.features) and targets (Edge.target) of the edges of a dataset,
+    exported in one pass as a CSR matrix and a target vector, one row per edge.
+
+    The columns are the integer feature ids of the relation feature generators (i.e. the values of their feature_set),
+    hence the same feature is the same column in every dataset exported with the same feature set.
+
+    Each row also records where its edge is (document id, part id, position in Part.edges),
+    so that predictions can be written back to the edges, also after saving and loading the matrix.
+
+    :type matrix: CSRMatrix
+    :type targets: numpy.ndarray
+    :type parts: list[(str, str)]
+    :type rows: numpy.ndarray
+    :type edges: list[nalaf.structures.data.Edge]
+    """
+
+    def __init__(self, matrix, targets, parts, rows, edges=None):
+        self.matrix = matrix
+        """the features of each edge"""
+        self.targets = targets
+        """the target of each edge, 0 if not set"""
+        self.parts = parts
+        """the (document id, part id) of the parts with edges"""
+        self.rows = rows
+        """the index in parts and the position in Part.edges of the edge of each row"""
+        self.edges = edges
+        """the edge of each row; None when loaded, see resolve()"""
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @staticmethod
+    def export(dataset, relation_type=None, num_columns=None):
+        """
+        :type dataset: nalaf.structures.data.Dataset
+        :param relation_type: export only the edges of this relation type, by default all of them
+        :type relation_type: str
+        :param num_columns: the number of columns, e.g. len(feature_set) + 1, by default the biggest feature id + 1
+        :type num_columns: int
+        :rtype: EdgeMatrix
+        """
+        data, indices, indptr, targets, parts, rows, edges = [], [], [0], [], [], [], []
+        for doc_id, document in dataset.documents.items():
+            for part_id, part in document.parts.items():
+                part_index = len(parts)
+                for position, edge in enumerate(part.edges):
+                    if relation_type is not None and edge.relation_type != relation_type:
+                        continue
+                    indices.extend(edge.features.keys())
+                    data.extend(edge.features.values())
+                    indptr.append(len(indices))
+                    targets.append(edge.target if edge.target is not None else 0)
+                    rows.append((part_index, position))
+                    edges.append(edge)
+                if rows and rows[-1][0] == part_index:
+                    parts.append((doc_id, part_id))
+
+        return EdgeMatrix(CSRMatrix(data, indices, indptr, num_columns), np.array(targets, dtype=np.float64),
+                          parts, np.array(rows, dtype=np.int64).reshape(len(rows), 2), edges)
+
+    def resolve(self, dataset):
+        """
+        Sets the edge of each row from the dataset the matrix was exported from (e.g. after load()).
+
+        :type dataset: nalaf.structures.data.Dataset
+        :returns the edge of each row
+        :rtype: list[nalaf.structures.data.Edge]
+        """
+        parts = [dataset.documents[doc_id].parts[part_id] for doc_id, part_id in self.parts]
+        self.edges = [parts[part_index].edges[position] for part_index, position in self.rows]
+        return self.edges
+
+    def write_targets(self, targets):
+        """
+        Sets the target of the edge of each row, e.g. to the predictions of a classifier.
+
+        :param targets: one target per row
+        """
+        for edge, target in zip(self.edges, targets):
+            edge.target = target.item() if isinstance(target, np.generic) else target
+
+    def save(self, directory):
+        """
+        Saves the matrix, the targets and the row index into the directory (created if needed).
+        """
+        self.matrix.save(directory)
+        np.save(os.path.join(directory, 'targets.npy'), self.targets)
+        np.save(os.path.join(directory, 'rows.npy'), self.rows)
+        with open(os.path.join(directory, 'parts.json'), 'w') as file:
+            json.dump(self.parts, file)
+
+    @staticmethod
+    def load(directory, mmap_mode='r'):
+        """
+        :param mmap_mode: see numpy.load, by default the arrays are memory-mapped read-only; None to read them
+        :rtype: EdgeMatrix
+        """
+        with open(os.path.join(directory, 'parts.json')) as file:
+            parts = [tuple(part) for part in json.load(file)]
+        return EdgeMatrix(CSRMatrix.load(directory, mmap_mode),
+                          np.load(os.path.join(directory, 'targets.npy'), mmap_mode=mmap_mode),
+                          parts, np.load(os.path.join(directory, 'rows.npy'), mmap_mode=mmap_mode))
+
+
+class TokenMatrix:
+    """
+    The features (Token.features) and labels of the tokens of a dataset, exported in one pass as
+    a CSR matrix (one row per token), an integer label array and the sentence boundaries.
+
+    The features are flattened into attributes like CRFsuite sees them (see crfsuite_attributes),
+    and the attributes are mapped to columns either:
+        * with a vocabulary (attribute to column), built while exporting or given (e.g. the one of a training set)
+        * by hashing (crc32, stable across processes) into 2 ** hash_bits columns
+
+    :type matrix: CSRMatrix
+    :type labels: numpy.ndarray
+    :type label_names: list[str]
+    :type offsets: numpy.ndarray
+    :type vocabulary: dict
+    :type hash_bits: int
+    """
+
+    def __init__(self, matrix, labels, label_names, offsets, vocabulary=None, hash_bits=None):
+        self.matrix = matrix
+        """the features of each token"""
+        self.labels = labels
+        """the index in label_names of the label of each token, -1 if the token has no (known) label"""
+        self.label_names = label_names
+        """the label values"""
+        self.offsets = offsets
+        """the row of the first token of each sentence (and the number of tokens at the end)"""
+        self.vocabulary = vocabulary
+        """the column of each attribute, None if hashed"""
+        self.hash_bits = hash_bits
+        """the number of bits of the hashed columns, None if with a vocabulary"""
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @staticmethod
+    def export(dataset, vocabulary=None, frozen=False, hash_bits=None, indicator=False, label_names=None,
+               predicted=False):
+        """
+        :type dataset: nalaf.structures.data.Dataset
+        :param vocabulary: the column of each attribute, extended with the unseen attributes (unless frozen);
+            by default a new one
+        :type vocabulary: dict
+        :param frozen: whether the attributes that are not in the vocabulary are dropped
+        :type frozen: bool
+        :param hash_bits: hash the attributes into 2 ** hash_bits columns instead of using a vocabulary
+        :type hash_bits: int
+        :param indicator: whether every attribute has the value 1.0 instead of its weight
+        :type indicator: bool
+        :param label_names: the known label values, by default all of them in order of appearance
+        :type label_names: list[str]
+        :param predicted: whether to export the predicted labels instead of the original labels
+        :type predicted: bool
+        :rtype: TokenMatrix
+        """
+        if hash_bits is None:
+            columns = vocabulary = vocabulary if vocabulary is not None else {}
+            num_columns = None
+        else:
+            columns, mask = {}, (1 << hash_bits) - 1
+            vocabulary, num_columns = None, 1 << hash_bits
+
+        label_names = list(label_names) if label_names is not None else None
+        label_index = {name: index for index, name in enumerate(label_names or [])}
+
+        data, indices, indptr, labels, offsets = [], [], [0], [], [0]
+        for part in dataset.parts():
+            for sentence in part.sentences:
+                for token in sentence:
+                    for attribute, value in crfsuite_attributes(token.features):
+                        column = columns.get(attribute)
+                        if column is None:
+                            if hash_bits is not None:
+                                column = columns[attribute] = zlib.crc32(attribute.encode('utf-8')) & mask
+                            elif frozen:
+                                continue
+                            else:
+                                column = columns[attribute] = len(columns)
+                        indices.append(column)
+                        data.append(1.0 if indicator else value)
+                    indptr.append(len(indices))
+
+                    token_labels = token.predicted_labels if predicted else token.original_labels
+                    index = -1
+                    if token_labels:
+                        index = label_index.get(token_labels[0].value, -1)
+                        if index == -1 and label_names is None:
+                            index = label_index[token_labels[0].value] = len(label_index)
+                    labels.append(index)
+                offsets.append(len(labels))
+
+        if num_columns is None:
+            num_columns = len(vocabulary)
+        if label_names is None:
+            label_names = sorted(label_index, key=label_index.get)
+
+        return TokenMatrix(CSRMatrix(data, indices, indptr, num_columns), np.array(labels, dtype=np.int32),
+                           label_names, np.array(offsets, dtype=np.int64), vocabulary, hash_bits)
+
+    def sentence_lengths(self):
+        """
+        :returns the number of tokens of each sentence
+        :rtype: numpy.ndarray
+        """
+        return np.diff(self.offsets)
+
+    def label_counts(self):
+        """
+        :returns the number of tokens with each label (in the order of label_names)
+        :rtype: numpy.ndarray
+        """
+        known = self.labels[self.labels >= 0]
+        return np.bincount(known, minlength=len(self.label_names))
+
+    def column_counts(self, label=None):
+        """
+        :param label: count only the tokens with this label value
+        :type label: str
+        :returns the number of tokens in which each column is stored
+        :rtype: numpy.ndarray
+        """
+        indices = self.matrix.indices
+        if label is not None:
+            rows = self.matrix.row_ids()
+            indices = indices[self.labels[rows] == self.label_names.index(label)]
+        return np.bincount(indices, minlength=self.matrix.num_columns)
+
+    def save(self, directory):
+        """
+        Saves the matrix, the labels, the sentence offsets and the column mapping into the directory
+        (created if needed).
+        """
+        self.matrix.save(directory)
+        np.save(os.path.join(directory, 'labels.npy'), self.labels)
+        np.save(os.path.join(directory, 'offsets.npy'), self.offsets)
+        with open(os.path.join(directory, 'tokens.json'), 'w') as file:
+            json.dump({'label_names': self.label_names, 'hash_bits': self.hash_bits,
+                       'vocabulary': sorted(self.vocabulary, key=self.vocabulary.get)
+                       if self.vocabulary is not None else None}, file)
+
+    @staticmethod
+    def load(directory, mmap_mode='r'):
+        """
+        :param mmap_mode: see numpy.load, by default the arrays are memory-mapped read-only; None to read them
+        :rtype: TokenMatrix
+        """
+        with open(os.path.join(directory, 'tokens.json')) as file:
+            meta = json.load(file)
+        vocabulary = meta['vocabulary']
+        if vocabulary is not None:
+            vocabulary = {attribute: column for column, attribute in enumerate(vocabulary)}
+        return TokenMatrix(CSRMatrix.load(directory, mmap_mode),
+                           np.load(os.path.join(directory, 'labels.npy'), mmap_mode=mmap_mode), meta['label_names'],
+                           np.load(os.path.join(directory, 'offsets.npy'), mmap_mode=mmap_mode),
+                           vocabulary, meta['hash_bits'])
@@ -32,6 +32,7 @@ setup(
         'beautifulsoup4',
         'requests>=2.8.1',
         'python-crfsuite>=0.8.4',
+        'numpy',
         # Note: it may cause problems on Windows machines
         # Throubleshooting
         # * Install python3-devel package or similar from your UNIX distribution
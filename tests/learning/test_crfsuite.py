@@ -1,4 +1,57 @@
 import unittest
+import tempfile
+import shutil
+import os
+import threading
+import warnings
+from nalaf.structures.data import Dataset, Document, Part, Entity
+from nalaf.structures.dataset_pipelines import PrepareDatasetPipeline
+from nalaf.preprocessing.labelers import BIOLabeler
+from nalaf.preprocessing.prefilters import MutationPrefilter
+from nalaf.learning.crfsuite import PyCRFSuite, CompiledTrainingSet, TaggerPool, TaggingMemo, \
+    FeatureSelection, CRFSuiteModel
+from nalaf.features import crfsuite_attributes
+from nalaf.learning.evaluators import MentionLevelEvaluator, EvaluationAccumulator
+from nalaf.utils import MUT_CLASS_ID
+from tests.structures.test_pipelines import LineSplitter
+
+
+def create_dataset():
+    texts = ['The c.A100G mutation.\nNothing here.',
+             'We found p.V100Q in the gene.',
+             'No mutations.\nBut c.T20C and p.R7X were reported.']
+    mentions = [['c.A100G'], ['p.V100Q'], ['c.T20C', 'p.R7X']]
+
+    dataset = Dataset()
+    for index, (text, doc_mentions) in enumerate(zip(texts, mentions)):
+        part = Part(text)
+        for mention in doc_mentions:
+            part.annotations.append(Entity(MUT_CLASS_ID, text.index(mention), mention))
+        dataset.documents['doc_{}'.format(index)] = Document()
+        dataset.documents['doc_{}'.format(index)].parts['p1'] = part
+    return dataset
+
+
+def prepared(pipeline, labeled=False):
+    """:returns the dataset of create_dataset() prepared with the pipeline, optionally labeled with BIOLabeler"""
+    dataset = create_dataset()
+    pipeline.execute(dataset)
+    if labeled:
+        BIOLabeler().label(dataset)
+    return dataset
+
+
+def predictions(dataset):
+    """:returns the predicted annotations of every part, with their confidence"""
+    return [[(ann.offset, ann.text, ann.confidence) for ann in part.predicted_annotations]
+            for part in dataset.parts()]
+
+
+def token_predictions(dataset):
+    """:returns the predicted label of every token of every sentence, with its confidence"""
+    return [[(token.predicted_labels[0].value, token.predicted_labels[0].confidence) for token in sentence]
+            for sentence in dataset.sentences()]
+
 
 class TestCRFSuite(unittest.TestCase):
     def test_init(self):
@@ -17,5 +70,282 @@ class TestCRFSuite(unittest.TestCase):
         pass  # TODO
 
 
+class TestPyCRFSuite(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.pipeline = PrepareDatasetPipeline(splitter=LineSplitter())
+        cls.dataset = prepared(cls.pipeline, labeled=True)
+        """the prepared and labeled training set, not to be modified by the tests"""
+        cls.model_file = os.path.join(cls.directory, 'model')
+        """the model trained on the dataset, not to be overwritten by the tests"""
+        PyCRFSuite.train(cls.dataset, cls.model_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def assertSameFile(self, first, second):
+        with open(first, 'rb') as first_file, open(second, 'rb') as second_file:
+            self.assertEqual(first_file.read(), second_file.read())
+
+    def test_train_stream_equals_train(self):
+        dataset = create_dataset()
+        sequences = PyCRFSuite.labelled_sequences(dataset.batches(2), self.pipeline, BIOLabeler())
+        PyCRFSuite.train_stream(sequences, os.path.join(self.directory, 'stream'))
+        self.assertSameFile(self.model_file, os.path.join(self.directory, 'stream'))
+
+        # the tokens of the consumed batches are released
+        self.assertEqual(sum(1 for _ in dataset.tokens()), 0)
+
+    def test_compiled_training_set(self):
+        compiled_file = os.path.join(self.directory, 'compiled')
+        CompiledTrainingSet.compile(PyCRFSuite.sentence_sequences(self.dataset), self.pipeline.fingerprint()) \
+            .save(compiled_file)
+        compiled = CompiledTrainingSet.load(compiled_file, self.pipeline.fingerprint())
+        self.assertEqual(len(compiled), sum(1 for _ in self.dataset.sentences()))
+        PyCRFSuite.train_stream(compiled, os.path.join(self.directory, 'compiled_model'))
+        self.assertSameFile(self.model_file, os.path.join(self.directory, 'compiled_model'))
+
+        self.assertRaises(ValueError, CompiledTrainingSet.load, compiled_file, 'another fingerprint')
+
+    def test_crfsuite_attributes(self):
+        self.assertEqual(list(crfsuite_attributes({'word[0]': 'A', 'BOS[0]': True, 'w[0]': 0.5})),
+                         [('word[0]:A', 1.0), ('BOS[0]', 1.0), ('w[0]', 0.5)])
+
+    def test_feature_selection(self):
+        sequences = list(PyCRFSuite.sentence_sequences(self.dataset))
+        attributes = {attribute for features, _ in sequences for item in features
+                      for attribute, _ in crfsuite_attributes(item)}
+
+        frequent = FeatureSelection(min_count=2).fit(sequences)
+        self.assertTrue(frequent.vocabulary < attributes)
+        self.assertIn('word[0]:.', frequent.vocabulary)
+        self.assertNotIn('word[0]:gene', frequent.vocabulary)
+
+        top = FeatureSelection(top_k=10, ranking='association').fit(sequences)
+        self.assertEqual(len(top.vocabulary), 10)
+        self.assertEqual(FeatureSelection(top_k=10, ranking='association').fit(sequences).vocabulary, top.vocabulary)
+        self.assertRaises(ValueError, FeatureSelection, ranking='random')
+
+        model_file = os.path.join(self.directory, 'selected_model')
+        selection = FeatureSelection(min_count=2)
+        PyCRFSuite.train(self.dataset, model_file, selection=selection)
+        self.assertEqual(selection.vocabulary, frequent.vocabulary)
+        self.assertEqual(FeatureSelection.load_vocabulary(model_file), frequent.vocabulary)
+        self.assertEqual(TaggerPool.get(model_file).vocabulary(), frequent.vocabulary)
+
+        self.assertRaises(ValueError, PyCRFSuite.train_stream, sequences, model_file, selection=FeatureSelection())
+        self.assertRaises(ValueError, FeatureSelection().select, sequences)
+
+        # the attributes left out of the vocabulary are ignored by the model anyway
+        tagged = prepared(self.pipeline)
+        PyCRFSuite.tag(tagged, model_file)
+
+        expected = prepared(self.pipeline)
+        for token in expected.tokens():
+            token.features = {attribute: weight for attribute, weight in crfsuite_attributes(token.features)
+                              if attribute in frequent.vocabulary}
+        PyCRFSuite.tag(expected, model_file)
+        self.assertEqual(token_predictions(tagged), token_predictions(expected))
+
+        # the sentences with none of the attributes of the vocabulary are tagged with a warning
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            TaggerPool.get(model_file).tag_sentences([[{'word[0]': 'unseen'}], sequences[0][0]])
+        self.assertEqual([str(warning.message).split(' sentences')[0] for warning in caught], ['1 of 2'])
+
+        os.remove(FeatureSelection.vocabulary_file(model_file))
+        self.assertIsNone(TaggerPool.get(model_file).vocabulary())
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            TaggerPool.get(model_file).tag_sentences([[{'word[0]': 'unseen'}]])
+        self.assertEqual(caught, [])
+
+        # retraining without selection removes the vocabulary
+        selection.save(FeatureSelection.vocabulary_file(model_file))
+        PyCRFSuite.train(self.dataset, model_file)
+        self.assertFalse(os.path.exists(FeatureSelection.vocabulary_file(model_file)))
+
+    def test_crfsuite_model(self):
+        model = CRFSuiteModel.read(self.model_file)
+        self.assertEqual(model.labels, TaggerPool.get(self.model_file).tagger().labels())
+        rewritten_file = os.path.join(self.directory, 'rewritten')
+        model.write(rewritten_file)
+        self.assertSameFile(self.model_file, rewritten_file)
+
+        compacted_file = os.path.join(self.directory, 'compacted')
+        validation = prepared(self.pipeline)
+        report = CRFSuiteModel.compact_file(self.model_file, compacted_file, threshold=0.1, validation=validation)
+        self.assertLess(report['compacted_size'], report['size'])
+        self.assertLess(report['compacted_features'], report['features'])
+        self.assertLess(report['compacted_attributes'], report['attributes'])
+        self.assertIn('compacted_f_measure', report)
+        self.assertEqual(report['f_measure_delta'], report['compacted_f_measure'] - report['f_measure'])
+        self.assertGreater(report['speedup'], 0)
+        self.assertEqual(report['size_reduction'], 1 - report['compacted_size'] / report['size'])
+        # copies of the validation dataset are tagged
+        self.assertEqual(list(validation.predicted_annotations()), [])
+        self.assertFalse(any(token.predicted_labels for token in validation.tokens()))
+        # only the tagger opened for the compacted model is closed
+        self.assertNotIn(os.path.abspath(compacted_file), TaggerPool._pools)
+        self.assertIn(os.path.abspath(self.model_file), TaggerPool._pools)
+
+        from pycrfsuite import Tagger
+        tagger = Tagger()
+        tagger.open(compacted_file)
+        info = tagger.info()
+        self.assertEqual(len(info.state_features) + len(info.transitions), report['compacted_features'])
+        self.assertTrue(all(abs(weight) > 0.1 for weight in info.state_features.values()))
+
+        self.assertEqual(len(CRFSuiteModel.read(self.model_file).compact(top_n=10).features),
+                         10 + sum(1 for feature in model.features if feature[0] == CRFSuiteModel.TRANSITION))
+
+    def test_tagger_pool(self):
+        pool = TaggerPool.get(self.model_file)
+        self.assertIs(pool, TaggerPool.get(self.model_file))
+        self.assertIs(pool.tagger(), pool.tagger())
+
+        other_thread_tagger = []
+        thread = threading.Thread(target=lambda: other_thread_tagger.append(pool.tagger()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(pool.tagger(), other_thread_tagger[0])
+
+        dataset = prepared(self.pipeline)
+        sentences = [[token.features for token in sentence] for sentence in dataset.sentences()]
+        results = pool.tag_sentences(sentences)
+        self.assertEqual(len(results), len(sentences))
+        for (labels, marginals), features in zip(results, sentences):
+            self.assertEqual(len(labels), len(features))
+            self.assertTrue(all(0 <= marginal <= 1 for marginal in marginals))
+
+        PyCRFSuite.tag(dataset, self.model_file)
+        self.assertEqual([[token.predicted_labels[0].value for token in sentence] for sentence in dataset.sentences()],
+                         [labels for labels, _ in results])
+
+    def test_tagger_pool_close(self):
+        model_file = os.path.join(self.directory, 'closed_model')
+        shutil.copyfile(self.model_file, model_file)
+        pool = TaggerPool.get(model_file)
+        pool.tagger()
+
+        TaggerPool.close(model_file)
+        self.assertNotIn(os.path.abspath(model_file), TaggerPool._pools)
+        self.assertIsNot(TaggerPool.get(model_file), pool)
+        TaggerPool.close('never opened')
+
+        TaggerPool.preload(model_file, self.model_file)
+        TaggerPool.clear()
+        self.assertEqual(TaggerPool._pools, {})
+        # the pools are reopened on demand
+        self.assertEqual(TaggerPool.get(self.model_file).tagger().labels(), pool.tagger().labels())
+
+    def test_tag_parallel_equals_serial(self):
+        serial = prepared(self.pipeline)
+        PyCRFSuite.tag(serial, self.model_file)
+
+        parallel = prepared(self.pipeline)
+        PyCRFSuite.tag(parallel, self.model_file, workers=2)
+
+        self.assertEqual(token_predictions(parallel), token_predictions(serial))
+        self.assertEqual(predictions(parallel), predictions(serial))
+
+    def test_tag_memo(self):
+        def duplicated_dataset():
+            data = create_dataset()
+            for doc_id, document in list(create_dataset().documents.items()):
+                data.documents[doc_id + '_copy'] = document
+            self.pipeline.execute(data)
+            return data
+
+        plain = duplicated_dataset()
+        PyCRFSuite.tag(plain, self.model_file)
+
+        memo = TaggingMemo()
+        memoized = duplicated_dataset()
+        PyCRFSuite.tag(memoized, self.model_file, memo=memo)
+
+        self.assertEqual(predictions(memoized), predictions(plain))
+        self.assertEqual(memo.misses, 5)
+        self.assertEqual(memo.hits, 5)
+        self.assertEqual(len(memo), 5)
+
+        memo = TaggingMemo(maxsize=2)
+        PyCRFSuite.tag(duplicated_dataset(), self.model_file, memo=memo)
+        self.assertEqual(len(memo), 2)
+
+    def test_memo_key(self):
+        key = TaggingMemo.key([{'word': 'a', 'num': 1.0}, {'word': 'b'}])
+        self.assertEqual(len(key), 16)
+        self.assertEqual(key, TaggingMemo.key([{'word': 'a', 'num': 1.0}, {'word': 'b'}]))
+        self.assertNotEqual(key, TaggingMemo.key([{'word': 'a', 'num': 2.0}, {'word': 'b'}]))
+        self.assertNotEqual(key, TaggingMemo.key([{'word': 'a', 'num': 1.0, 'word[1]': 'b'}]))
+
+    def test_tag_batches_equals_tag(self):
+        expected = prepared(self.pipeline)
+        PyCRFSuite.tag(expected, self.model_file)
+
+        dataset = create_dataset()
+        accumulator = EvaluationAccumulator(MentionLevelEvaluator())
+        PyCRFSuite.tag_batches(dataset.batches(2), self.model_file, self.pipeline, accumulator=accumulator)
+
+        self.assertEqual(predictions(dataset), predictions(expected))
+        self.assertTrue(all(token.predicted_labels for token in dataset.tokens()))
+        self.assertFalse(any(token.features for token in dataset.tokens()))
+        self.assertEqual(accumulator.finalize()(MentionLevelEvaluator.TOTAL_LABEL).dic_counts,
+                         MentionLevelEvaluator().evaluate(expected)(MentionLevelEvaluator.TOTAL_LABEL).dic_counts)
+
+    def test_release(self):
+        dataset = prepared(self.pipeline, labeled=True)
+        PyCRFSuite.train(dataset, os.path.join(self.directory, 'released_model'), release=True)
+        self.assertFalse(any(token.features for token in dataset.tokens()))
+        self.assertTrue(all(token.original_labels for token in dataset.tokens()))
+        self.assertSameFile(self.model_file, os.path.join(self.directory, 'released_model'))
+
+        expected = prepared(self.pipeline)
+        PyCRFSuite.tag(expected, self.model_file)
+
+        dataset = create_dataset()
+        accumulator = EvaluationAccumulator(MentionLevelEvaluator())
+        PyCRFSuite.tag_batches(dataset.batches(2), self.model_file, self.pipeline,
+                               accumulator=accumulator, release='all')
+        self.assertEqual(list(dataset.tokens()), [])
+        self.assertEqual(predictions(dataset), predictions(expected))
+        self.assertEqual(accumulator.finalize()(MentionLevelEvaluator.TOTAL_LABEL).tp,
+                         MentionLevelEvaluator().evaluate(expected)(MentionLevelEvaluator.TOTAL_LABEL).tp)
+
+    def test_tag_prefiltered(self):
+        pipeline = PrepareDatasetPipeline(splitter=LineSplitter(), prefilter=MutationPrefilter())
+        for workers in (1, 2):
+            dataset = prepared(pipeline)
+            PyCRFSuite.tag(dataset, self.model_file, workers=workers)
+
+            part = dataset.documents['doc_0'].parts['p1']
+            self.assertEqual(part.prefiltered_sentences, {1})
+            self.assertEqual([token.predicted_labels[0].value for token in part.sentences[1]], ['O'] * 3)
+            self.assertEqual([ann.text for part in dataset.parts() for ann in part.predicted_annotations],
+                             ['c.A100G', 'p.V100Q', 'c.T20C', 'p.R7X'])
+        self.assertEqual(pipeline.prefilter.skipped_annotations, 0)
+
+    def test_prune_after_prefilter(self):
+        pipeline = PrepareDatasetPipeline(splitter=LineSplitter(), prefilter=MutationPrefilter())
+        sequences = list(PyCRFSuite.labelled_sequences([create_dataset()], pipeline, BIOLabeler(),
+                                                       filter_batch=Dataset.prune_filtered_sentences))
+        # the sentences with a mention, even those that moved to a prefiltered index
+        self.assertEqual([labels.count('B-{}'.format(MUT_CLASS_ID)) for _, labels in sequences], [1, 1, 2])
+
+        dataset = prepared(pipeline, labeled=True)
+        dataset.prune_filtered_sentences()
+        self.assertEqual([part.prefiltered_sentences for part in dataset.parts()], [set(), set(), set()])
+        self.assertEqual([part.sentences_ for part in dataset.parts()][2], ['But c.T20C and p.R7X were reported.'])
+
+        # the sentences skipped by the prefilter of a former execution are forgotten
+        dataset = prepared(pipeline)
+        self.assertEqual(dataset.documents['doc_0'].parts['p1'].prefiltered_sentences, {1})
+        self.pipeline.execute(dataset)
+        self.assertEqual([part.prefiltered_sentences for part in dataset.parts()], [set(), set(), set()])
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from nalaf.structures.data import Dataset
+from nalaf.structures.dataset_pipelines import PrepareDatasetPipeline
+from nalaf.preprocessing.labelers import BIOLabeler
+from nalaf.learning.crfsuite import TaggerPool
+from nalaf.learning.cross_validation import PyCRFSuiteCrossValidation
+from tests.structures.test_pipelines import LineSplitter
+from tests.learning.test_crfsuite import create_dataset
+
+
+class TestPyCRFSuiteCrossValidation(unittest.TestCase):
+    def test_parallel_equals_serial(self):
+        def dataset():
+            data = Dataset()
+            for copy in range(2):
+                for doc_id, document in create_dataset().documents.items():
+                    data.documents['{}_{}'.format(doc_id, copy)] = document
+            return data
+
+        def counts(evaluations):
+            return {label: evaluations(label).dic_counts for label in evaluations}
+
+        def cross_validation(workers):
+            return PyCRFSuiteCrossValidation(PrepareDatasetPipeline(splitter=LineSplitter()), BIOLabeler(),
+                                             workers=workers)
+
+        pools = set(TaggerPool._pools)
+        serial_data = dataset()
+        serial, serial_folds = cross_validation(1).run(serial_data, n=3)
+        # the taggers of the deleted fold models are closed
+        self.assertEqual(set(TaggerPool._pools), pools)
+
+        data = dataset()
+        parallel, parallel_folds = cross_validation(3).run(data, n=3)
+
+        self.assertEqual(len(parallel_folds), 3)
+        self.assertEqual([counts(evaluations) for evaluations in parallel_folds],
+                         [counts(evaluations) for evaluations in serial_folds])
+        self.assertEqual(counts(parallel), counts(serial))
+        self.assertEqual(len(counts(parallel)['TOTAL']), 6)
+        # neither the workers nor the serial procedure modify the given dataset
+        for data in (data, serial_data):
+            self.assertFalse(any(part.predicted_annotations for part in data.parts()))
+            self.assertFalse(any(token.predicted_labels for token in data.tokens()))
+
+
+if __name__ == '__main__':
+    unittest.main()
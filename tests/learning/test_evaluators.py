@@ -1,6 +1,12 @@
 import unittest
-from nalaf.structures.data import Dataset, Document, Part, Entity
-from nalaf.learning.evaluators import Evaluator, MentionLevelEvaluator
+import random
+import copy
+import pickle
+from nalaf.structures.data import Dataset, Document, Part, Entity, Relation, Token, Label
+import math
+from nalaf.learning.evaluators import Evaluator, MentionLevelEvaluator, Evaluation, Evaluations, \
+    EvaluationWithStandardError, EvaluationAccumulator, DocumentLevelRelationEvaluator, TokenLevelEvaluator, \
+    MultiSystemEvaluator
 from nalaf.utils import MUT_CLASS_ID
 
 
@@ -130,5 +136,383 @@ class TestMentionLevelEvaluator(unittest.TestCase):
         self.assertEqual(evaluations(2).fp_ov, 1)
         self.assertEqual(evaluations(2).fn_ov, 1)
 
+    def test_equals_pairwise_comparison(self):
+        def pairwise_counts(dataset, subclass_analysis):
+            # the former quadratic implementation, comparing every pair of annotations with Entity.__eq__
+            labels = [MentionLevelEvaluator.TOTAL_LABEL]
+            if subclass_analysis:
+                labels += list(set(ann.subclass for ann in dataset.annotations()) |
+                               set(ann.subclass for ann in dataset.predicted_annotations()))
+            counts = {label: {docid: dict.fromkeys(['tp', 'fp', 'fn', 'fp_ov', 'fn_ov'], 0)
+                              for docid in dataset.documents} for label in labels}
+            for docid, doc in dataset.documents.items():
+                for part in doc.parts.values():
+                    overlap_real = {label: [] for label in labels}
+                    overlap_predicted = {label: [] for label in labels}
+                    Entity.equality_operator = 'overlapping'
+                    for ann_a in part.annotations:
+                        for ann_b in part.predicted_annotations:
+                            if ann_a == ann_b:
+                                overlap_real[labels[0]].append(ann_a)
+                                overlap_predicted[labels[0]].append(ann_b)
+                                if subclass_analysis:
+                                    ann_b.subclass = ann_a.subclass
+                                    overlap_real[ann_a.subclass].append(ann_a)
+                                    overlap_predicted[ann_b.subclass].append(ann_b)
+                    Entity.equality_operator = 'exact'
+                    for anns, others, overlaps, count, count_ov in [
+                            (part.predicted_annotations, part.annotations, overlap_predicted, 'tp', 'fp'),
+                            (part.annotations, part.predicted_annotations, overlap_real, None, 'fn')]:
+                        for ann in anns:
+                            for label in [labels[0]] + ([ann.subclass] if subclass_analysis else []):
+                                if ann in others:
+                                    if count:
+                                        counts[label][docid][count] += 1
+                                else:
+                                    counts[label][docid][count_ov] += 1
+                                    if ann in overlaps[label]:
+                                        counts[label][docid][count_ov + '_ov'] += 1
+            return counts
+
+        generator = random.Random(1)
+        dataset = Dataset()
+        for doc_nr in range(20):
+            part = Part('x' * 200)
+            for annotations in (part.annotations, part.predicted_annotations):
+                for _ in range(generator.randint(0, 15)):
+                    offset = generator.randint(0, 190)
+                    ann = Entity(generator.choice(['e_1', 'e_2']), offset, 'x' * generator.randint(0, 10))
+                    ann.subclass = generator.randint(0, 2)
+                    annotations.append(ann)
+            # some exact matches, also duplicated
+            part.predicted_annotations += [copy.copy(ann) for ann in part.annotations[:3]] + part.annotations[:1]
+            dataset.documents['doc_{}'.format(doc_nr)] = Document()
+            dataset.documents['doc_{}'.format(doc_nr)].parts['p'] = part
+
+        for subclass_analysis in (False, True):
+            expected_dataset = copy.deepcopy(dataset)
+            expected = pairwise_counts(expected_dataset, subclass_analysis)
+            evaluations = MentionLevelEvaluator(subclass_analysis).evaluate(dataset)
+            for label in expected:
+                self.assertEqual(evaluations(label).dic_counts, expected[label])
+            self.assertEqual([ann.subclass for ann in dataset.predicted_annotations()],
+                             [ann.subclass for ann in expected_dataset.predicted_annotations()])
+
+
+class TestDocumentLevelRelationEvaluator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dataset = Dataset()
+        relations = [
+            # true, predicted
+            ([('BRCA1', 'c.A100G', 'r_4'), ('TP53', 'R7X', 'r_4'), ('TP53', 'human', 'r_5')],
+             [('c.A100G', 'BRCA1', 'r_4'), ('c.A100G', 'BRCA1', 'r_4'), ('tp53', 'r7x', 'r_4'), ('A', 'B', 'r_4')]),
+            ([('a', 'B', 'r_4')], [('A', 'b', 'r_4'), ('tp53', 'mouse', 'r_5')]),
+        ]
+        for doc_nr, (true, predicted) in enumerate(relations):
+            part = Part('text')
+            part.relations = [Relation(0, 1, text1, text2, rel_type) for text1, text2, rel_type in true]
+            part.predicted_relations = [Relation(0, 1, text1, text2, rel_type) for text1, text2, rel_type in predicted]
+            cls.dataset.documents['doc_{}'.format(doc_nr)] = Document()
+            cls.dataset.documents['doc_{}'.format(doc_nr)].parts['p'] = part
+
+    def test_match_case(self):
+        evaluation = DocumentLevelRelationEvaluator('r_4').evaluate(self.dataset)('r_4')
+        self.assertEqual(evaluation.dic_counts['doc_0'], {'tp': 1, 'fp': 2, 'fn': 1})
+        self.assertEqual(evaluation.dic_counts['doc_1'], {'tp': 0, 'fp': 1, 'fn': 1})
+
+    def test_ignore_case(self):
+        evaluation = DocumentLevelRelationEvaluator('r_4', match_case=False).evaluate(self.dataset)('r_4')
+        self.assertEqual(evaluation.dic_counts['doc_0'], {'tp': 2, 'fp': 1, 'fn': 0})
+        # the entities are lower cased before they are ordered
+        self.assertEqual(evaluation.dic_counts['doc_1'], {'tp': 1, 'fp': 0, 'fn': 0})
+
+    def test_many_relation_types(self):
+        evaluations = DocumentLevelRelationEvaluator(['r_4', 'r_5']).evaluate(self.dataset)
+        self.assertEqual(sorted(evaluations), ['r_4', 'r_5'])
+        self.assertEqual(evaluations('r_4').dic_counts,
+                         DocumentLevelRelationEvaluator('r_4').evaluate(self.dataset)('r_4').dic_counts)
+        self.assertEqual(evaluations('r_5').dic_counts, {'doc_0': {'tp': 0, 'fp': 0, 'fn': 1},
+                                                         'doc_1': {'tp': 0, 'fp': 1, 'fn': 0}})
+
+    def test_unique_relations(self):
+        self.assertEqual(self.dataset.documents['doc_0'].unique_relations('r_4', predicted=True),
+                         {'BRCA1 r_4 c.A100G', 'r7x r_4 tp53', 'A r_4 B'})
+
+
+class TestTokenLevelEvaluator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dataset = Dataset()
+        documents = [
+            # (original, predicted) of the tokens of each sentence
+            [[('O', 'O'), ('B-e_2', 'B-e_2'), ('I-e_2', 'O')], [('O', 'B-e_2'), (None, 'O')]],
+            [[('B-e_2', 'B-e_2'), ('I-e_2', 'I-e_2'), ('O', 'O')]],
+            [],
+        ]
+        for doc_nr, sentences in enumerate(documents):
+            part = Part('text')
+            part.sentences = []
+            for sentence in sentences:
+                part.sentences.append([])
+                for original, predicted in sentence:
+                    token = Token('w', 0)
+                    token.original_labels = [Label(original)] if original else None
+                    token.predicted_labels = [Label(predicted)]
+                    part.sentences[-1].append(token)
+            cls.dataset.documents['doc_{}'.format(doc_nr)] = Document()
+            cls.dataset.documents['doc_{}'.format(doc_nr)].parts['p'] = part
+
+    def test_implements_evaluator_interface(self):
+        self.assertIsInstance(TokenLevelEvaluator(), Evaluator)
+
+    def test_collect(self):
+        labels = TokenLevelEvaluator().collect(self.dataset)
+        self.assertEqual(labels.label_names, ['B-e_2', 'I-e_2', 'O'])
+        self.assertEqual(labels.original.tolist(), [2, 0, 1, 2, 0, 1, 2])
+        self.assertEqual(labels.predicted.tolist(), [2, 0, 2, 0, 0, 1, 2])
+        self.assertEqual(labels.documents.tolist(), [0, 0, 0, 0, 1, 1, 1])
+        self.assertEqual(labels.docids, ['doc_0', 'doc_1', 'doc_2'])
+
+        self.assertEqual(TokenLevelEvaluator.confusion_matrix(labels).tolist(), [[2, 0, 0], [0, 1, 1], [1, 0, 2]])
+
+    def test_evaluate(self):
+        evaluations = TokenLevelEvaluator().evaluate(self.dataset)
+        self.assertEqual(sorted(evaluations), ['B-e_2', 'I-e_2', 'O', 'TOTAL'])
+
+        self.assertEqual((evaluations('B-e_2').tp, evaluations('B-e_2').fp, evaluations('B-e_2').fn), (2, 1, 0))
+        self.assertEqual((evaluations('I-e_2').tp, evaluations('I-e_2').fp, evaluations('I-e_2').fn), (1, 0, 1))
+        self.assertEqual((evaluations('O').tp, evaluations('O').fp, evaluations('O').fn), (2, 1, 1))
+        # all but the outside label
+        self.assertEqual((evaluations('TOTAL').tp, evaluations('TOTAL').fp, evaluations('TOTAL').fn), (3, 1, 1))
+        self.assertEqual(evaluations('TOTAL').compute('exact').precision, 3 / 4)
+
+        self.assertEqual(evaluations('B-e_2').dic_counts, {'doc_0': {'tp': 1, 'fp': 1, 'fn': 0, 'fp_ov': 0, 'fn_ov': 0},
+                                                           'doc_1': {'tp': 1, 'fp': 0, 'fn': 0, 'fp_ov': 0, 'fn_ov': 0},
+                                                           'doc_2': {'tp': 0, 'fp': 0, 'fn': 0, 'fp_ov': 0, 'fn_ov': 0}})
+        self.assertGreaterEqual(evaluations('TOTAL').compute('exact').f_measure_SE, 0)
+
+    def test_empty(self):
+        evaluations = TokenLevelEvaluator().evaluate(Dataset())
+        self.assertEqual(list(evaluations), ['TOTAL'])
+        self.assertEqual(evaluations('TOTAL').tp, 0)
+
+
+class TestMultiSystemEvaluator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        generator = random.Random(2)
+
+        def random_annotations():
+            annotations = []
+            for _ in range(generator.randint(0, 15)):
+                ann = Entity(generator.choice(['e_1', 'e_2']), generator.randint(0, 190),
+                             'x' * generator.randint(0, 10))
+                ann.subclass = generator.randint(0, 2)
+                annotations.append(ann)
+            return annotations
+
+        cls.gold = Dataset()
+        cls.systems = {'a': {}, 'b': {}, 'c': {}}
+        for doc_nr in range(20):
+            document = Document()
+            cls.gold.documents['doc_{}'.format(doc_nr)] = document
+            for part_nr in range(2):
+                part = Part('x' * 200)
+                part.annotations = random_annotations()
+                document.parts['p_{}'.format(part_nr)] = part
+                for name, predictions in cls.systems.items():
+                    # some exact matches too
+                    predictions[('doc_{}'.format(doc_nr), 'p_{}'.format(part_nr))] = \
+                        random_annotations() + [copy.copy(ann) for ann in part.annotations[:generator.randint(0, 3)]]
+
+    def test_equals_mention_level_evaluator(self):
+        for subclass_analysis in (False, True):
+            evaluator = MultiSystemEvaluator(self.gold, subclass_analysis)
+            system_evaluations = evaluator.evaluate(self.systems, workers=2)
+            self.assertEqual(list(system_evaluations), ['a', 'b', 'c'])
+
+            for name, predictions in self.systems.items():
+                dataset = copy.deepcopy(self.gold)
+                for (docid, partid), annotations in predictions.items():
+                    dataset.documents[docid].parts[partid].predicted_annotations = copy.deepcopy(annotations)
+                expected = MentionLevelEvaluator(subclass_analysis).evaluate(dataset)
+
+                self.assertEqual(sorted(system_evaluations[name]), sorted(expected))
+                for label in expected:
+                    self.assertEqual(system_evaluations[name](label).dic_counts, expected(label).dic_counts)
+
+                # a dataset is scored the same, and the predictions are left untouched
+                subclasses = [ann.subclass for annotations in predictions.values() for ann in annotations]
+                self.assertEqual(evaluator.score(dataset)[MultiSystemEvaluator.TOTAL_LABEL],
+                                 expected(MultiSystemEvaluator.TOTAL_LABEL).dic_counts)
+                self.assertEqual([ann.subclass for annotations in predictions.values() for ann in annotations],
+                                 subclasses)
+
+    def test_missing_parts_have_no_predictions(self):
+        evaluations = MultiSystemEvaluator(self.gold).evaluate({'none': {}}, workers=1)['none']
+        self.assertEqual(evaluations('TOTAL').tp, 0)
+        self.assertEqual(evaluations('TOTAL').fp, 0)
+        self.assertEqual(evaluations('TOTAL').fn, len(list(self.gold.annotations())))
+
+    def test_paired_test(self):
+        system_evaluations = MultiSystemEvaluator(self.gold).evaluate(
+            {'gold': {key: list(part.annotations) for key, part in MultiSystemEvaluator(self.gold).index.items()},
+             'a': self.systems['a'], 'a_copy': self.systems['a']}, workers=1)
+        total = {name: evaluations('TOTAL') for name, evaluations in system_evaluations.items()}
+
+        for method in MultiSystemEvaluator.METHODS:
+            same = MultiSystemEvaluator.paired_test(total['a'], total['a_copy'], method=method, n=200, seed=0)
+            self.assertEqual(same, (0, 1))
+
+            better = MultiSystemEvaluator.paired_test(total['gold'], total['a'], method=method, n=200, seed=0)
+            self.assertAlmostEqual(better.difference, 1 - total['a'].compute('exact').f_measure)
+            self.assertLess(better.p_value, 0.05)
+
+            self.assertEqual(better, MultiSystemEvaluator.paired_test(total['gold'], total['a'], method=method,
+                                                                      n=200, seed=0, batch_size=100))
+
+        self.assertRaises(ValueError, MultiSystemEvaluator.paired_test, total['a'], total['a'], method='t-test')
+
+        comparisons = MultiSystemEvaluator.compare(system_evaluations, n=100, seed=0)
+        self.assertEqual(list(comparisons), [('gold', 'a'), ('gold', 'a_copy'), ('a', 'a_copy')])
+        self.assertEqual(comparisons[('a', 'a_copy')].p_value, 1)
+
+
+class TestEvaluationAccumulator(unittest.TestCase):
+    @staticmethod
+    def create_dataset():
+        dataset = Dataset()
+        for doc_nr, (real, predicted) in enumerate([
+                ([(0, 'aaaa', 1), (10, 'bbbb', 1)], [(0, 'aaaa', 1), (11, 'bb', 1)]),
+                ([(5, 'cccc', 2)], []),
+                ([], [(3, 'dd', 1)]),
+                ([(0, 'eeee', 1)], [(0, 'eeee', 1)])]):
+            part = Part('x' * 20)
+            for annotations, spans in ((part.annotations, real), (part.predicted_annotations, predicted)):
+                for offset, text, subclass in spans:
+                    ann = Entity(MUT_CLASS_ID, offset, text)
+                    ann.subclass = subclass
+                    annotations.append(ann)
+            dataset.documents['doc_{}'.format(doc_nr)] = Document()
+            dataset.documents['doc_{}'.format(doc_nr)].parts['p'] = part
+        return dataset
+
+    def batches(self, sizes):
+        dataset = self.create_dataset()
+        docids = list(dataset.documents)
+        start = 0
+        for size in sizes:
+            batch = Dataset()
+            for docid in docids[start:start + size]:
+                batch.documents[docid] = dataset.documents[docid]
+            start += size
+            yield batch
+
+    def test_release(self):
+        dataset = self.create_dataset()
+        for part in dataset.parts():
+            part.sentences_ = ['x' * 20]
+        evaluations = EvaluationAccumulator(MentionLevelEvaluator()).add(dataset, release='all').finalize()
+
+        self.assertEqual([part.sentences_ for part in dataset.parts()], [[]] * 4)
+        self.assertEqual(evaluations('TOTAL').dic_counts,
+                         MentionLevelEvaluator().evaluate(self.create_dataset())('TOTAL').dic_counts)
+
+    def test_streaming_equals_whole(self):
+        evaluator = MentionLevelEvaluator(subclass_analysis=True)
+        expected = evaluator.evaluate(self.create_dataset())
+
+        accumulator = EvaluationAccumulator(evaluator)
+        for batch in self.batches([1, 2, 1]):
+            accumulator.add(batch)
+        evaluations = accumulator.finalize()
+
+        self.assertEqual(sorted(evaluations), sorted(expected))
+        for label in expected:
+            self.assertEqual(evaluations(label).dic_counts, expected(label).dic_counts)
+            self.assertEqual(list(evaluations(label).dic_counts), list(expected(label).dic_counts))
+
+        # one document at a time
+        accumulator = EvaluationAccumulator(evaluator)
+        for docid, document in self.create_dataset().documents.items():
+            accumulator.add_document(docid, document)
+        self.assertEqual(accumulator.finalize()('2').dic_counts, expected('2').dic_counts)
+
+    def test_merge(self):
+        evaluator = DocumentLevelRelationEvaluator('r_4')
+        shards = [EvaluationAccumulator(evaluator).add(batch) for batch in self.batches([2, 1, 1])]
+        shards = [pickle.loads(pickle.dumps(shard)) for shard in shards]
+
+        left = EvaluationAccumulator(evaluator).merge(shards[0]).merge(shards[1]).merge(shards[2])
+        right = EvaluationAccumulator(evaluator).merge(shards[2]).merge(
+            EvaluationAccumulator(evaluator).merge(shards[1]).merge(shards[0]))
+        self.assertEqual(left.finalize()('r_4').dic_counts, right.finalize()('r_4').dic_counts)
+        self.assertEqual(left.finalize()('r_4').dic_counts, evaluator.evaluate(self.create_dataset())('r_4').dic_counts)
+
+        # the counts of the same document are added up
+        twice = EvaluationAccumulator(MentionLevelEvaluator()).add(next(self.batches([1])))
+        twice.merge(twice)
+        self.assertEqual(twice.finalize()('TOTAL').dic_counts['doc_0']['tp'], 2)
+
+
+class TestEvaluationWithStandardError(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        generator = random.Random(2)
+        cls.dic_counts = {}
+        for docid in range(300):
+            tp = generator.randint(0, 5)
+            cls.dic_counts['doc_{}'.format(docid)] = {'tp': tp, 'fp': generator.randint(0, 3),
+                                                      'fn': generator.randint(0, 3), 'fp_ov': 0, 'fn_ov': 0}
+        for counts in list(cls.dic_counts.values())[::3]:
+            counts['fp_ov'], counts['fn_ov'] = min(1, counts['fp']), min(1, counts['fn'])
+
+    def test_seed_and_cache(self):
+        evaluation = EvaluationWithStandardError('e_2', self.dic_counts, seed=7)
+        computation = evaluation.compute('exact')
+        self.assertEqual(computation, EvaluationWithStandardError('e_2', self.dic_counts, seed=7).compute('exact'))
+        self.assertIs(evaluation.standard_errors('exact'), evaluation.standard_errors('exact'))
+        self.assertNotEqual(computation.f_measure_SE,
+                            EvaluationWithStandardError('e_2', self.dic_counts, seed=8).compute('exact').f_measure_SE)
+
+        # the means are the ones of the total counts
+        total = Evaluation('e_2', evaluation.tp, evaluation.fp, evaluation.fn, evaluation.fp_ov, evaluation.fn_ov)
+        for strictness in ('exact', 'overlapping', 'half_overlapping'):
+            self.assertEqual(evaluation.compute(strictness).f_measure, total.compute(strictness).f_measure)
+
+    def test_equals_python_bootstrap(self):
+        # the former procedure, one python sample at a time
+        generator = random.Random(3)
+        keys = list(self.dic_counts)
+        total = EvaluationWithStandardError('e_2', self.dic_counts)
+        for strictness in ('exact', 'overlapping'):
+            mean = total.compute(strictness, {'precision_SE': 0, 'recall_SE': 0, 'f_measure_SE': 0}).f_measure
+            samples = []
+            for _ in range(1000):
+                sample = generator.sample(keys, round(len(keys) * 0.15))
+                samples.append(Evaluation('e_2', *(sum(self.dic_counts[key][count] for key in sample)
+                                                   for count in EvaluationWithStandardError.COUNTS))
+                               .compute(strictness).f_measure)
+            expected = math.sqrt(sum((x - mean) ** 2 for x in samples) / 999) / math.sqrt(1000)
+            self.assertAlmostEqual(total.compute(strictness).f_measure_SE / expected, 1, delta=0.15)
+
+    def test_compute_SEs_parallel(self):
+        evaluations = Evaluations()
+        for label in ('a', 'b', 'c'):
+            evaluations.add(EvaluationWithStandardError(label, self.dic_counts, seed=1))
+        evaluations.compute_SEs(['exact', 'half_overlapping'], workers=3)
+        for label in evaluations:
+            self.assertEqual(evaluations(label)._SEs['half_overlapping'],
+                             EvaluationWithStandardError(label, self.dic_counts, seed=1)
+                             .standard_errors('half_overlapping'))
+
+    def test_small_samples(self):
+        self.assertEqual(EvaluationWithStandardError('e_2', {}).compute('exact').f_measure_SE, 0)
+        one = EvaluationWithStandardError('e_2', {'doc_1': {'tp': 1, 'fp': 1, 'fn': 0}}, p=1)
+        self.assertEqual(one.compute('exact').precision, 0.5)
+        self.assertEqual(one.compute('exact').precision_SE, 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import numpy as np
+from nalaf.learning.kernels import ParseTree, TreeKernel, KernelSVM, path_enclosed_tree
+
+
+class TestParseTree(unittest.TestCase):
+    def test_parse(self):
+        symbols = {}
+        tree = ParseTree.parse('( (S (NP (DT The) (NN cat)) (VP (VBD sat))))', symbols)
+        labels = {value: key[1] for key, value in symbols.items() if key[0] == 'label'}
+        self.assertEqual([labels[label] for label in tree.labels],
+                         ['', 'S', 'NP', 'DT', 'The', 'NN', 'cat', 'VP', 'VBD', 'sat'])
+        self.assertEqual(tree.children[1], (2, 7))
+        self.assertEqual(tree.children[4], ())
+        self.assertEqual(tree.productions[4], -1)
+        self.assertEqual([node for node, preterminal in enumerate(tree.preterminal) if preterminal], [3, 5, 8])
+
+        # the same productions are interned to the same integers
+        other = ParseTree.parse('(NP (DT The) (NN cat))', symbols)
+        self.assertEqual(other.productions[0], tree.productions[2])
+
+
+class TestTreeKernel(unittest.TestCase):
+    def test_fragment_counts(self):
+        # (NP (D a) (N man)) has 6 subset trees and 3 subtrees
+        tree = '(NP (D a) (N man))'
+        self.assertEqual(TreeKernel('sst', decay=1, normalize=False).kernel(tree, tree), 6)
+        self.assertEqual(TreeKernel('st', decay=1, normalize=False).kernel(tree, tree), 3)
+        # partial trees: a, b, B, B(b), c, C, C(c) and A with any subsequence of those of its children
+        self.assertEqual(TreeKernel('ptk', decay=1, mu=1, normalize=False).kernel(
+            '(A (B b) (C c))', '(A (B b) (C c))'), 15)
+        self.assertEqual(TreeKernel('ptk', decay=1, mu=1, normalize=False).kernel(
+            '(A (B b) (C c))', '(A (C c))'), 6)
+
+    def test_matrix(self):
+        trees = ['(S (NP (DT The) (NN cat)) (VP (VBD sat)))', '(S (NP (NN Dogs)) (VP (VBD sat)))',
+                 '(S (NP (DT The) (NN cat)) (VP (VBD sat)))']
+        for kind in TreeKernel.KINDS:
+            kernel = TreeKernel(kind)
+            gram = kernel.matrix(trees)
+            self.assertEqual(gram.shape, (3, 3))
+            np.testing.assert_allclose(np.diag(gram), 1)
+            np.testing.assert_allclose(gram, gram.T)
+            self.assertAlmostEqual(gram[0, 2], 1)
+            self.assertTrue(0 < gram[0, 1] < 1)
+            # the identical trees are evaluated once
+            self.assertEqual(len(kernel.trees), 2)
+
+            np.testing.assert_allclose(TreeKernel(kind).matrix(trees, workers=2), gram)
+            np.testing.assert_allclose(kernel.matrix(trees[:1], trees[1:]), gram[:1, 1:])
+
+    def test_invalid_kind(self):
+        self.assertRaises(ValueError, TreeKernel, 'dtk')
+
+
+class TestPathEnclosedTree(unittest.TestCase):
+    def test_path_enclosed_tree(self):
+        tree = '( (S (NP (NN BRCA1)) (VP (VBZ has) (NP (NN mutation) (NN A1B))) (CC and) (NP (NN C2D))))'
+        self.assertEqual(path_enclosed_tree(tree, (0, 1), (3, 4)),
+                         '(S (NP (E1 (NN BRCA1))) (VP (VBZ has) (NP (NN mutation) (E2 (NN A1B)))))')
+        self.assertEqual(path_enclosed_tree(tree, (5, 6), (3, 4)),
+                         '(S (VP (NP (E2 (NN A1B)))) (CC and) (NP (E1 (NN C2D))))')
+        self.assertEqual(path_enclosed_tree(tree, (2, 4), (2, 4)), '(NP (E1 (E2 (NN mutation))) (E1 (E2 (NN A1B))))')
+        self.assertRaises(ValueError, path_enclosed_tree, tree, (6, 7), (7, 8))
+
+
+class TestKernelSVM(unittest.TestCase):
+    def test_fit_predict(self):
+        samples = np.array([[1, 0], [2, 1], [1, 1], [-1, 0], [-2, -1], [-1, -1]], dtype=np.float64)
+        targets = [1, 1, 1, -1, -1, -1]
+        classifier = KernelSVM(c=10).fit(samples.dot(samples.T), targets)
+        self.assertEqual(classifier.predict(samples.dot(samples[classifier.support].T)).tolist(), targets)
+        self.assertLess(len(classifier.support), len(targets))
+
+
+if __name__ == '__main__':
+    unittest.main()
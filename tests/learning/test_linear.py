@@ -0,0 +1,63 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+from nalaf.learning.linear import LinearClassifier
+from nalaf.utils.sparse import CSRMatrix
+
+
+class TestLinearClassifier(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # feature 1 indicates a positive sample, feature 2 a negative one, feature 3 is noise
+        features = [{1: 1, 3: 1}, {1: 1}, {1: 1, 3: 1}, {2: 1, 3: 1}, {2: 1}, {2: 1}]
+        cls.matrix = CSRMatrix([value for row in features for value in row.values()],
+                               [column for row in features for column in row],
+                               np.cumsum([0] + [len(row) for row in features]))
+        cls.targets = [1, 1, 1, -1, -1, -1]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fit_predict(self):
+        for loss in LinearClassifier.LOSSES:
+            classifier = LinearClassifier(loss, c=10).fit(self.matrix, self.targets)
+            self.assertEqual(classifier.predict(self.matrix).tolist(), self.targets)
+            self.assertGreater(classifier.weights[1], 0)
+            self.assertLess(classifier.weights[2], 0)
+
+        # unseen features are ignored
+        self.assertEqual(classifier.decision_function(CSRMatrix([1, 1], [1, 99], [0, 2])).tolist(),
+                         classifier.decision_function(CSRMatrix([1], [1], [0, 1])).tolist())
+
+    def test_predict_parallel_equals_serial(self):
+        classifier = LinearClassifier(c=10).fit(self.matrix, self.targets)
+        classifier.MIN_BLOCK_ROWS = 2
+        self.assertEqual(classifier.decision_function(self.matrix, workers=3).tolist(),
+                         classifier.decision_function(self.matrix).tolist())
+        self.assertEqual(classifier.predict(self.matrix, workers=None).tolist(), self.targets)
+
+    def test_logistic_optimum(self):
+        # without features the optimal bias is the log odds of the targets
+        classifier = LinearClassifier(c=1000).fit(CSRMatrix([], [], [0, 0, 0, 0, 0], 1), [1, 1, 1, -1])
+        self.assertAlmostEqual(classifier.bias, np.log(3), places=4)
+        self.assertAlmostEqual(classifier.predict_probability(CSRMatrix([], [], [0, 0]))[0], 0.75, places=4)
+
+    def test_save_load(self):
+        classifier = LinearClassifier('squared_hinge').fit(self.matrix, self.targets)
+        classifier.save(os.path.join(self.directory, 'model'))
+        loaded = LinearClassifier.load(os.path.join(self.directory, 'model'))
+        self.assertEqual(loaded.loss, 'squared_hinge')
+        self.assertEqual(loaded.decision_function(self.matrix).tolist(),
+                         classifier.decision_function(self.matrix).tolist())
+
+    def test_invalid_loss(self):
+        self.assertRaises(ValueError, LinearClassifier, 'hinge')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from nose.plugins.attrib import attr
-from nalaf.learning.taggers import StubSameSentenceRelationExtractor
+from nalaf.learning.taggers import StubSameSentenceRelationExtractor, LinearRelationExtractor, \
+    TreeKernelRelationExtractor
 from nalaf.structures.data import *
 from nalaf.learning.taggers import GNormPlusGeneTagger
 from nalaf.preprocessing.spliters import NLTKSplitter
@@ -46,5 +47,98 @@ class TestGNormPlusGeneTagger(unittest.TestCase):
         self.data.purge_false_relationships()
         self.assertEqual(len([x for x in self.data.relations() if x.class_id == PRO_REL_MUT_CLASS_ID]), 0)
 
+
+class TestLinearRelationExtractor(unittest.TestCase):
+    @staticmethod
+    def create_dataset(features, related):
+        dataset = Dataset()
+        dataset.documents['doc_1'] = Document()
+        part = Part('BRCA1 has mutations A1B, C2D and E3F')
+        dataset.documents['doc_1'].parts['p1'] = part
+
+        protein = Entity(PRO_CLASS_ID, 0, 'BRCA1')
+        for edge_features, mutation_text, is_related in zip(features, ['A1B', 'C2D', 'E3F'], related):
+            mutation = Entity(MUT_CLASS_ID, part.text.index(mutation_text), mutation_text)
+            edge = Edge(protein, mutation, PRO_REL_MUT_CLASS_ID, [], 0, part)
+            edge.features = edge_features
+            part.edges.append(edge)
+            if is_related:
+                part.relations.append(Relation(0, mutation.offset, 'BRCA1', mutation_text, PRO_REL_MUT_CLASS_ID))
+
+        # edges of other relation types are left alone
+        other = Edge(protein, protein, 'r_other', [], 0, part)
+        other.features = {1: 1}
+        part.edges.append(other)
+        return dataset
+
+    def test_train_tag(self):
+        extractor = LinearRelationExtractor(PRO_CLASS_ID, MUT_CLASS_ID, PRO_REL_MUT_CLASS_ID)
+        # the edges are labeled with the relations of the parts
+        extractor.train(self.create_dataset([{1: 1}, {2: 1}, {1: 1, 3: 1}], [True, False, True]))
+        self.assertGreater(extractor.classifier.weights[1], 0)
+        self.assertLess(extractor.classifier.weights[2], 0)
+
+        dataset = self.create_dataset([{2: 1}, {1: 1, 4: 1}, {1: 1}], [False, False, False])
+        dataset.documents['doc_1'].parts['p1'].edges[-1].target = 1
+        extractor.tag(dataset)
+        self.assertEqual([edge.target for edge in dataset.edges()], [-1, 1, 1, 1])
+        self.assertEqual([(relation.text2, relation.class_id) for relation in dataset.predicted_relations()],
+                         [('C2D', PRO_REL_MUT_CLASS_ID), ('E3F', PRO_REL_MUT_CLASS_ID)])
+
+
+class TestTreeKernelRelationExtractor(unittest.TestCase):
+    tree = '(S (S (NP (NN {0})) (VP (VBZ has) (NP (NN mutation) (NN {1})))) (CC but) (S (NP (NN {2})) (VP (VBZ is) ' \
+           '(ADJP (JJ normal)))))'
+
+    @classmethod
+    def create_dataset(cls, sentences):
+        """
+        :param sentences: for each sentence, its related protein, its mutation and its unrelated protein,
+            which make two edges in the same sentence
+        """
+        dataset = Dataset()
+        dataset.documents['doc_1'] = Document()
+        text = ' '.join('{} has mutation {} but {} is normal'.format(*words) for words in sentences)
+        part = Part(text)
+        dataset.documents['doc_1'].parts['p1'] = part
+
+        start = 0
+        for sentence_id, words in enumerate(sentences):
+            sentence = []
+            for word in '{} has mutation {} but {} is normal'.format(*words).split():
+                sentence.append(Token(word, start))
+                start += len(word) + 1
+            part.sentences.append(sentence)
+            part.sentence_parse_trees.append(cls.tree.format(*words))
+
+            related, mutation, unrelated = (Entity(class_id, sentence[index].start, sentence[index].word)
+                                            for class_id, index in ((PRO_CLASS_ID, 0), (MUT_CLASS_ID, 3),
+                                                                    (PRO_CLASS_ID, 5)))
+            for protein in (related, unrelated):
+                part.edges.append(Edge(protein, mutation, PRO_REL_MUT_CLASS_ID, sentence, sentence_id, part))
+            part.relations.append(Relation(related.offset, mutation.offset, related.text, mutation.text,
+                                           PRO_REL_MUT_CLASS_ID))
+        return dataset
+
+    def test_train_tag(self):
+        extractor = TreeKernelRelationExtractor(PRO_CLASS_ID, MUT_CLASS_ID, PRO_REL_MUT_CLASS_ID)
+        train = self.create_dataset([('BRCA1', 'A1B', 'TP53'), ('TP53', 'C2D', 'BRCA1')])
+        self.assertEqual([edge.entity1.text for edge in train.edges()], ['BRCA1', 'TP53', 'TP53', 'BRCA1'])
+        # the two pairs of a sentence get different trees
+        first, second = (extractor.tree(edge) for edge in list(train.edges())[:2])
+        self.assertNotEqual(first, second)
+        self.assertIn('(E1 (NN BRCA1))', first)
+
+        extractor.train(train)
+        self.assertEqual([edge.target for edge in train.edges()], [1, -1, 1, -1])
+        self.assertTrue(extractor.support_trees)
+
+        dataset = self.create_dataset([('EGFR', 'E3F', 'KRAS')])
+        dataset.documents['doc_1'].parts['p1'].relations = []
+        extractor.tag(dataset)
+        self.assertEqual([edge.target for edge in dataset.edges()], [1, -1])
+        self.assertEqual([(relation.text1, relation.text2) for relation in dataset.predicted_relations()],
+                         [('EGFR', 'E3F')])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import tempfile
+import shutil
+import os
+from nalaf.structures.dataset_pipelines import PrepareDatasetPipeline
+from nalaf.preprocessing.labelers import BIOLabeler
+from nalaf.learning.crfsuite import PyCRFSuite, CompiledTrainingSet, TaggerPool
+from nalaf.learning.tuning import PyCRFSuiteSearch, _window_offset
+from tests.structures.test_pipelines import LineSplitter
+from tests.learning.test_crfsuite import create_dataset
+
+
+class TestPyCRFSuiteSearch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_grid_and_random(self):
+        self.assertEqual(PyCRFSuiteSearch.grid({'c1': [0, 1], 'c2': [0.1]}),
+                         [{'c1': 0, 'c2': 0.1}, {'c1': 1, 'c2': 0.1}])
+        candidates = PyCRFSuiteSearch.random({'c1': [0, 1], 'c2': lambda r: r.uniform(0, 1)}, 5, seed=1)
+        self.assertEqual(candidates, PyCRFSuiteSearch.random({'c1': [0, 1], 'c2': lambda r: r.uniform(0, 1)}, 5, seed=1))
+        self.assertEqual(len(candidates), 5)
+        self.assertTrue(all(0 <= candidate['c2'] <= 1 for candidate in candidates))
+
+    def test_window_offset(self):
+        self.assertEqual(_window_offset('stem[-1]:walk'), -1)
+        self.assertEqual(_window_offset('word[0]:a[2]'), 0)
+        self.assertEqual(_window_offset('BOS'), 0)
+
+    def test_run(self):
+        pipeline = PrepareDatasetPipeline(splitter=LineSplitter())
+        train = create_dataset()
+        pipeline.execute(train)
+        BIOLabeler().label(train)
+        training_set = CompiledTrainingSet.compile(PyCRFSuite.sentence_sequences(train))
+
+        validation = create_dataset()
+        pipeline.execute(validation)
+
+        candidates = PyCRFSuiteSearch.grid({'c1': [0.0, 1.0], 'c2': [0.01, 100.0], 'max_iterations': [50]})
+        candidates.append({'c2': 0.01, 'window': (-1, 1)})
+        search = PyCRFSuiteSearch(training_set, validation, workers=2)
+        leaderboard_file = os.path.join(self.directory, 'leaderboard.tsv')
+        best_model_file = os.path.join(self.directory, 'best.model')
+        params, f_measure = search.run(candidates, leaderboard_file, best_model_file, min_iterations=5, eta=2)
+
+        self.assertIn(params, candidates)
+        self.assertTrue(os.path.exists(best_model_file))
+        # budgets of 5, 10, 20, 40 and the full max_iterations, keeping the best half each time
+        self.assertEqual([sum(1 for result in search.leaderboard if result[1] == round_nr) for round_nr in range(5)],
+                         [5, 3, 2, 1, 1])
+        with open(leaderboard_file) as file:
+            lines = file.read().splitlines()
+        self.assertEqual(len(lines), 1 + len(search.leaderboard))
+        self.assertEqual(float(lines[1].split('\t')[6]), round(f_measure, 4))
+
+        # the best model is usable for tagging
+        expected = create_dataset()
+        pipeline.execute(expected)
+        PyCRFSuite.tag(expected, best_model_file)
+        self.assertTrue(any(part.predicted_annotations for part in expected.parts()))
+
+        # the same search without worker processes
+        pools = set(TaggerPool._pools)
+        serial = PyCRFSuiteSearch(training_set, validation, workers=1)
+        self.assertEqual(serial.run(candidates, min_iterations=5, eta=2), (params, f_measure))
+        # the taggers of the deleted candidate models are closed
+        self.assertEqual(set(TaggerPool._pools), pools)
+        self.assertEqual([result[:6] for result in serial.leaderboard], [result[:6] for result in search.leaderboard])
+
+    def test_run_validates_halving(self):
+        search = PyCRFSuiteSearch(None, None, workers=1)
+        self.assertRaises(ValueError, search.run, [{}], eta=1)
+        self.assertRaises(ValueError, search.run, [{}], min_iterations=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
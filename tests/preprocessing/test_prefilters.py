@@ -0,0 +1,49 @@
+import unittest
+from nalaf.structures.data import Dataset, Document, Part, Entity
+from nalaf.preprocessing.prefilters import MutationPrefilter, PatternPrefilter
+from nalaf.preprocessing.tokenizers import TmVarTokenizer
+from nalaf.utils import MUT_CLASS_ID
+
+
+class TestMutationPrefilter(unittest.TestCase):
+    def test_keep(self):
+        prefilter = MutationPrefilter()
+        for sentence in ['The c.A100G mutation.', 'We found p.V100Q.', 'R7X and 1234A>G', 'the rs 1234 SNP',
+                         'Arg7Ter', 'glycine to alanine', 'a 12delAG deletion', 'IVS2+1']:
+            self.assertTrue(prefilter.keep(sentence), sentence)
+        for sentence in ['Nothing here.', 'No mutations.', 'The patient was 12 years old.']:
+            self.assertFalse(prefilter.keep(sentence), sentence)
+
+    def test_apply_and_count(self):
+        text = 'Nothing here.\nThe c.A100G mutation.\nNo p.V100Q here, right?'
+        part = Part(text)
+        part.sentences_ = text.split('\n')
+        part.annotations.append(Entity(MUT_CLASS_ID, text.index('p.V100Q'), 'p.V100Q'))
+        dataset = Dataset()
+        dataset.documents['doc_1'] = Document()
+        dataset.documents['doc_1'].parts['p1'] = part
+        TmVarTokenizer().tokenize(dataset)
+
+        prefilter = PatternPrefilter([r'c\.'], class_id=MUT_CLASS_ID)
+        shadow = prefilter.apply(dataset)
+
+        self.assertEqual(part.prefiltered_sentences, {0, 2})
+        shadow_part = shadow.documents['doc_1'].parts['p1']
+        self.assertEqual(shadow_part.sentences_, ['The c.A100G mutation.'])
+        self.assertIs(shadow_part.sentences[0], part.sentences[1])
+        self.assertEqual(len(part.sentences), 3)
+
+        prefilter.count(dataset)
+        self.assertEqual((prefilter.sentences, prefilter.skipped, prefilter.skipped_annotations), (3, 2, 1))
+        self.assertEqual(prefilter.skipped_predicted_annotations, 0)
+
+        # at inference there are no gold annotations, but those of an upstream annotator are counted
+        part.annotations = []
+        part.predicted_annotations.append(Entity(MUT_CLASS_ID, text.index('p.V100Q'), 'p.V100Q'))
+        part.predicted_annotations.append(Entity('e_other', 0, 'Nothing'))
+        prefilter.count(dataset)
+        self.assertEqual((prefilter.skipped_annotations, prefilter.skipped_predicted_annotations), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
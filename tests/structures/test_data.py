@@ -74,6 +74,33 @@ class TestDataset(unittest.TestCase):
         self.dataset.delete_subclass_annotations(0)
         self.assertEqual(len(list(self.dataset.annotations())), 1)
 
+    def test_release(self):
+        dataset = Dataset()
+        dataset.documents['doc'] = Document()
+        part = Part('some text')
+        part.annotations.append(Entity(MUT_CLASS_ID, 0, 'some'))
+        part.sentences_ = ['some text']
+        part.sentences = [[Token('some', 0), Token('text', 5)]]
+        for token in part.sentences[0]:
+            token.features['word'] = token.word
+            token.predicted_labels = [Label('O', 0.9)]
+        dataset.documents['doc'].parts['p1'] = part
+
+        self.assertRaises(ValueError, dataset.release, 'everything')
+
+        self.assertGreater(dataset.release('features'), 0)
+        self.assertEqual([token.features for token in part.sentences[0]], [{}, {}])
+        self.assertEqual(part.sentences_, ['some text'])
+        self.assertEqual(dataset.release('features'), 0)
+
+        self.assertGreater(dataset.release(('sentences', 'labels')), 0)
+        self.assertEqual(part.sentences_, [])
+        self.assertIsNone(part.sentences[0][0].predicted_labels)
+
+        self.assertGreater(dataset.release('all'), 0)
+        self.assertEqual(part.sentences, [[]])
+        self.assertEqual(len(part.annotations), 1)
+
 
 class TestDocument(unittest.TestCase):
     @classmethod
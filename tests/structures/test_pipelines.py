@@ -1,4 +1,71 @@
 from unittest import TestCase
+import time
+import sys
+import subprocess
+import tempfile
+import shutil
+from nalaf.structures.data import Dataset, Document, Part, FeatureDictionary
+from nalaf.structures.dataset_pipelines import PrepareDatasetPipeline
+from nalaf.preprocessing.spliters import Splitter
+from nalaf.preprocessing.prefilters import MutationPrefilter
+from nalaf.features import FeatureGenerator
+from nalaf.features.relations import BagOfWordsFeatureGenerator
+from nalaf.utils.cache import ContentAddressedCache
+
+
+class LineSplitter(Splitter):
+    """splits on new lines, to not depend on the NLTK data in the tests"""
+
+    def split(self, dataset):
+        for part in dataset.parts():
+            part.sentences_ = [line for line in part.text.split('\n') if line]
+
+
+class VocabularyFeatureGenerator(FeatureGenerator):
+    """shardable generator that numbers the words in the order it sees them, optionally slowly for some words"""
+
+    def __init__(self, slow_word=None):
+        self.vocabulary = {}
+        self.slow_word = slow_word
+
+    def generate(self, dataset):
+        for token in dataset.tokens():
+            if token.word == self.slow_word:
+                time.sleep(0.5)
+            self.vocabulary.setdefault(token.word, len(self.vocabulary))
+
+    def merge(self, other):
+        for word in sorted(other.vocabulary, key=other.vocabulary.get):
+            self.vocabulary.setdefault(word, len(self.vocabulary))
+
+
+class ProcessFeatureGenerator(FeatureGenerator):
+    """generator that owns a subprocess, like BioLemmatizer"""
+
+    def __init__(self):
+        self.program = [sys.executable, '-c', 'import sys; sys.stdin.read()']
+        self.process = subprocess.Popen(self.program, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def generate(self, dataset):
+        pass
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def create_dataset():
+    dataset = Dataset()
+    dataset.documents['doc_1'] = Document()
+    dataset.documents['doc_1'].parts['p1'] = Part('The c.A100G mutation.\nIt is in BRCA1.')
+    dataset.documents['doc_2'] = Document()
+    dataset.documents['doc_2'].parts['p1'] = Part('Another p.V100Q one.')
+    return dataset
+
+
+def dump(dataset):
+    return [(part.sentences_, [[(t.word, t.start, list(t.features.items())) for t in s] for s in part.sentences])
+            for part in dataset.parts()]
 
 
 class TestPrepareDatasetPipeline(TestCase):
@@ -7,3 +74,111 @@ class TestPrepareDatasetPipeline(TestCase):
 
     def test_init(self):
         pass  # TODO
+
+    def test_fingerprint(self):
+        self.assertEqual(PrepareDatasetPipeline(splitter=LineSplitter()).fingerprint(),
+                         PrepareDatasetPipeline(splitter=LineSplitter()).fingerprint())
+        self.assertNotEqual(PrepareDatasetPipeline(splitter=LineSplitter()).fingerprint(),
+                            PrepareDatasetPipeline(splitter=LineSplitter(), feature_generators=[]).fingerprint())
+        self.assertNotEqual(PrepareDatasetPipeline(splitter=LineSplitter()).fingerprint(),
+                            PrepareDatasetPipeline(splitter=LineSplitter(), prefilter=MutationPrefilter()).fingerprint())
+
+    def test_fingerprint_ignores_runtime_handles(self):
+        first, second = ProcessFeatureGenerator(), ProcessFeatureGenerator()
+        try:
+            self.assertNotEqual(first.process.pid, second.process.pid)
+            self.assertEqual(PrepareDatasetPipeline(splitter=LineSplitter(), feature_generators=[first]).fingerprint(),
+                             PrepareDatasetPipeline(splitter=LineSplitter(), feature_generators=[second]).fingerprint())
+
+            second.program = second.program + ['configured differently']
+            self.assertNotEqual(
+                PrepareDatasetPipeline(splitter=LineSplitter(), feature_generators=[first]).fingerprint(),
+                PrepareDatasetPipeline(splitter=LineSplitter(), feature_generators=[second]).fingerprint())
+        finally:
+            first.close()
+            second.close()
+
+    def test_fingerprint_ignores_accumulated_state(self):
+        feature_set = FeatureDictionary()
+        pipeline = PrepareDatasetPipeline(splitter=LineSplitter(), prefilter=MutationPrefilter(),
+                                          feature_generators=[BagOfWordsFeatureGenerator(feature_set)])
+        fingerprint = pipeline.fingerprint()
+        feature_set['bow_a'] = 1
+        pipeline.execute(create_dataset())
+
+        self.assertGreater(pipeline.prefilter.sentences, 0)
+        self.assertEqual(pipeline.fingerprint(), fingerprint)
+        self.assertNotEqual(PrepareDatasetPipeline(splitter=LineSplitter(), prefilter=MutationPrefilter(),
+                                                   feature_generators=[BagOfWordsFeatureGenerator(
+                                                       feature_set, training_mode=False)]).fingerprint(),
+                            fingerprint)
+
+    def test_prefilter(self):
+        expected = create_dataset()
+        PrepareDatasetPipeline(splitter=LineSplitter()).execute(expected)
+
+        for workers in (1, 2):
+            dataset = create_dataset()
+            pipeline = PrepareDatasetPipeline(splitter=LineSplitter(), prefilter=MutationPrefilter())
+            pipeline.execute(dataset, workers=workers)
+
+            part = dataset.documents['doc_1'].parts['p1']
+            self.assertEqual(part.prefiltered_sentences, {1})
+            self.assertTrue(all(not token.features for token in part.sentences[1]))
+            # the features of the kept sentences are the same as without prefilter
+            self.assertEqual(dump(dataset)[1], dump(expected)[1])
+            self.assertEqual(dump(dataset)[0][1][0], dump(expected)[0][1][0])
+            self.assertEqual((pipeline.prefilter.sentences, pipeline.prefilter.skipped), (3, 1))
+
+
+class TestPrepareDatasetPipelineCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_execute_cached(self):
+        expected = create_dataset()
+        PrepareDatasetPipeline(splitter=LineSplitter()).execute(expected)
+
+        cache = ContentAddressedCache(self.directory)
+        first = create_dataset()
+        PrepareDatasetPipeline(splitter=LineSplitter()).execute(first, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+        second = create_dataset()
+        second.documents['doc_3'] = Document()
+        second.documents['doc_3'].parts['p1'] = Part('Not seen before.')
+        PrepareDatasetPipeline(splitter=LineSplitter()).execute(second, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+        self.assertEqual(dump(first), dump(expected))
+        del second.documents['doc_3']
+        self.assertEqual(dump(second), dump(expected))
+
+
+class TestPrepareDatasetPipelineParallel(TestCase):
+    def test_execute_parallel_equals_serial(self):
+        expected = create_dataset()
+        PrepareDatasetPipeline(splitter=LineSplitter()).execute(expected)
+
+        dataset = create_dataset()
+        PrepareDatasetPipeline(splitter=LineSplitter()).execute(dataset, workers=2, chunk_size=1)
+
+        self.assertEqual(dump(dataset), dump(expected))
+        self.assertEqual(list(dataset.documents.keys()), ['doc_1', 'doc_2'])
+
+    def test_merge_in_chunk_order(self):
+        vocabularies = []
+        # the chunk scheduled first or the one scheduled last is delayed, so they complete in different orders
+        for slow_word in ('mutation', 'one'):
+            generator = VocabularyFeatureGenerator(slow_word)
+            PrepareDatasetPipeline(splitter=LineSplitter(), feature_generators=[generator]).execute(
+                create_dataset(), workers=2, chunk_size=1)
+            vocabularies.append(list(generator.vocabulary.items()))
+
+        self.assertEqual(vocabularies[0], vocabularies[1])
+        # the chunks are scheduled largest first: doc_1 and then doc_2
+        self.assertEqual([word for word, _ in vocabularies[0]][:2], ['The', 'c'])
+        self.assertEqual(vocabularies[0][-1][0], 'one')
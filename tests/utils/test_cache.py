@@ -0,0 +1,57 @@
+import unittest
+import tempfile
+import shutil
+import os
+from nalaf.utils.cache import ContentAddressedCache
+
+
+class TestContentAddressedCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_put(self):
+        cache = ContentAddressedCache(self.directory)
+        key = cache.key('config', 'some text')
+        self.assertEqual(key, cache.key('config', 'some text'))
+        self.assertNotEqual(key, cache.key('configsome', ' text'))
+
+        self.assertIsNone(cache.get(key))
+        cache.put(key, ['value', 1])
+        self.assertIn(key, cache)
+        self.assertEqual(cache.get(key), ['value', 1])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evict_least_recently_used(self):
+        cache = ContentAddressedCache(self.directory, max_size_in_bytes=None)
+        keys = [cache.key(str(i)) for i in range(4)]
+        for i, key in enumerate(keys):
+            cache.put(key, 'x' * 100)
+            os.utime(cache._path(key), (i, i))
+
+        entry_size = os.path.getsize(cache._path(keys[0]))
+        cache.evict(2 * entry_size)
+
+        self.assertEqual([key in cache for key in keys], [False, False, True, True])
+        self.assertEqual(cache.size(), 2 * entry_size)
+
+    def test_size_bound_on_put(self):
+        cache = ContentAddressedCache(self.directory, max_size_in_bytes=1000)
+        for i in range(20):
+            cache.put(cache.key(str(i)), 'x' * 100)
+        self.assertLessEqual(cache.size(), 1000)
+
+    def test_size_on_overwrite(self):
+        cache = ContentAddressedCache(self.directory, max_size_in_bytes=1000)
+        key = cache.key('overwritten')
+        for _ in range(20):
+            cache.put(key, 'x' * 100)
+        cache.put(cache.key('other'), 'x' * 100)
+        self.assertEqual(cache._size, cache.size())
+        self.assertIn(key, cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from nalaf.structures.data import Document, Part
+from nalaf.utils.scheduling import LengthBucketedScheduler
+
+
+def create_document(size):
+    document = Document()
+    document.parts['p1'] = Part('x' * size)
+    return document
+
+
+class TestLengthBucketedScheduler(unittest.TestCase):
+    def setUp(self):
+        sizes = [200] * 40 + [80000, 50000] + [1000] * 10
+        self.items = [('doc_{}'.format(i), create_document(size)) for i, size in enumerate(sizes)]
+
+    def test_schedule_covers_all_documents_once(self):
+        chunks = LengthBucketedScheduler(workers=4).schedule(self.items)
+        keys = [key for chunk in chunks for key, _ in chunk]
+        self.assertEqual(sorted(keys), sorted(key for key, _ in self.items))
+
+    def test_largest_first(self):
+        scheduler = LengthBucketedScheduler(workers=4)
+        chunks = scheduler.schedule(self.items)
+        self.assertEqual([key for key, _ in chunks[0]], ['doc_40'])
+        self.assertEqual([key for key, _ in chunks[1]], ['doc_41'])
+
+        costs = [sum(scheduler.estimate_cost(document) for _, document in chunk) for chunk in chunks]
+        self.assertEqual(costs, sorted(costs, reverse=True))
+
+    def test_chunk_size(self):
+        chunks = LengthBucketedScheduler(workers=1, chunk_size=3).schedule(self.items)
+        self.assertTrue(all(len(chunk) <= 3 for chunk in chunks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+import tempfile
+import shutil
+import numpy as np
+from nalaf.structures.data import Dataset, Document, Part, Entity, Edge, Token, Label
+from nalaf.utils.sparse import CSRMatrix, EdgeMatrix, TokenMatrix
+
+
+class TestCSRMatrix(unittest.TestCase):
+    def test_products(self):
+        # [[1, 0, 2], [0, 0, 0], [0, 3, 0]]
+        matrix = CSRMatrix([1, 2, 3], [0, 2, 1], [0, 2, 2, 3])
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertEqual(matrix.dot(np.array([1.0, 2.0, 3.0])).tolist(), [7, 0, 6])
+        self.assertEqual(matrix.transpose_dot(np.array([1.0, 2.0, 3.0])).tolist(), [1, 9, 2])
+        # the columns beyond the vector are taken as zero
+        self.assertEqual(matrix.dot(np.array([1.0, 2.0])).tolist(), [1, 0, 6])
+
+    def test_row_block(self):
+        matrix = CSRMatrix([1, 2, 3], [0, 2, 1], [0, 2, 2, 3])
+        block = matrix.row_block(1, 3)
+        self.assertEqual(block.shape, (2, 3))
+        self.assertEqual(block.dot(np.array([1.0, 2.0, 3.0])).tolist(), [0, 6])
+        self.assertEqual(matrix.row_block(0, 1).dot(np.array([1.0, 2.0, 3.0])).tolist(), [7])
+
+
+class TestEdgeMatrix(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        self.dataset = Dataset()
+        for doc_id, features in [('doc_1', [{1: 1, 4: 0.5}, {2: 1}]), ('doc_2', []), ('doc_3', [{3: 1}])]:
+            part = Part('A B')
+            for edge_features in features:
+                edge = Edge(Entity('e_1', 0, 'A'), Entity('e_2', 2, 'B'), 'r_1', [], 0, part)
+                edge.features = edge_features
+                edge.target = 1
+                part.edges.append(edge)
+            other = Edge(Entity('e_1', 0, 'A'), Entity('e_3', 2, 'B'), 'r_2', [], 0, part)
+            other.features = {5: 1}
+            part.edges.append(other)
+            self.dataset.documents[doc_id] = Document()
+            self.dataset.documents[doc_id].parts['abstract'] = part
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export(self):
+        edges = EdgeMatrix.export(self.dataset, 'r_1', num_columns=10)
+        self.assertEqual(edges.matrix.shape, (3, 10))
+        self.assertEqual(edges.matrix.indptr.tolist(), [0, 2, 3, 4])
+        self.assertEqual(edges.matrix.indices.tolist(), [1, 4, 2, 3])
+        self.assertEqual(edges.matrix.data.tolist(), [1, 0.5, 1, 1])
+        self.assertEqual(edges.targets.tolist(), [1, 1, 1])
+        self.assertEqual(edges.parts, [('doc_1', 'abstract'), ('doc_3', 'abstract')])
+        self.assertEqual(edges.rows.tolist(), [[0, 0], [0, 1], [1, 0]])
+
+        self.assertEqual(len(EdgeMatrix.export(self.dataset)), 6)
+
+    def test_save_load(self):
+        edges = EdgeMatrix.export(self.dataset, 'r_1')
+        edges.save(self.directory)
+
+        loaded = EdgeMatrix.load(self.directory)
+        self.assertIsInstance(loaded.matrix.data, np.memmap)
+        for name in CSRMatrix.ARRAYS:
+            self.assertEqual(getattr(loaded.matrix, name).tolist(), getattr(edges.matrix, name).tolist())
+        self.assertEqual(loaded.matrix.num_columns, 5)
+        self.assertIsNone(loaded.edges)
+
+        # the predictions are written back to the same edges
+        self.assertEqual(loaded.resolve(self.dataset), edges.edges)
+        loaded.write_targets(np.array([-1, 1, -1]))
+        self.assertEqual([edge.target for edge in self.dataset.edges()], [-1, 1, None, None, -1, None])
+
+
+class TestTokenMatrix(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        self.dataset = Dataset()
+        part = Part('c.A100G was found. It is bad.')
+        sentences = [[('c.A100G', 'B-e_2'), ('was', 'O'), ('found', 'O')], [('It', 'O'), ('is', None), ('bad', 'O')]]
+        part.sentences = []
+        for sentence in sentences:
+            part.sentences.append([])
+            for word, label in sentence:
+                token = Token(word, part.text.index(word))
+                token.features['word'] = word.lower()
+                token.features['length'] = len(word)
+                if label is not None:
+                    token.original_labels = [Label(label)]
+                part.sentences[-1].append(token)
+        self.dataset.documents['doc_1'] = Document()
+        self.dataset.documents['doc_1'].parts['abstract'] = part
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export_vocabulary(self):
+        tokens = TokenMatrix.export(self.dataset)
+        self.assertEqual(tokens.matrix.shape, (6, 7))
+        self.assertEqual(list(tokens.vocabulary)[:3], ['word[0]:c.a100g', 'length[0]', 'word[0]:was'])
+        self.assertEqual(tokens.matrix.indptr.tolist(), [0, 2, 4, 6, 8, 10, 12])
+        self.assertEqual(tokens.matrix.data[:2].tolist(), [1, 7])
+        self.assertEqual(tokens.labels.tolist(), [0, 1, 1, 1, -1, 1])
+        self.assertEqual(tokens.label_names, ['B-e_2', 'O'])
+        self.assertEqual(tokens.offsets.tolist(), [0, 3, 6])
+        self.assertEqual(tokens.sentence_lengths().tolist(), [3, 3])
+        self.assertEqual(tokens.label_counts().tolist(), [1, 4])
+        self.assertEqual(tokens.column_counts()[tokens.vocabulary['length[0]']], 6)
+        self.assertEqual(tokens.column_counts('B-e_2')[tokens.vocabulary['length[0]']], 1)
+
+        # a frozen vocabulary drops the unseen attributes
+        frozen = TokenMatrix.export(self.dataset, vocabulary={'length[0]': 0}, frozen=True, indicator=True,
+                                    label_names=['O'])
+        self.assertEqual(frozen.matrix.shape, (6, 1))
+        self.assertEqual(frozen.matrix.data.tolist(), [1] * 6)
+        self.assertEqual(frozen.labels.tolist(), [-1, 0, 0, 0, -1, 0])
+
+    def test_export_hashed(self):
+        tokens = TokenMatrix.export(self.dataset, hash_bits=4)
+        self.assertIsNone(tokens.vocabulary)
+        self.assertEqual(tokens.matrix.num_columns, 16)
+        self.assertTrue((tokens.matrix.indices < 16).all())
+        # the same attribute is always the same column
+        self.assertEqual(tokens.matrix.indices[1], tokens.matrix.indices[3])
+        self.assertEqual(TokenMatrix.export(self.dataset, hash_bits=4).matrix.indices.tolist(),
+                         tokens.matrix.indices.tolist())
+
+    def test_save_load(self):
+        tokens = TokenMatrix.export(self.dataset)
+        tokens.save(self.directory)
+
+        loaded = TokenMatrix.load(self.directory)
+        self.assertIsInstance(loaded.labels, np.memmap)
+        self.assertEqual(loaded.vocabulary, tokens.vocabulary)
+        self.assertEqual(loaded.label_names, tokens.label_names)
+        self.assertEqual(loaded.labels.tolist(), tokens.labels.tolist())
+        self.assertEqual(loaded.offsets.tolist(), tokens.offsets.tolist())
+        self.assertEqual(loaded.matrix.data.tolist(), tokens.matrix.data.tolist())
+        self.assertEqual(loaded.label_counts().tolist(), tokens.label_counts().tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()